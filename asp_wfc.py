@@ -9,6 +9,7 @@ from world_rando import asp_wave_collapse
 from rom_tools.rom_manager import RomManager
 from rom_tools import rom_data_structures
 from rom_tools import graphics
+from rom_tools.compress import compression_cache
 
 # If a level is larger than this, it won't be reconfigured, since
 # grounding the ASP model will take ages
@@ -242,6 +243,7 @@ def get_args(arg_list):
     parser = argparse.ArgumentParser(description="Build new rooms for Super Metroid using wavefunction collapse!")
     parser.add_argument("--revert", action="store_true", help="Reset altered rooms to their original state")
     parser.add_argument("--compile", action="store_true", help="Compile the generated rooms from the output folder into a rom")
+    parser.add_argument("--compress_cache", default=None, help="Folder to keep compressed level data in between runs")
     args = parser.parse_args(arg_list)
     return args
 
@@ -252,7 +254,7 @@ def revert():
     clean_rom = RomManager(rom_clean_path, "../roms/sm_foo.smc")
     revert_rom = RomManager(rom2_path, rom0_path)
     print("Parsing...")
-    clean_names = clean_rom.parse()
+    clean_names = clean_rom.parse(snapshot=True)
     revert_names = revert_rom.parse()
     print("Resetting rooms...")
     # Reverted ROM should have the same /pattern/ of names as existing
@@ -279,7 +281,7 @@ def make_data():
     random.seed(0)
     rom = RomManager(rom_clean_path, rom2_path)
     print("Parsing...")
-    obj_names = rom.parse()
+    obj_names = rom.parse(snapshot=True)
     print("Collapsing...")
     computed_files = set(get_computed_files())
     for args in wfc_args:
@@ -304,7 +306,7 @@ def make_data():
 def rom_compile():
     print("Parsing...")
     rom = RomManager(rom_clean_path, rom2_path)
-    obj_names = rom.parse()
+    obj_names = rom.parse(snapshot=True)
     print("Reading level data...")
     # Find the level data - should be .p files in the output folder
     for obj_path in get_computed_files():
@@ -323,6 +325,8 @@ def rom_compile():
 
 if __name__ == "__main__":
     args = get_args(sys.argv[1:])
+    if args.compress_cache is not None:
+        compression_cache.level_data_cache = compression_cache.CompressionCache(cache_dir=args.compress_cache)
     if args.revert:
         revert()
     elif args.compile:
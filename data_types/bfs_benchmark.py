@@ -0,0 +1,73 @@
+# Times the ConstraintGraph searches on the whole vanilla map
+# (every room in rooms.txt, hooked up by the vanilla exits in exits.txt)
+# Run from the repository root with:
+# python -m data_types.bfs_benchmark
+import sys
+import time
+
+from encoding import parse_rooms, sm_global
+from data_types.constraintgraph import ConstraintGraph, BFSState, BFSItemsState, Door
+from data_types.item_set import ItemSet
+from data_types.orderedset import OrderedSet
+from door_rando.alg_support import dummy_exit_graph, get_fixed_items, get_starting_assignments
+
+def vanilla_graph(room_file="encoding/dsl/rooms.txt", exits_file="encoding/dsl/exits.txt"):
+    """Builds the vanilla map as a single ConstraintGraph"""
+    rooms = parse_rooms.load_rooms(room_file)
+    exits = parse_rooms.parse_exits(exits_file)
+    graph = ConstraintGraph()
+    for room in rooms.values():
+        graph.add_subgraph(room.graph)
+    connected = set()
+    for door1, door2 in exits.items():
+        if (door2, door1) in connected:
+            continue
+        if door1 not in graph.name_node or door2 not in graph.name_node:
+            continue
+        if not isinstance(graph.name_node[door1].data, Door) or not isinstance(graph.name_node[door2].data, Door):
+            continue
+        graph.connect_doors(door1, door2)
+        connected.add((door1, door2))
+    return graph
+
+def time_it(name, f, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = f()
+        best = min(best, time.perf_counter() - start)
+    print("{:<45} {:>10.2f} ms".format(name, best * 1000))
+    return result
+
+def room_searches(rooms, fixed_items):
+    """Searches every room from every entrance the way choose_progress_exit does"""
+    n_states = 0
+    wildcards = OrderedSet(["Item_Dummy1", "Item_Dummy2"])
+    for room in rooms.values():
+        room_graph, _ = dummy_exit_graph(room.graph, room.doors)
+        for doors in room.doors.values():
+            for door in doors:
+                state = BFSItemsState(door, wildcards, ItemSet(["MB"]), get_starting_assignments())
+                _, finished, _, _ = room_graph.BFS_items(state, None, fixed_items)
+                n_states += len(finished)
+    return n_states
+
+def run(repeats=5):
+    graph = vanilla_graph()
+    print("Vanilla graph: {} nodes, {} edges".format(len(graph.name_node), sum(1 for _ in graph.edges)))
+    start = BFSState("Landing_Site_L2", ItemSet())
+    statues = BFSState("Statues_ET", ItemSet())
+    time_it("check_completability (to Statues_ET)", lambda: graph.check_completability(start, statues), repeats)
+    escape = BFSState("Escape_4_R", ItemSet(sm_global.items + sm_global.bosses))
+    landing_site = BFSState("Landing_Site_L2", ItemSet(sm_global.items + sm_global.bosses))
+    time_it("check_completability (escape)", lambda: graph.check_completability(escape, landing_site), repeats)
+    frozen = time_it("freeze", graph.freeze, repeats)
+    time_it("frozen check_completability (to Statues_ET)", lambda: frozen.check_completability(start, statues), repeats)
+    time_it("frozen check_completability (escape)", lambda: frozen.check_completability(escape, landing_site), repeats)
+    rooms = parse_rooms.load_rooms("encoding/dsl/rooms.txt")
+    n_states = time_it("BFS_items (every room, every door)", lambda: room_searches(rooms, get_fixed_items()), repeats)
+    print("BFS_items states: {}".format(n_states))
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    run(repeats)
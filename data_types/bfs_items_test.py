@@ -0,0 +1,145 @@
+# Checks that pruning dominated states from BFS_items doesn't change what the search can reach,
+# on the graphs from door_rando/alg_test.py and on every room from every door,
+# and that continuing a search after adding rooms reaches the same states as a new BFS_items.
+# Run from the repository root with:
+# python -m data_types.bfs_items_test
+import collections
+import random
+
+from encoding import parse_rooms
+from data_types.constraintgraph import BFSItemsState
+from data_types.item_set import ItemSet
+from data_types.orderedset import OrderedSet
+from door_rando.alg_support import dummy_exit_graph, get_fixed_items, get_starting_assignments, door_hookups
+
+def by_node(finished):
+    states = collections.defaultdict(list)
+    for state in finished:
+        states[state.node].append(state)
+    return states
+
+def check_pruning(graph, start_state, fixed_items):
+    """Every state that the unpruned search finds is dominated by a state of the pruned search,
+    and every state of the pruned search is dominated by one that the unpruned search finds"""
+    _, pruned, _, _ = graph.BFS_items(start_state, fixed_items=fixed_items)
+    _, unpruned, _, _ = graph.BFS_items(start_state, fixed_items=fixed_items, prune=False)
+    pruned_states = by_node(pruned)
+    unpruned_states = by_node(unpruned)
+    assert pruned_states.keys() == unpruned_states.keys(), start_state.node
+    for node, states in unpruned_states.items():
+        for state in states:
+            assert any(state <= other for other in pruned_states[node]), state
+    for node, states in pruned_states.items():
+        for state in states:
+            assert any(state <= other for other in unpruned_states[node]), state
+    return len(pruned), len(unpruned)
+
+def check_same_states(finished, other_finished):
+    """Every state of each search is dominated by a state of the other one at the same node"""
+    states = by_node(finished)
+    other_states = by_node(other_finished)
+    assert states.keys() == other_states.keys()
+    for node, node_states in states.items():
+        for state in node_states:
+            assert any(state <= other for other in other_states[node]), state
+    for node, node_states in other_states.items():
+        for state in node_states:
+            assert any(state <= other for other in states[node]), state
+
+def check_extension(graph, start_state, door1, door2, room_graph, fixed_items):
+    """Adds room_graph at door1 and checks that the search kept on the graph, continued from the doors that
+    were connected, gives the same result as a new BFS_items"""
+    search = graph.items_search(start_state, fixed_items)
+    graph.add_room(door1, door2, room_graph)
+    assert graph.items_search(start_state, fixed_items) is search
+    _, fresh, _, _ = graph.BFS_items(start_state, fixed_items=fixed_items)
+    check_same_states(search.finished, fresh)
+
+def check_overlay(graph, start_state, door, fixed_items):
+    """An overlay sees the edges to a new node, its parent only does after it is committed"""
+    search = graph.items_search(start_state, fixed_items)
+    before = list(search.finished)
+    graph.add_node("Overlay_Test")
+    graph.add_edge(door, "Overlay_Test")
+    overlay = search.overlay()
+    overlay.extend()
+    assert any(state.node == "Overlay_Test" for state in overlay.finished)
+    assert list(search.finished) == before
+    after = list(overlay.finished)
+    overlay.commit()
+    assert list(search.finished) == after
+    _, fresh, _, _ = graph.BFS_items(start_state, fixed_items=fixed_items)
+    check_same_states(search.finished, fresh)
+    graph.remove_node("Overlay_Test")
+
+def check_room_chain(rooms, seed, n_rooms, fixed_items):
+    """Grows a map from Landing_Site one random room at a time, the way the door randomizer does,
+    checking the extended search after each room"""
+    rand = random.Random(seed)
+    door_room = {door: name for name, room in rooms.items() for doors in room.doors.values() for door in doors}
+    graph, exits = dummy_exit_graph(rooms["Landing_Site"].graph, rooms["Landing_Site"].doors)
+    used_rooms = {"Landing_Site"}
+    start_state = BFSItemsState("Landing_Site_L2", OrderedSet(), ItemSet(), {})
+    for _ in range(n_rooms):
+        exit_door = rand.choice(exits)[:-len("dummy")]
+        direction = next(d for d, doors in rooms[door_room[exit_door]].doors.items() if exit_door in doors)
+        room_name, door = rand.choice([(name, door) for name, room in sorted(rooms.items()) if name not in used_rooms
+                                       for door in room.doors.get(door_hookups[direction], [])
+                                       if room.graph.name_node[door].data.items is not None])
+        room_graph, room_exits = dummy_exit_graph(rooms[room_name].graph, rooms[room_name].doors)
+        room_graph.remove_node(door + "dummy")
+        graph.remove_node(exit_door + "dummy")
+        exits.remove(exit_door + "dummy")
+        exits.extend(e for e in room_exits if e != door + "dummy")
+        used_rooms.add(room_name)
+        check_extension(graph, start_state, exit_door, door, room_graph, fixed_items)
+
+if __name__ == "__main__":
+    rooms = parse_rooms.load_rooms("encoding/dsl/rooms.txt")
+    fixed_items = get_fixed_items()
+
+    wz = rooms["Warehouse_Zeelas"]
+    wz_graph, _ = dummy_exit_graph(wz.graph, wz.doors)
+    check_pruning(wz_graph, BFSItemsState("Warehouse_Zeelas_L2", OrderedSet(["Item_Dummy", "Item_Dummy1"]), ItemSet(), {}), fixed_items)
+
+    ls = rooms["Landing_Site"]
+    ls_graph, _ = dummy_exit_graph(ls.graph, ls.doors)
+    check_pruning(ls_graph, BFSItemsState("Landing_Site_L2", OrderedSet(["Item_Dummy"]), ItemSet(), {}), fixed_items)
+
+    fm = rooms["First_Missile"]
+    fm_graph, _ = dummy_exit_graph(fm.graph, fm.doors)
+    check_pruning(fm_graph, BFSItemsState("First_Missile_R", OrderedSet(), ItemSet(), {}), fixed_items)
+
+    # Items found in one room used in another
+    ls_graph.remove_node("Landing_Site_L2dummy")
+    fm_graph.remove_node("First_Missile_Rdummy")
+    ls_graph.add_room("Landing_Site_L2", "First_Missile_R", fm_graph)
+    check_pruning(ls_graph, BFSItemsState("Landing_Site_L2", OrderedSet(), ItemSet(), {}), fixed_items)
+
+    # The same, continuing the search on Landing_Site
+    ls_graph, _ = dummy_exit_graph(ls.graph, ls.doors)
+    fm_graph, _ = dummy_exit_graph(fm.graph, fm.doors)
+    ls_graph.remove_node("Landing_Site_L2dummy")
+    fm_graph.remove_node("First_Missile_Rdummy")
+    check_extension(ls_graph, BFSItemsState("Landing_Site_L2", OrderedSet(), ItemSet(), {}),
+                    "Landing_Site_L2", "First_Missile_R", fm_graph, fixed_items)
+    check_overlay(ls_graph, BFSItemsState("Landing_Site_L2", OrderedSet(), ItemSet(), {}), "First_Missile_R", fixed_items)
+
+    for seed in range(5):
+        check_room_chain(rooms, seed, 8, fixed_items)
+
+    kraid = rooms["Kraid"]
+    kraid_graph, _ = dummy_exit_graph(kraid.graph, kraid.doors)
+    check_pruning(kraid_graph, BFSItemsState("Kraid_L", OrderedSet(), ItemSet(["CB"]), {}), fixed_items)
+
+    # Every room from every door, the way choose_progress_exit searches them
+    n_pruned, n_unpruned = 0, 0
+    for room in rooms.values():
+        room_graph, _ = dummy_exit_graph(room.graph, room.doors)
+        for doors in room.doors.values():
+            for door in doors:
+                state = BFSItemsState(door, OrderedSet(["Item_Dummy1", "Item_Dummy2"]), ItemSet(["MB"]), get_starting_assignments())
+                pruned, unpruned = check_pruning(room_graph, state, fixed_items)
+                n_pruned += pruned
+                n_unpruned += unpruned
+    print("{} states with pruning, {} without".format(n_pruned, n_unpruned))
@@ -31,10 +31,11 @@
 #TODO: re-implement using networkx and cached graphs at different item thresholds?
 
 import collections
+import copy
 import random
 
 from data_types.minsetset import MinSetSet
-from data_types.item_set import ItemSet
+from data_types.item_set import ItemSet, item_mapping, mask_len, mask_items
 from data_types.orderedset import OrderedSet
 
 infinity = float("inf")
@@ -43,7 +44,9 @@ infinity = float("inf")
 #TODO: alter graph so that the edge list is part of the node data structure?
 #TODO: alter graph so that node ID is an index into the graph? (faster hashing?)
 # I wish Python had abstract data types :(
+# States are never modified by the searches, so they can be shared between offers without copying.
 class BFSState(object):
+    __slots__ = ["node", "items"]
 
     def __init__(self, node_, items_=ItemSet()):
         self.node = node_
@@ -68,6 +71,7 @@ class BFSState(object):
         return self.node + "\n" + str(self.items) + "\n"
 
 class BFSItemsState(object):
+    __slots__ = ["node", "items", "wildcards", "assignments"]
 
     #TODO: argument order??
     def __init__(self, node_, wildcards_=OrderedSet(), items_=ItemSet(), assignments_={}):
@@ -81,7 +85,7 @@ class BFSItemsState(object):
 
     # Two states are equal if they can cross the same set of edges
     def __eq__(self, other):
-        return self.node == other.node and self.items == other.items and len(self.wildcards) == len(other.wildcards)
+        return self.node == other.node and self.items.num == other.items.num and len(self.wildcards) == len(other.wildcards)
 
     # An item set is leq another if it has at most the same items and at most the same number of wildcards
     def __le__(self, other):
@@ -99,7 +103,7 @@ class BFSItemsState(object):
 
     # Only the number of wildcards matters
     def __hash__(self):
-        return hash((self.node, len(self.wildcards), self.items))
+        return hash((self.node, len(self.wildcards), self.items.num))
 
     # Does other make progress relative to self?
     # If it's at another node with maybe better items
@@ -119,6 +123,8 @@ class ConstraintGraph(object):
         self.name_node = {}
         self.node_edges = {}
         self.nnodes = 0
+        # The last ItemsSearch made by items_search, which is told about changes to the graph
+        self.last_items_search = None
 
     def add_node(self, name=None, node_data=None):
         # name is the ID value - need something to hash the node by.
@@ -135,6 +141,8 @@ class ConstraintGraph(object):
     def add_edge(self, start, end, items=MinSetSet()):
         assert start in self.name_node, "Node does not exist: " + start
         assert end in self.name_node, "Node does not exist: " + end
+        if self.last_items_search is not None:
+            self.last_items_search.edges_changed(start)
         # check if an edge already exists: if it does, and their sets
         for edge in self.node_edges[start]:
             if edge.terminal == end:
@@ -153,6 +161,9 @@ class ConstraintGraph(object):
         for index, edge in enumerate(self.node_edges[node1]):
             if edge.terminal == node2:
                 del self.node_edges[node1][index]
+                # Searches can't take back states that needed the edge
+                if self.last_items_search is not None:
+                    self.last_items_search.stale = True
                 return
         assert False, "No such edge: " + node1 + " -> " + node2
 
@@ -167,6 +178,8 @@ class ConstraintGraph(object):
 
     def remove_node(self, node):
         assert node in self.name_node, "Node does not exist: " + node
+        if self.last_items_search is not None:
+            self.last_items_search.node_removed(node, len(self.node_edges[node]) == 0)
         del self.name_node[node]
         del self.node_edges[node]
         indices_to_remove = {}
@@ -185,23 +198,18 @@ class ConstraintGraph(object):
         always beneficial."""
         n = 0
 
-        # key - node name
-        # key - item set
+        # key - (node name, item mask)
         # value - state predecessor
-        offers = collections.defaultdict(lambda: {})
-
-        # key - node_name
-        # value - set of item sets
-        finished = collections.defaultdict(set)
+        offer_table = {}
 
         final_state = None
 
         # queue to hold node, item pairs
-        queue = [start_state]
+        queue = collections.deque([start_state])
 
         while len(queue) > 0:
             n += 1
-            state = queue.pop(0).copy()
+            state = queue.popleft()
             #if n % 10000 == 0:
             #    print(n)
             #    print(state)
@@ -214,166 +222,84 @@ class ConstraintGraph(object):
             # make an offer to pick up an item or defeat a boss
             node_data = self.name_node[node].data
             if isinstance(node_data, Item) or isinstance(node_data, Boss):
-                new_items = items | ItemSet([node_data.type])
+                new_mask = items.num | item_mapping[node_data.type]
                 # if we haven't already visited this node with the new item set...
-                if new_items not in finished[node]:
-                    offers[node][new_items] = state.copy()
-                    finished[node].add(new_items)
+                if (node, new_mask) not in offer_table:
+                    offer_table[(node, new_mask)] = state
                     # don't have to make a new queue item - pick up the item/boss is the only option
                     # the following for-loop handles creating the new queue items...
-                    items = new_items
+                    items = ItemSet(num_=new_mask)
+            items_mask = items.num
             # make an offer to every adjacent node reachable with this item set
             for edge in self.node_edges[node]:
-                if edge.items.matches(items) and edge_pred((node, edge.terminal)):
+                if edge.items.matches_mask(items_mask) and edge_pred((node, edge.terminal)):
                     # if we haven't already visited terminal with those items...
-                    if items not in finished[edge.terminal]:
-                        offers[edge.terminal][items] = state.copy()
-                        finished[edge.terminal].add(items)
-                        queue.append(BFSState(edge.terminal, items))       
+                    if (edge.terminal, items_mask) not in offer_table:
+                        offer_table[(edge.terminal, items_mask)] = state
+                        queue.append(BFSState(edge.terminal, items))
+        offers, finished = split_offer_table(offer_table)
         return offers, finished, final_state is not None, final_state
 
     def BFS_target(self, start_state, end_state=None):
         #TODO: review this - does it really process every combo only once?
-        # key - node name
-        # key - item set
+        # key - (node name, item mask)
         # value - state predecessor
-        offers = collections.defaultdict(lambda: {})
-
-        # key - node name
-        # value - item set
-        finished = collections.defaultdict(set)
+        offer_table = {}
 
         final_state = None
 
         # queue to hold node, item pairs
-        queue = [start_state]
+        queue = collections.deque([start_state])
 
         while len(queue) > 0:
-            state = queue.pop(0).copy()
+            state = queue.popleft()
             # we've reached the goal with at least the right items
             if end_state is not None and start_state >= end_state:
                 final_state = state
                 break
             node = state.node
             items = state.items
+            items_mask = items.num
             # make an offer to every adjacent node reachable with this item set
             for edge in self.node_edges[node]:
-                if edge.items.matches(items):
+                if edge.items.matches_mask(items_mask):
                     # if we haven't already visited terminal with those items...
-                    if items not in finished[edge.terminal]:
-                        offers[edge.terminal][items] = state
-                        finished[edge.terminal].add(items)
+                    if (edge.terminal, items_mask) not in offer_table:
+                        offer_table[(edge.terminal, items_mask)] = state
                         queue.append(BFSState(edge.terminal, items))
             # make an offer to pick up an item or defeat a boss
             node_data = self.name_node[node].data
             if isinstance(node_data, Item) or isinstance(node_data, Boss):
-                new_items = items | ItemSet([node_data.type])
+                new_mask = items_mask | item_mapping[node_data.type]
                 # if we haven't already visited this node with the new item set...
-                if new_items not in finished[node]:
-                    offers[node][new_items] = state
-                    finished[node].add(new_items)
-                    queue.append(BFSState(node, new_items))
+                if (node, new_mask) not in offer_table:
+                    offer_table[(node, new_mask)] = state
+                    queue.append(BFSState(node, ItemSet(num_=new_mask)))
+        offers, finished = split_offer_table(offer_table)
         return offers, finished, final_state is not None, final_state
 
-    def BFS_items(self, start_state, end_state=None, fixed_items=ItemSet()):
+    def BFS_items(self, start_state, end_state=None, fixed_items=ItemSet(), prune=True):
         """Finds a satsifying assignment of items to reach end from start. finished[end] will wind up with
         a list of (unassigned but reached items, item set needed, and possible item assignments). Each assignment
         is a dictionary, where key = item node name, and value = string value for item assigned there. Currently does
-        not allow items to be fixed, but an already-assigned items dictionary can be passed."""
-
-        #TODO: I think there's a way to make finished store less stuff - after all, we are only interested in keeping the
-        # elements with a maximal NUMBER of wildcards for each item set.
-        # Set of BFSItemsState
-        # Ordered so that you can randomly choose from it without relying
-        # on the internal hash function which is randomly salted.
-        finished = OrderedSet()
-
-        # Key - BFSItemsState (antecessor)
-        # Value - BFSItemsState (predecessor)
-        offers = {}
-
-        # what items we actually needed to reach the end...
-        final_state = None
-
-        queue = [start_state]
-
-        # queue search terms are:
-        #       - node name
-        #       - wildcard set
-        #       - item set
-        #       - assignment dictionary - key: item node, value: type assigned there
-        # however two search terms are equal if the number of wildcards and the
-        # obtained items are the same - that's why finished just includes the number
-        # - add start node to the finished list
-        #finished[start_state.node][start_state.items].append((start_state.wildcards.copy(), start_state.assignments.copy()))
-        finished.add(start_state)
-        while len(queue) > 0:
-            state = queue.pop(0)
-            #print("State: {}".format(state))
-            node = state.node
-            wildcards = state.wildcards
-            items = state.items
-            assignments = state.assignments
-            if end_state is not None and state >= end_state:
-                final_state = state
-                break
-            node_data = self.name_node[node].data
-            # In addition to fixed items, pass an assigments list and check it
-            if isinstance(node_data, Item):
-                # If we don't already have this item, pick it up as a wildcard
-                if node not in wildcards and node not in assignments:
-                    new_state = BFSItemsState(node, wildcards | set([state.node]), items, assignments)
-                    if new_state not in finished:
-                        finished.add(new_state)
-                        offers[new_state] = state
-                        queue.append(new_state)
-                    # There's no need to process edges - picking up that item won't prevent you from crossing an edge
-                    continue
-                # If we don't have the item but it was already assigned, pick it up as a fixed item
-                elif node in assignments and assignments[node] not in items:
-                    new_state = BFSItemsState(node, wildcards, items | ItemSet([assignments[node]]), assignments)
-                    if new_state not in finished:
-                        finished.add(new_state)
-                        offers[new_state] = state
-                        queue.append(new_state)
-                    continue
-            elif isinstance(node_data, Boss):
-                # If we haven't defeated this boss yet, do so (as a fixed item)
-                if node_data.type not in items:
-                    new_state = BFSItemsState(node, wildcards, items | ItemSet([node_data.type]), assignments)
-                    if new_state not in finished:
-                        finished.add(new_state)
-                        offers[new_state] = state
-                        queue.append(new_state)
-                    # There's no need to process edges - defeating that boss will allow you to cross strictly more edges
-                    continue
-            # Now cross edges
-            for edge in self.node_edges[state.node]:
-                # For each set, use some wildcards to cross it, then add that node with those assignments to the queue
-                for item_set in edge.items.sets:
-                    # Items in item set that we don't already have
-                    need_items = item_set - items
-                    #print("Need items: {}".format(need_items))
-                    # Can cross the edge if we have enough wildcards to satisfy need_items and there are no fixed items that we do not already have (i.e. bosses)
-                    if len(need_items) <= len(wildcards) and len(need_items & fixed_items) == 0:
-                        #print("Can cross")
-                        wildcards_copy = wildcards.copy()
-                        items_copy = state.items.copy()
-                        assignments_copy = assignments.copy()
-                        # Make an assignment that allows crossing that edge
-                        for item in need_items:
-                            # Get the last available wildcard -> the latest one the player got.
-                            wildcard = wildcards_copy.pop()
-                            assignments_copy[wildcard] = item
-                            items_copy = items_copy.add(item)
-                        new_state = BFSItemsState(edge.terminal, wildcards_copy, items_copy, assignments_copy)
-                        #print("Items: {}, wildcards: {}".format(items_copy, wildcards_copy))
-                        # If there's not already an entry for this item set with at least as many wildcards, then add it
-                        if new_state not in finished:
-                            finished.add(new_state)
-                            offers[new_state] = state
-                            queue.append(new_state)
-        return offers, finished, final_state is not None, final_state
+        not allow items to be fixed, but an already-assigned items dictionary can be passed.
+        With prune=False, dominated states are kept and searched too (see data_types/bfs_items_test.py)."""
+        search = ItemsSearch(self, start_state, fixed_items, prune)
+        final_state = search.run(end_state)
+        return search.offers, search.finished, final_state is not None, final_state
+
+    def items_search(self, start_state, fixed_items=ItemSet()):
+        """Gets the BFS_items search from start_state as an ItemsSearch. The last search is kept on the graph,
+        and if it can be used for start_state (see ItemsSearch.move_start), it is continued from the nodes
+        that gained edges since, instead of searching the whole graph again."""
+        search = self.last_items_search
+        if search is None or search.stale or search.fixed_items.num != fixed_items.num or not search.move_start(start_state):
+            search = ItemsSearch(self, start_state, fixed_items)
+            self.last_items_search = search
+            search.run()
+        else:
+            search.extend()
+        return search
 
     #TODO: is this really useful?
     def check_completability(self, start_state, end_state):
@@ -458,16 +384,24 @@ class ConstraintGraph(object):
         self.add_subgraph(room_graph)
         self.connect_doors(door1, door2)
 
-    def copy(self):
-        """returns a copy of self - pointers to data might still be entangled"""
+    def copy(self, copy_data=False):
+        """returns a copy of self - pointers to data might still be entangled unless copy_data is set.
+        Edge constraints are never modified in place, so they are always shared."""
         new_graph = ConstraintGraph()
         for node_name, node in self.name_node.items():
-            new_graph.add_node(node_name, node.data)
+            data = copy.copy(node.data) if copy_data else node.data
+            new_graph.name_node[node_name] = ConstraintNode(node_name, data)
+        # self has no duplicate edges, so there is no need to go through add_edge
         for node_name, node_edges in self.node_edges.items():
-            for edge in node_edges:
-                new_graph.add_edge(node_name, edge.terminal, edge.items)
+            new_graph.node_edges[node_name] = [ConstraintEdge(edge.terminal, edge.items) for edge in node_edges]
+        new_graph.nnodes = len(new_graph.name_node)
         return new_graph
 
+    def freeze(self):
+        """returns a FrozenConstraintGraph compiled from self, for fast searching.
+        The frozen graph is a snapshot - later changes to self are not reflected in it."""
+        return FrozenConstraintGraph(self)
+
     def __repr__(self):
         self_str = ""
         for node_name, edges in self.node_edges.items():
@@ -487,6 +421,429 @@ class ConstraintGraph(object):
             for e in edges:
                 yield n, e
 
+class ItemsSearch(object):
+    """A BFS_items search that is kept after it finishes, so that it can be continued when edges are added to the
+    graph instead of searching the whole graph again (see ConstraintGraph.items_search).
+    finished and offers are the same as the ones BFS_items returns.
+    An overlay is a search layered on top of another one, which leaves the other one unchanged until it is
+    committed - for trying out edges that might be removed again."""
+
+    def __init__(self, graph, start_state, fixed_items=ItemSet(), prune=True, parent=None):
+        self.graph = graph
+        # The state the search started from
+        self.root = start_state
+        # The state the search is used for - see move_start()
+        self.start_state = start_state
+        # The states from start_state to the root's node, if they are different
+        self.start_path = []
+        self.fixed_items = fixed_items
+        self.prune = prune
+        self.parent = parent
+        if parent is None:
+            # Set of BFSItemsState
+            # Ordered so that you can randomly choose from it without relying
+            # on the internal hash function which is randomly salted.
+            # Unless prune is False, only states that are not dominated are kept - see search()
+            self.finished = OrderedSet()
+            # Key - BFSItemsState (antecessor)
+            # Value - BFSItemsState (predecessor)
+            self.offers = {}
+            # Key - node name
+            # Value - list of (items mask, number of wildcards, BFSItemsState) for the states in finished at that node.
+            # No state in the list is dominated by another one.
+            self.frontier = {}
+            # The nodes whose outgoing edges changed since the search was last brought up to date
+            # (a dict, so that the order doesn't depend on string hashing)
+            self.changed_nodes = {}
+        else:
+            self.root = parent.root
+            self.start_state = parent.start_state
+            self.start_path = parent.start_path
+            self.finished = OverlaySet(parent.finished)
+            self.offers = collections.ChainMap({}, parent.offers)
+            self.frontier = collections.ChainMap({}, parent.frontier)
+            # The graph only tells the parent about changes
+            self.changed_nodes = parent.changed_nodes
+        # Set when the graph changes in a way that the search can't be continued over
+        self.stale = False
+
+    def run(self, end_state=None):
+        """Searches from the start state. Returns the first state that reaches end_state, or None."""
+        # queue search terms are:
+        #       - node name
+        #       - wildcard set
+        #       - item set
+        #       - assignment dictionary - key: item node, value: type assigned there
+        # however two search terms are equal if the number of wildcards and the
+        # obtained items are the same - that's why finished just includes the number
+        # - add start node to the finished list
+        self.finished.add(self.root)
+        self.frontier[self.root.node] = [(self.root.items.num, len(self.root.wildcards), self.root)]
+        return self.search(collections.deque([self.root]), end_state)
+
+    def extend(self):
+        """Continues the search over the edges added to the graph since it was last brought up to date.
+        Only the states at the nodes that gained edges can cross a new edge - everything else was already expanded."""
+        assert not self.stale
+        queue = collections.deque()
+        for node in self.changed_nodes:
+            for _, _, state in self.frontier.get(node, ()):
+                queue.append(state)
+        self.search(queue, None)
+        if self.parent is None:
+            self.changed_nodes.clear()
+
+    def overlay(self):
+        """Gets a search on top of this one, which can be extended without changing this one"""
+        assert self.parent is None
+        return ItemsSearch(self.graph, self.start_state, self.fixed_items, self.prune, parent=self)
+
+    def commit(self):
+        """Makes the parent of an overlay the same as the overlay"""
+        parent = self.parent
+        self.finished.commit()
+        parent.offers.update(self.offers.maps[0])
+        parent.frontier.update(self.frontier.maps[0])
+        parent.changed_nodes.clear()
+
+    def edges_changed(self, node):
+        self.changed_nodes[node] = None
+
+    def node_removed(self, node, sink):
+        """Forgets the states at a node that is being removed from the graph.
+        Unless nothing can be reached from the node, the states reached through it have to be searched again."""
+        self.changed_nodes.pop(node, None)
+        states = self.frontier.get(node, ())
+        if len(states) == 0:
+            return
+        if not sink:
+            self.stale = True
+            return
+        for _, _, state in states:
+            self.finished.discard(state)
+        self.frontier[node] = []
+
+    def move_start(self, start_state):
+        """Uses this search for start_state, which has to be reachable from the state the search started from.
+        That gives the same result as searching from start_state when start_state has the same items, wildcards and
+        assignments as the root, and can get back to the root's node without picking anything up or using a wildcard:
+        then they can reach exactly the same states. Returns whether start_state can use this search."""
+        if start_state is self.start_state:
+            return True
+        root = self.root
+        if start_state.items.num != root.items.num or list(start_state.wildcards) != list(root.wildcards) \
+                or start_state.assignments != root.assignments:
+            return False
+        path = self.plain_path(start_state, root.node)
+        if path is None:
+            return False
+        self.start_state = start_state
+        self.start_path = [BFSItemsState(node, start_state.wildcards, start_state.items, start_state.assignments) for node in path[:-1]]
+        return True
+
+    def plain_path(self, state, end):
+        """The nodes on a path from state to end that doesn't pick anything up or use a wildcard, or None"""
+        graph = self.graph
+        items_mask = state.items.num
+        assignments = state.assignments
+        offers = {state.node: None}
+        queue = collections.deque([state.node])
+        while len(queue) > 0:
+            node = queue.popleft()
+            if node == end:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = offers[node]
+                return path[::-1]
+            # BFS_items doesn't cross edges from a node with something to pick up
+            node_data = graph.name_node[node].data
+            if isinstance(node_data, Item):
+                if node not in state.wildcards and node not in assignments:
+                    continue
+                if node in assignments and item_mapping[assignments[node]] & ~items_mask != 0:
+                    continue
+            elif isinstance(node_data, Boss) and item_mapping[node_data.type] & ~items_mask != 0:
+                continue
+            for edge in graph.node_edges[node]:
+                if edge.terminal not in offers and edge.items.matches_mask(items_mask):
+                    offers[edge.terminal] = node
+                    queue.append(edge.terminal)
+        return None
+
+    def path_to(self, state):
+        """The states from the start state to state"""
+        return self.start_path + bfs_items_backtrack(self.root, state, self.offers)
+
+    def search(self, queue, end_state):
+        """The BFS_items main loop. Expands the states in queue, adding to finished and offers.
+        Returns the first state that reaches end_state, or None."""
+        # what items we actually needed to reach the end...
+        final_state = None
+        finished = self.finished
+        offers = self.offers
+        frontier = self.frontier
+        prune = self.prune
+        fixed_items = self.fixed_items
+
+        # A state dominates another at the same node if it has a superset of its items, at least as many wildcards,
+        # and has used up no item node that the other can still pick up (as a wildcard or as an assigned item).
+        # Then it can cross every edge the other can, using no more wildcards, and pick up every item
+        # the other can, so the other one doesn't need to be searched.
+        # Comparing only the items and the number of wildcards would not be enough: the other state
+        # could still reach an item node that the dominating one used as a wildcard, and gain a wildcard there.
+        # States that are equal (see BFSItemsState.__eq__) are merged regardless, just like without pruning.
+        def used_nodes(state):
+            return state.assignments.keys() | state.wildcards
+
+        def offer(new_state, state):
+            if not prune:
+                if new_state not in finished:
+                    frontier[new_state.node] = list(frontier.get(new_state.node, ())) + [(new_state.items.num, len(new_state.wildcards), new_state)]
+                    finished.add(new_state)
+                    offers[new_state] = state
+                    queue.append(new_state)
+                return
+            new_mask = new_state.items.num
+            new_wildcards = len(new_state.wildcards)
+            node_frontier = frontier.get(new_state.node, ())
+            for mask, n_wildcards, old_state in node_frontier:
+                if new_mask | mask == mask and new_wildcards <= n_wildcards:
+                    if (new_mask == mask and new_wildcards == n_wildcards) or used_nodes(old_state) <= used_nodes(new_state):
+                        return
+            # Drop the states that the new one dominates
+            kept = []
+            for entry in node_frontier:
+                mask, n_wildcards, old_state = entry
+                if new_mask | mask == new_mask and n_wildcards <= new_wildcards and used_nodes(new_state) <= used_nodes(old_state):
+                    finished.discard(old_state)
+                else:
+                    kept.append(entry)
+            kept.append((new_mask, new_wildcards, new_state))
+            frontier[new_state.node] = kept
+            finished.add(new_state)
+            offers[new_state] = state
+            queue.append(new_state)
+
+        while len(queue) > 0:
+            state = queue.popleft()
+            # Dominated after it was queued
+            if state not in finished:
+                continue
+            #print("State: {}".format(state))
+            node = state.node
+            wildcards = state.wildcards
+            items = state.items
+            assignments = state.assignments
+            if end_state is not None and state >= end_state:
+                final_state = state
+                break
+            node_data = self.graph.name_node[node].data
+            # In addition to fixed items, pass an assigments list and check it
+            if isinstance(node_data, Item):
+                # If we don't already have this item, pick it up as a wildcard
+                if node not in wildcards and node not in assignments:
+                    new_state = BFSItemsState(node, wildcards | set([state.node]), items, assignments)
+                    offer(new_state, state)
+                    # There's no need to process edges - picking up that item won't prevent you from crossing an edge
+                    continue
+                # If we don't have the item but it was already assigned, pick it up as a fixed item
+                elif node in assignments and assignments[node] not in items:
+                    new_state = BFSItemsState(node, wildcards, ItemSet(num_=items.num | item_mapping[assignments[node]]), assignments)
+                    offer(new_state, state)
+                    continue
+            elif isinstance(node_data, Boss):
+                # If we haven't defeated this boss yet, do so (as a fixed item)
+                if node_data.type not in items:
+                    new_state = BFSItemsState(node, wildcards, ItemSet(num_=items.num | item_mapping[node_data.type]), assignments)
+                    offer(new_state, state)
+                    # There's no need to process edges - defeating that boss will allow you to cross strictly more edges
+                    continue
+            # Now cross edges
+            items_mask = items.num
+            n_wildcards = len(wildcards)
+            fixed_mask = fixed_items.num
+            for edge in self.graph.node_edges[state.node]:
+                # For each set, use some wildcards to cross it, then add that node with those assignments to the queue
+                for set_mask in edge.items.masks:
+                    # Items in item set that we don't already have
+                    need_mask = set_mask & ~items_mask
+                    # Can cross the edge if we have enough wildcards to satisfy need_items and there are no fixed items that we do not already have (i.e. bosses)
+                    if need_mask == 0:
+                        # No wildcards used - the new state can share them with this one
+                        new_state = BFSItemsState(edge.terminal, wildcards, items, assignments)
+                        offer(new_state, state)
+                    elif mask_len(need_mask) <= n_wildcards and need_mask & fixed_mask == 0:
+                        wildcards_copy = wildcards.copy()
+                        assignments_copy = assignments.copy()
+                        # Make an assignment that allows crossing that edge
+                        for item in mask_items(need_mask):
+                            # Get the last available wildcard -> the latest one the player got.
+                            wildcard = wildcards_copy.pop()
+                            assignments_copy[wildcard] = item
+                        new_state = BFSItemsState(edge.terminal, wildcards_copy, ItemSet(num_=items_mask | need_mask), assignments_copy)
+                        #print("Items: {}, wildcards: {}".format(items_copy, wildcards_copy))
+                        # If there's not already an entry for this node with at least these items and as many wildcards, then add it
+                        offer(new_state, state)
+        return final_state
+
+class OverlaySet(object):
+    """The finished set of an overlay ItemsSearch: a set on top of an OrderedSet, which leaves the OrderedSet
+    unchanged. States added to it are kept separately, and states discarded from the OrderedSet are hidden.
+    It iterates in the same order as the OrderedSet would after the same changes."""
+
+    def __init__(self, base):
+        self.base = base
+        self.added = OrderedSet()
+        self.hidden = set()
+
+    def __contains__(self, key):
+        return key in self.added or (key in self.base and key not in self.hidden)
+
+    def __len__(self):
+        return len(self.base) - len(self.hidden) + len(self.added)
+
+    def __iter__(self):
+        for key in self.base:
+            if key not in self.hidden:
+                yield key
+        yield from self.added
+
+    def add(self, key):
+        if key not in self:
+            self.added.add(key)
+
+    def discard(self, key):
+        if key in self.added:
+            self.added.discard(key)
+        elif key in self.base:
+            self.hidden.add(key)
+
+    def commit(self):
+        """Makes the changes to the OrderedSet"""
+        for key in self.hidden:
+            self.base.discard(key)
+        for key in self.added:
+            self.base.add(key)
+
+class FrozenConstraintGraph(object):
+    """A read-only ConstraintGraph compiled for searching. Nodes are integer ids (indices into node_names),
+    and the edges are in CSR form: the edges leaving node i are edge_starts[i] to edge_starts[i+1]-1,
+    with terminals in edge_terminals and the item masks of the edge's MinSetSet in edge_masks.
+    States are single ints: (item mask << node_bits) | node id.
+    Every item node must have an item assigned."""
+
+    def __init__(self, graph):
+        self.node_names = list(graph.name_node.keys())
+        self.node_index = {name: index for index, name in enumerate(self.node_names)}
+        self.node_bits = max(len(self.node_names) - 1, 1).bit_length()
+        # The item mask picked up at each node, or None if the node has no item or boss
+        self.pickup_masks = []
+        self.edge_starts = [0]
+        self.edge_terminals = []
+        self.edge_masks = []
+        for name in self.node_names:
+            node_data = graph.name_node[name].data
+            if isinstance(node_data, Item) or isinstance(node_data, Boss):
+                self.pickup_masks.append(item_mapping[node_data.type])
+            else:
+                self.pickup_masks.append(None)
+            for edge in graph.node_edges[name]:
+                self.edge_terminals.append(self.node_index[edge.terminal])
+                self.edge_masks.append(edge.items.masks)
+            self.edge_starts.append(len(self.edge_terminals))
+
+    def state_key(self, state):
+        return (state.items.num << self.node_bits) | self.node_index[state.node]
+
+    def key_state(self, key):
+        return BFSState(self.node_names[key & ((1 << self.node_bits) - 1)], ItemSet(num_=key >> self.node_bits))
+
+    def search(self, start_state, end_state=None):
+        """The search from ConstraintGraph.BFS_optimized, over state keys.
+        Returns the offer table (key - state key, value - predecessor state key),
+        the first state key offered that satisfies end_state (or None), and the state key that reached end_state (or None)."""
+        node_bits = self.node_bits
+        node_mask = (1 << node_bits) - 1
+        pickup_masks = self.pickup_masks
+        edge_starts = self.edge_starts
+        edge_terminals = self.edge_terminals
+        edge_masks = self.edge_masks
+        if end_state is None:
+            end_node = -1
+            end_items = 0
+        else:
+            end_node = self.node_index[end_state.node]
+            end_items = end_state.items.num
+
+        # key - state key
+        # value - predecessor state key
+        offer_table = {}
+        # the first offer that is good enough for end_state - this is the one bfs_backtrack would use
+        end_key = None
+        final_key = None
+
+        queue = collections.deque([self.state_key(start_state)])
+        while len(queue) > 0:
+            key = queue.popleft()
+            node = key & node_mask
+            items_mask = key >> node_bits
+            # we've reached the goal with at least the right items
+            if node == end_node and items_mask & end_items == end_items:
+                final_key = key
+                break
+            # make an offer to pick up an item or defeat a boss
+            pickup_mask = pickup_masks[node]
+            if pickup_mask is not None:
+                new_key = key | (pickup_mask << node_bits)
+                if new_key not in offer_table:
+                    offer_table[new_key] = key
+                    if end_key is None and node == end_node and (items_mask | pickup_mask) & end_items == end_items:
+                        end_key = new_key
+                    items_mask |= pickup_mask
+            # make an offer to every adjacent node reachable with this item set
+            items_key = items_mask << node_bits
+            for edge in range(edge_starts[node], edge_starts[node + 1]):
+                for set_mask in edge_masks[edge]:
+                    if items_mask & set_mask == set_mask:
+                        terminal = edge_terminals[edge]
+                        new_key = items_key | terminal
+                        if new_key not in offer_table:
+                            offer_table[new_key] = key
+                            queue.append(new_key)
+                            if end_key is None and terminal == end_node and items_mask & end_items == end_items:
+                                end_key = new_key
+                        break
+        return offer_table, end_key, final_key
+
+    def BFS_optimized(self, start_state, end_state=None):
+        """Same as ConstraintGraph.BFS_optimized, with the same return values"""
+        offer_table, _, final_key = self.search(start_state, end_state)
+        state_table = {}
+        for key, pred_key in offer_table.items():
+            node_items = (self.node_names[key & ((1 << self.node_bits) - 1)], key >> self.node_bits)
+            state_table[node_items] = self.key_state(pred_key)
+        offers, finished = split_offer_table(state_table)
+        final_state = None if final_key is None else self.key_state(final_key)
+        return offers, finished, final_state is not None, final_state
+
+    def check_completability(self, start_state, end_state):
+        """Same as ConstraintGraph.check_completability - the path of node names from start_state to end_state, or None"""
+        offer_table, end_key, final_key = self.search(start_state, end_state)
+        if final_key is None:
+            return None
+        assert end_key is not None, "Backtrack: no path to reach " + end_state.node
+        start_key = self.state_key(start_state)
+        path = []
+        key = end_key
+        # loop from the end state until we reach the start state
+        while key != start_key:
+            path.append(self.node_names[key & ((1 << self.node_bits) - 1)])
+            key = offer_table[key]
+        path.append(start_state.node)
+        path.reverse()
+        return path
+
 class ConstraintEdge(object):
 
     def __init__(self, terminal, items=MinSetSet()):
@@ -543,6 +900,11 @@ class Room(object):
         self.doors = doors
         self.item_nodes = item_nodes
 
+    def copy(self):
+        """returns a copy of self that can be changed without affecting self"""
+        doors = collections.defaultdict(list, {direction: door_list[:] for direction, door_list in self.doors.items()})
+        return Room(self.name, self.mem_address, self.graph.copy(copy_data=True), doors, self.item_nodes[:])
+
     def dictify(self, exits):
         g = self.graph
         nodes = list([node_rel_name(node) for node in g.nodes])
@@ -582,6 +944,22 @@ class Room(object):
             "Doors": doors}
         return d
 
+def split_offer_table(offer_table):
+    """Converts an offer table keyed by (node, item mask) into the offers and finished dictionaries
+       returned by BFS_opt and BFS_target."""
+    # key - node name
+    # key - item set
+    # value - state predecessor
+    offers = collections.defaultdict(lambda: {})
+    # key - node_name
+    # value - set of item sets
+    finished = collections.defaultdict(set)
+    for (node, mask), state in offer_table.items():
+        items = ItemSet(num_=mask)
+        offers[node][items] = state
+        finished[node].add(items)
+    return offers, finished
+
 #TODO: fix this for normal offers
 # offers:
 # key - node
@@ -0,0 +1,53 @@
+# Checks that FrozenConstraintGraph finds the same paths as the ConstraintGraph it was made from,
+# on every room from every door and on the vanilla map.
+# Run from the repository root with:
+# python -m data_types.frozen_graph_test
+from encoding import parse_rooms, sm_global
+from data_types.constraintgraph import BFSState
+from data_types.item_set import ItemSet
+from data_types.bfs_benchmark import vanilla_graph
+
+def check_same_path(graph, frozen, start_state, end_state):
+    """Both graphs give the same check_completability result"""
+    path = graph.check_completability(start_state, end_state)
+    assert frozen.check_completability(start_state, end_state) == path, (start_state, end_state)
+    return path
+
+def check_same_tables(graph, frozen, start_state, end_state=None):
+    """Both graphs give the same BFS_optimized results"""
+    offers, finished, found, final_state = graph.BFS_optimized(start_state, end_state)
+    frozen_offers, frozen_finished, frozen_found, frozen_final_state = frozen.BFS_optimized(start_state, end_state)
+    assert found == frozen_found
+    assert final_state == frozen_final_state
+    assert dict(finished) == dict(frozen_finished)
+    assert {node: dict(node_offers) for node, node_offers in offers.items()} == \
+        {node: dict(node_offers) for node, node_offers in frozen_offers.items()}
+
+if __name__ == "__main__":
+    rooms = parse_rooms.load_rooms("encoding/dsl/rooms.txt")
+    all_items = ItemSet(sm_global.items + sm_global.bosses)
+    n_paths, n_no_paths = 0, 0
+    for room in rooms.values():
+        frozen = room.graph.freeze()
+        doors = [door for doors in room.doors.values() for door in doors]
+        for items in [ItemSet(), all_items]:
+            for door in doors:
+                start_state = BFSState(door, items)
+                check_same_tables(room.graph, frozen, start_state)
+                # The start state isn't in the offers, so the start door can't be the target
+                for end_door in [end_door for end_door in doors if end_door != door]:
+                    # all_items as the end items can only be reached by picking everything up
+                    for end_items in [items, all_items]:
+                        if check_same_path(room.graph, frozen, start_state, BFSState(end_door, end_items)) is None:
+                            n_no_paths += 1
+                        else:
+                            n_paths += 1
+    print("{} paths found, {} impossible".format(n_paths, n_no_paths))
+
+    # The searches check_layout makes
+    graph = vanilla_graph()
+    frozen = graph.freeze()
+    assert check_same_path(graph, frozen, BFSState("Landing_Site_L2", ItemSet()), BFSState("Statues_ET", ItemSet())) is not None
+    escape = BFSState("Escape_4_R", all_items)
+    assert check_same_path(graph, frozen, escape, BFSState("Landing_Site_L2", all_items)) is not None
+    check_same_tables(graph, frozen, escape)
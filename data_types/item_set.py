@@ -1,7 +1,7 @@
 # 36 items -> 64 bit set?
 # does python guarantee storage in 64 bit integers rather than some weird thing?
-#TODO: doing a hashtable lookup every time is slow
-#TODO: maybe not have a class? dealing with copy is sad
+# Inner loops (graph searches, MinSetSet.matches) should use the mask functions below
+# on plain ints instead of ItemSet objects, to avoid a lookup and an allocation per operation.
 item_mapping = {
     "B" : 1,
     "PB" : 1 << 1,
@@ -41,12 +41,40 @@ item_mapping = {
     "Statues" : 1 << 35,
 }
 
+# Mask -> item, for the masks of single items
+mask_item = {mask: item for item, mask in item_mapping.items()}
+
+# Number of items in a mask
+if hasattr(int, "bit_count"):
+    mask_len = int.bit_count
+else:
+    def mask_len(mask):
+        return bin(mask).count("1")
+
+def items_mask(item_list):
+    """Get the mask for a list of items"""
+    mask = 0
+    for item in item_list:
+        mask |= item_mapping[item]
+    return mask
+
+def mask_items(mask):
+    """Get the items in a mask, in the same order as ItemSet.to_list"""
+    items = []
+    while mask:
+        # Lowest set bit
+        bit = mask & -mask
+        items.append(mask_item[bit])
+        mask ^= bit
+    return items
+
 class ItemSet(object):
+    __slots__ = ["num"]
 
     def __init__(self, item_list=[], num_=0):
-        self.num = num_
         for item in item_list:
-            self.num |= item_mapping[item]
+            num_ |= item_mapping[item]
+        self.num = num_
 
     # modification
     def add(self, item):
@@ -55,21 +83,19 @@ class ItemSet(object):
     def remove(self, item):
         item_mask = item_mapping[item]
         assert self.num & item_mask != 0, "Item Set: cannot remove an element not in set"
-        return ItemSet(num=self.num & (~item_mask))
+        return ItemSet(num_=self.num & (~item_mask))
 
     # set union
     def __or__(self, other):
-       return ItemSet([], self.num | other.num)
+       return ItemSet(num_=self.num | other.num)
 
     # set intersection
     def __and__(self, other):
-        return ItemSet([], self.num & other.num)
+        return ItemSet(num_=self.num & other.num)
 
     # set minus
     def __sub__(self, other):
-        diff = self.num ^ other.num
-        diff = diff & self.num
-        return ItemSet([], diff)
+        return ItemSet(num_=self.num & ~other.num)
 
     # comparison
     def __eq__(self, other):
@@ -101,23 +127,18 @@ class ItemSet(object):
         return hash(self.num)
 
     # cardinality
-    # sketch af
     def __len__(self):
-        return bin(self.num).count("1")
+        return mask_len(self.num)
 
     # iterating over the items means you want the item values (strings)
     def __iter__(self):
         return iter(self.to_list())
 
     def to_list(self):
-        slist = []
-        for item, mask in item_mapping.items():
-            if self.num & mask != 0:
-                slist.append(item)
-        return slist
+        return mask_items(self.num)
 
     def copy(self):
-        return ItemSet([], self.num)
+        return ItemSet(num_=self.num)
 
     def __repr__(self):
         return "ISet(" + str(self.to_list()) + ")"
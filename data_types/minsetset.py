@@ -14,6 +14,9 @@ class MinSetSet:
 			self.sets = set([ItemSet()])
 		else:
 			self.sets = set_
+		# The item masks of the sets, in the same order as iterating over self.sets.
+		# MinSetSets are never changed in place, so this never goes stale.
+		self.masks = tuple(self_set.num for self_set in self.sets)
 
 	def __add__(self, other):
 		"""OR the two minsetsets together. Either you have a set from one,
@@ -33,8 +36,12 @@ class MinSetSet:
 	def matches(self, items):
 		"""Is items good enough to pass self? All sets in self are valid ways
 		to pass. Is items a superset of any of them?"""
-		for self_set in self.sets:
-			if items >= self_set:
+		return self.matches_mask(items.num)
+
+	def matches_mask(self, items_mask):
+		"""Same as matches, but for an item mask (see item_set.py)."""
+		for mask in self.masks:
+			if items_mask & mask == mask:
 				return True
 		return False
 
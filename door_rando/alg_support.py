@@ -191,9 +191,11 @@ def door_direction(door_name):
     """get the direction letter for a door node"""
     return door_name.split("_")[-1].rstrip("0123456789")
 
-def check_backtrack(graph, current_state, backtrack_node, dummy_exits, fixed_items):
+def check_backtrack(graph, current_state, backtrack_node, dummy_exits, search):
     """
     Temporarily connects a backtrack and performs a search as if that backtrack existed
+    search is the ItemsSearch from current_state without the backtrack. It is extended across the new edges
+    in an overlay instead of searching the whole graph again - commit the overlay if the backtrack is used.
     """
     # Pretend like they are connected - remove their dummy nodes from the list of dummies...
     # Make a shallow copy first - if it turns out that backtracking was a bad decision, we need the original
@@ -214,10 +216,11 @@ def check_backtrack(graph, current_state, backtrack_node, dummy_exits, fixed_ite
         graph.add_edge(backtrack_node, intermediate, backtrack_node_constraints)
         graph.add_edge(intermediate, current_state.node)
     # Find the reachable exits under the new scheme (start from current node, to ensure you can get to backtrack exit)
-    backtrack_offers, backtrack_finished, _, _ = graph.BFS_items(current_state, fixed_items=fixed_items)
-    backtrack_exits = [s for s in backtrack_finished if s.node in dummy_copy]
+    backtrack_search = search.overlay()
+    backtrack_search.extend()
+    backtrack_exits = [s for s in backtrack_search.finished if s.node in dummy_copy]
     # Return the intermediate so that the alg can remove it if this backtrack wasn't used
-    return backtrack_offers, backtrack_exits, dummy_copy, intermediate
+    return backtrack_search, backtrack_exits, dummy_copy, intermediate
 
 def augment_offers(offers, other_offers):
     """
@@ -0,0 +1,85 @@
+import collections
+import dbm
+import hashlib
+import shelve
+
+# Results of the completability checks, keyed by a hash of everything they depend on.
+# Recently used results are kept in memory, and optionally in a shelf on disk so that
+# re-runs and batch jobs can reuse results from earlier runs.
+
+def layout_key(room_file_hash, doubleboss, door_changes, item_changes, start_state, escape_items):
+    """Get the cache key for the completability checks of a layout.
+    door_changes is kept in order: the order that doors were connected in determines the
+    order of the edges in the graph, and so which path the search finds.
+    The order of item_changes doesn't matter, so it is sorted."""
+    key_parts = [
+        room_file_hash,
+        doubleboss,
+        list(door_changes),
+        sorted(item_changes),
+        start_state.node,
+        start_state.items.num,
+        escape_items.num,
+    ]
+    return hashlib.sha256(repr(key_parts).encode()).hexdigest()
+
+class CompletabilityCache(object):
+
+    def __init__(self, max_size=256, shelf_file=None, read_only=False):
+        # key -> (path to statues, escape path), least recently used first
+        self.memory = collections.OrderedDict()
+        self.max_size = max_size
+        self.shelf = None
+        if shelf_file is not None:
+            if not read_only:
+                self.shelf = shelve.open(shelf_file, flag="c")
+            # A read-only shelf is only useful if some earlier run made it
+            elif dbm.whichdb(shelf_file):
+                self.shelf = shelve.open(shelf_file, flag="r")
+        self.read_only = read_only
+        # The results put into a read-only cache, for a process that can write the shelf to save
+        self.unsaved = []
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.memory or (self.shelf is not None and key in self.shelf)
+
+    def get(self, key):
+        """Get the cached result for key, or None if it isn't cached"""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+        if self.shelf is not None and key in self.shelf:
+            value = self.shelf[key]
+            self.remember(key, value)
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.remember(key, value)
+        if self.read_only:
+            self.unsaved.append((key, value))
+        elif self.shelf is not None:
+            self.shelf[key] = value
+
+    def take_unsaved(self):
+        """Get the results put into a read-only cache since the last call, as (key, value) pairs"""
+        unsaved = self.unsaved
+        self.unsaved = []
+        return unsaved
+
+    def remember(self, key, value):
+        """Put key in the in-memory LRU only"""
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def close(self):
+        if self.shelf is not None:
+            self.shelf.close()
+            self.shelf = None
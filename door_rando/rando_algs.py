@@ -170,11 +170,10 @@ def item_quota_rando(rooms, debug, starting_items, items_to_place):
 
     #TODO: maybe doing this places too many items too early?
     while len(rooms_to_place) > 0:
-        # To record the current state and remember the path
-        start_state = current_state.copy()
         # Wildcard BFS to find reachable exits
-        bfs_tree, bfs_finished, _, _ = current_graph.BFS_items(current_state, None, fixed_items)
-        reachable_exits = [s for s in bfs_finished if s.node in dummy_exits]
+        # The search is kept on the graph, and continued over the new room when that gives the same result
+        search = current_graph.items_search(current_state, fixed_items)
+        reachable_exits = [s for s in search.finished if s.node in dummy_exits]
         #print(reachable_exits)
 
         #TODO: Consider multiple backtracks?
@@ -185,12 +184,13 @@ def item_quota_rando(rooms, debug, starting_items, items_to_place):
         # If we haven't already connected the current exit and if there is a valid backtracking exit
         if current_state.node in exits_to_connect[current_direction] and len(exits_to_connect[door_hookups[current_direction]]) > 0:
             backtrack_exit = random.choice(exits_to_connect[door_hookups[current_direction]])
-            backtrack_o, backtrack_finished, dummy_copy, intermediate = check_backtrack(current_graph, current_state, backtrack_exit, dummy_exits, fixed_items)
+            backtrack_search, backtrack_finished, dummy_copy, intermediate = check_backtrack(current_graph, current_state, backtrack_exit, dummy_exits, search)
 
             #TODO: greater than or equal to?
             #TODO: how much of this should be in check_backtracks? technically all of this could be moved
             # If there are more reachable exits by backtracking, do so!
             if len(backtrack_finished) > len(reachable_exits):
+                backtrack_search.commit()
                 # Those dummy exits aren't there anymore
                 # Remove the actual dummy exits from the graph
                 if current_state.node + "dummy" in dummy_exits:
@@ -206,7 +206,6 @@ def item_quota_rando(rooms, debug, starting_items, items_to_place):
                 door_changes.append((current_state.node, backtrack_exit))
                 # Set reachable exits we got from backtracking
                 reachable_exits = backtrack_finished
-                bfs_tree = backtrack_o
                 if debug:
                     print("\tBacktrack connecting {} to {}".format(current_state.node, backtrack_exit))
             # Otherwise, repair the damage to the graph and keep going
@@ -307,7 +306,7 @@ def item_quota_rando(rooms, debug, starting_items, items_to_place):
                 print_progress_bar(nrooms_placed, nrooms, prefix=progress_prefix)
             found = True
             # The last element will always be a dummy node
-            path_to_room = bfs_items_backtrack(start_state, exit_state, bfs_tree)[:-1]
+            path_to_room = search.path_to(exit_state)[:-1]
             n_path_to_room = [s.node for s in path_to_room]
             path_in_room = bfs_items_backtrack(entrance_state, current_state, chosen_o)
             n_path_in_room = [s.node for s in path_in_room]
@@ -0,0 +1,79 @@
+# Generates many door randomizer seeds in one process.
+# Parsed rooms and encoding files, and the clean rom, are only loaded once,
+# and each rom and spoiler file is written as soon as its seed is done.
+import sys
+import time
+from pathlib import Path
+
+import door_rando_main
+from door_rando_main import find_layout, write_spoiler, make_rom, open_completability_cache, make_worker_pool
+from door_rando import settings
+from data_types.item_set import ItemSet
+from encoding import sm_global
+from misc import rng, settings_parse
+
+def get_args(arg_list):
+    parser = door_rando_main.make_parser()
+    parser.description = "Generate many Super Metroid door randomizer seeds at once. " \
+        "The roms are named after --create, with the number of the seed added: a.sfc -> a_0.sfc, a_1.sfc, ..."
+    parser.add_argument("--count", metavar="<n>", type=int, required=False, help="Generate n seeds, derived from --seed.")
+    parser.add_argument("--seeds", metavar="<filename>", required=False, help="A file with one seed per line to generate.")
+    args = parser.parse_args(arg_list)
+    door_rando_main.check_args(parser, args)
+    if (args.count is None) == (args.seeds is None):
+        parser.error("use exactly one of --count and --seeds")
+    return args
+
+def batch_seeds(args):
+    """The list of seeds to generate"""
+    if args.seeds is not None:
+        with open(args.seeds) as f:
+            return [line.strip() for line in f if line.strip() != ""]
+    base_seed = rng.seed_rng(args.seed)
+    return [rng.derive_seed(base_seed, i) for i in range(args.count)]
+
+def rom_name(create, index):
+    """The file name for the index-th rom"""
+    create = Path(create)
+    return str(create.with_name("{}_{}{}".format(create.stem, index, create.suffix)))
+
+def main(arg_list):
+    args = get_args(arg_list)
+    # Hijack stdout for output
+    if args.logfile is not None:
+        sys.stdout = open(args.logfile, "w")
+    # Update the settings from JSON files
+    if args.settings is not None:
+        settings_parse.get_settings(settings.setting_paths, args.settings)
+
+    all_items = ItemSet(sm_global.items[:])
+    starting_items = door_rando_main.parse_starting_items(args.starting_items)
+    items_to_place = settings.items_to_item_list(settings.items)
+    with open(args.clean, "rb") as clean_file:
+        clean_data = clean_file.read()
+
+    open_completability_cache(args)
+    # One pool for every seed, so the worker processes are only started once
+    pool = make_worker_pool(args)
+    out = []
+    total_start = time.perf_counter()
+    for index, seed in enumerate(batch_seeds(args)):
+        start = time.perf_counter()
+        seed, layout = find_layout(args, seed, starting_items, items_to_place, all_items, pool)
+        layout_time = time.perf_counter() - start
+        create = rom_name(args.create, index)
+        write_spoiler(create + ".spoiler.txt", seed, items_to_place, layout)
+        if args.graph:
+            from door_rando import spoiler_graph
+            spoiler_graph.make_spoiler_graph(layout[1], create)
+        make_rom(args, create, layout, clean_data=clean_data)
+        rom_time = time.perf_counter() - start - layout_time
+        print("{} - {}: completable {}, layout {:.2f}s, rom {:.2f}s".format(create, seed, layout[0], layout_time, rom_time))
+        out.append({"seed": str(seed), "rom": create})
+    door_rando_main.close_worker_pool(pool)
+    door_rando_main.completability_cache.close()
+    print("{} seeds in {:.2f}s".format(len(out), time.perf_counter() - total_start))
+    return out
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
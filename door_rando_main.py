@@ -1,7 +1,10 @@
 # Python Imports
 import argparse
+import dbm
+import os
 import sys
 from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 
 # Internal imports
 from encoding import parse_rooms, sm_global
@@ -12,6 +15,7 @@ from door_rando.rando_algs import item_quota_rando
 from door_rando.alg_support import get_fixed_items
 from data_types.item_set import ItemSet
 from data_types.constraintgraph import BFSState
+from door_rando.completability_cache import CompletabilityCache, layout_key
 from misc import rng, settings_parse
 
 #TODO: A better file structure would keep all the rando algorithms that produce door changes and item changes somewhere else
@@ -32,6 +36,9 @@ from misc import rng, settings_parse
 #TODO: timeout for the completability check...
 #TODO: extraneous _int_ nodes make it into the escape path
 
+# Results of the completability checks - see main() for the on-disk shelf
+completability_cache = CompletabilityCache()
+
 #TODO: is there a possibility for a door not to be in door_changes?
 def write_door_changes(door_changes, spoiler_file):
     for left, right in door_changes:
@@ -149,8 +156,7 @@ def pretty_print_out_path(f, out_path):
             current_item_set = item_set
     return
 
-def get_args(arg_list):
-    #print(arg_list)
+def make_parser():
     parser = argparse.ArgumentParser(description="Welcome to the Super Metroid Door randomizer!")
     parser.add_argument("--clean", metavar="<filename>", required=True, help="The path to a clean rom file from the current directory.")
     parser.add_argument("--create", metavar="<filename>", required=True, help="The path to the rom file you want to create.")
@@ -165,89 +171,193 @@ def get_args(arg_list):
     parser.add_argument("--hard_mode", action="store_true", required=False, help="Enables hard mode logic for all rooms.")
     parser.add_argument("--noescape", action="store_true", required=False, help="If set, cannot soft-reset during the escape sequence.")
     parser.add_argument("--logfile", metavar="<filename>", required=False, help="The path to a log file to use for standard out")
+    parser.add_argument("--workers", metavar="<n>", type=int, required=False, help="With --completable, try this many seeds at once in separate processes.")
+    parser.add_argument("--check_cache", metavar="<filename>", required=False, help="A file to keep the results of completability checks in, so that re-runs can reuse them.")
     #TODO argument for which algorithm to use
-    args = parser.parse_args(arg_list)
-    return args
+    return parser
 
-def main(arg_list):
-    args = get_args(arg_list)
-    # Hijack stdout for output
-    if args.logfile is not None:
-        sys.stdout = open(args.logfile, "w")
-    seed = rng.seed_rng(args.seed)
-    spoiler_file = open(args.create + ".spoiler.txt", "w")
-    # Update the settings from JSON files
-    if args.settings is not None:
-        settings_parse.get_settings(settings.setting_paths, args.settings)
+def check_args(parser, args):
+    """Rejects combinations of arguments that make_parser can't"""
+    if args.workers is not None:
+        if not args.completable:
+            parser.error("--workers only applies with --completable")
+        if args.workers < 1:
+            parser.error("--workers must be at least 1")
 
-    # Setup
-    # Copy it to remove Bombs
-    # TODO: GET RID OF Bombs
-    all_items = sm_global.items[:]
-    all_items = ItemSet(all_items)
+def get_args(arg_list):
+    #print(arg_list)
+    parser = make_parser()
+    args = parser.parse_args(arg_list)
+    check_args(parser, args)
+    return args
 
+def check_layout(graph, start_state, escape_items):
+    """Checks whether a layout is completable - whether the statues can be reached from start_state,
+    and then whether it is possible to escape with escape_items. Changes graph to check the escape.
+    Returns the path to the statues and the escape path - either is None if there is no path."""
+    end_state = BFSState("Statues_ET", ItemSet())
+    path_to_statues = graph.freeze().check_completability(start_state, end_state)
+    escape_path = None
+    if path_to_statues is not None:
+        prepare_for_escape(graph)
+        escape_start = BFSState("Escape_4_R", escape_items)
+        escape_end = BFSState("Landing_Site_L2", escape_items)
+        escape_path = graph.freeze().check_completability(escape_start, escape_end)
+    return path_to_statues, escape_path
+
+def generate_layout(args, seed, starting_items, items_to_place, all_items):
+    """Seeds the RNG with seed, then generates a single door and item layout.
+    Returns whether the layout is completable along with the layout itself."""
+    rng.seed_rng(seed)
     escape_timer = 0
-
-    starting_items = parse_starting_items(args.starting_items)
-    items_to_place = settings.items_to_item_list(settings.items)
-
-    completable = False
-    while not completable:
-        #TODO: re-parsing rooms is quick and dirty...
-        if args.hard_mode:
-            rooms = parse_rooms.parse_rooms("encoding/dsl/rooms_hard.txt")
-        else:
-            rooms = parse_rooms.parse_rooms("encoding/dsl/rooms.txt")
-        # Phantoon means an extra L door - mercilessly destroy the maridia map station
-        if args.doubleboss:
-            del rooms["Maridia_Map"]
-        # Remove the double boss rooms
+    if args.hard_mode:
+        room_file = "encoding/dsl/rooms_hard.txt"
+    else:
+        room_file = "encoding/dsl/rooms.txt"
+    # Rooms are only parsed once - every attempt gets its own copy
+    rooms = parse_rooms.load_rooms(room_file)
+    # Phantoon means an extra L door - mercilessly destroy the maridia map station
+    if args.doubleboss:
+        del rooms["Maridia_Map"]
+    # Remove the double boss rooms
+    else:
+        second_boss_rooms = ["Kraid2", "Phantoon2", "Draygon2", "Ridley2"]
+        for boss_room in second_boss_rooms:
+            if boss_room in rooms:
+                del rooms[boss_room]
+    door_changes, item_changes, graph, state, path = item_quota_rando(rooms, args.debug, starting_items, items_to_place[:])
+    # Check completability - can reach statues? can escape?
+    start_state = BFSState(state.node, state.items)
+    # This takes too long
+    #start_state = BFSState("Landing_Site_R2", ItemSet())
+    escape_items = all_items | ItemSet(["Kraid", "Phantoon", "Draygon", "Ridley"])
+    key = layout_key(parse_rooms.room_file_hash(room_file), args.doubleboss, door_changes, item_changes, start_state, escape_items)
+    checked = completability_cache.get(key)
+    if checked is None:
+        checked = check_layout(graph, start_state, escape_items)
+        completability_cache.put(key, checked)
+    path_to_statues, escape_path = checked
+    final_path = path_to_statues
+    completable = path_to_statues is not None
+    if completable:
+        final_path = path + path_to_statues
+        final_path = remove_loops(final_path, starting_items, {k:v for k,v in item_changes})
+        print(final_path[-1])
+        if escape_path is None:
+            completable = False
         else:
-            second_boss_rooms = ["Kraid2", "Phantoon2", "Draygon2", "Ridley2"]
-            for boss_room in second_boss_rooms:
-                if boss_room in rooms:
-                    del rooms[boss_room]
-        door_changes, item_changes, graph, state, path = item_quota_rando(rooms, args.debug, starting_items, items_to_place[:])
-        # Check completability - can reach statues?
-        start_state = BFSState(state.node, state.items)
-        # This takes too long
-        #start_state = BFSState("Landing_Site_R2", ItemSet())
-        end_state = BFSState("Statues_ET", ItemSet())
-        path_to_statues = graph.check_completability(start_state, end_state)
-        final_path = path_to_statues
-        escape_path = None
-        completable = path_to_statues is not None
-        if completable:
-            final_path = path + path_to_statues
-            final_path = remove_loops(final_path, starting_items, {k:v for k,v in item_changes})
-            print(final_path[-1])
-            # Check completability - can escape?
-            items = all_items | ItemSet(["Kraid", "Phantoon", "Draygon", "Ridley"])
-            prepare_for_escape(graph)
-            escape_start = BFSState("Escape_4_R", items)
-            escape_end = BFSState("Landing_Site_L2", items)
-            escape_path = graph.check_completability(escape_start, escape_end)
-            if escape_path is None:
-                completable = False
-            else:
-                # One minute to get out of tourian, then 30 seconds per room
-                #TODO: Is this fair? the player might need to farm and explore...
-                #TODO: Simple node-length means intermediate nodes / etc. will cause problems
-                # give the player time to defeat minibosses, or go through long cutscenes
-                for node in escape_path:
-                    if node in settings.escape:
-                        escape_timer += (settings.escape[node] - 2*settings.escape["per_node"])
-                escape_timer += settings.escape["tourian"] + settings.escape["per_node"] * len(escape_path)
+            # One minute to get out of tourian, then 30 seconds per room
+            #TODO: Is this fair? the player might need to farm and explore...
+            #TODO: Simple node-length means intermediate nodes / etc. will cause problems
+            # give the player time to defeat minibosses, or go through long cutscenes
+            for node in escape_path:
+                if node in settings.escape:
+                    escape_timer += (settings.escape[node] - 2*settings.escape["per_node"])
+            escape_timer += settings.escape["tourian"] + settings.escape["per_node"] * len(escape_path)
+    return completable, door_changes, item_changes, final_path, escape_path, escape_timer
+
+def init_worker(settings_folder, check_cache_file):
+    """Sets up a seed search worker process. Workers do not share the settings
+    of the main process under every start method, and their progress bars
+    would interleave, so their output is discarded.
+    The completability check shelf does not support concurrent writers, so workers only read it,
+    and return the checks they make to the main process to save (see attempt_layout).
+    Some dbm backends can't be read while the main process has the shelf open -
+    then workers only use the checks they made themselves."""
+    global completability_cache
+    if settings_folder is not None:
+        settings_parse.get_settings(settings.setting_paths, settings_folder)
+    completability_cache = CompletabilityCache(read_only=True)
+    if check_cache_file is not None:
+        try:
+            completability_cache = CompletabilityCache(shelf_file=check_cache_file, read_only=True)
+        except dbm.error:
+            pass
+    sys.stdout = open(os.devnull, "w")
+
+def attempt_layout(args, seed, starting_items, items_to_place, all_items):
+    """generate_layout for a worker process. Also returns the completability checks it made,
+    as (key, value) pairs for the main process to put in its cache."""
+    layout = generate_layout(args, seed, starting_items, items_to_place, all_items)
+    return layout, completability_cache.take_unsaved()
+
+def make_worker_pool(args):
+    """Gets the pool of args.workers processes for find_completable_layout,
+    or None if layouts are generated in this process"""
+    if not (args.completable and args.workers is not None):
+        return None
+    return ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.settings, args.check_cache))
+
+def find_completable_layout(args, pool, base_seed, starting_items, items_to_place, all_items):
+    """Runs independent seed attempts on a pool made by make_worker_pool.
+    Attempt i uses the i-th seed derived from base_seed, and the completable
+    attempt with the lowest index wins, so the result only depends on base_seed."""
+    # Keep more attempts in flight than there are workers so that a slow
+    # attempt at the head of the queue does not leave the other workers idle.
+    n_in_flight = 2 * args.workers
+    attempts = deque()
+    next_attempt = 0
+    try:
+        while True:
+            while len(attempts) < n_in_flight:
+                seed = rng.derive_seed(base_seed, next_attempt)
+                future = pool.submit(attempt_layout, args, seed, starting_items, items_to_place, all_items)
+                attempts.append((seed, future))
+                next_attempt += 1
+            seed, future = attempts.popleft()
+            layout, checks = future.result()
+            for key, value in checks:
+                completability_cache.put(key, value)
+            if layout[0]:
+                return seed, layout
+            print("Not Completable: " + seed)
+    finally:
+        # Drop the attempts that can no longer win and haven't started yet.
+        # The running ones can't be stopped without breaking the pool, so they keep their
+        # worker until they finish - close_worker_pool terminates them at the end.
+        for _, future in attempts:
+            future.cancel()
+
+def close_worker_pool(pool):
+    """Shuts down a make_worker_pool pool without waiting for the attempts that are still running.
+    concurrent.futures would join the worker processes at exit, so they are terminated."""
+    if pool is None:
+        return
+    processes = list(pool._processes.values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+def open_completability_cache(args):
+    """Backs the completability cache with the --check_cache shelf.
+    Only the main process writes to it - pool workers send it their checks."""
+    global completability_cache
+    if args.check_cache is not None:
+        completability_cache = CompletabilityCache(shelf_file=args.check_cache)
+
+def find_layout(args, seed, starting_items, items_to_place, all_items, pool=None):
+    """Generates the layout for seed. With --completable, keeps going with new seeds until the layout is completable.
+    pool is the make_worker_pool pool to try the seeds on, if there is one.
+    Returns the seed that was used and the layout."""
+    if pool is not None:
+        return find_completable_layout(args, pool, seed, starting_items, items_to_place, all_items)
+    # The same sequence of seeds as find_completable_layout, so the map doesn't depend on --workers
+    base_seed = seed
+    attempt = 0
+    while True:
+        layout = generate_layout(args, seed, starting_items, items_to_place, all_items)
         # Accept the seed regardless if we don't care about completability
-        if not args.completable:
-            break
-        # Re-seed the rng for a new map (if we need to)
-        if not completable and args.completable:
-            print("Not Completable")
-            seed = rng.seed_rng(None)
-
-    print("Completable: " + str(completable))
-    print("RNG SEED - " + str(seed))
+        if layout[0] or not args.completable:
+            return seed, layout
+        # Try the next seed for a new map (if we need to)
+        print("Not Completable: " + seed)
+        attempt += 1
+        seed = rng.derive_seed(base_seed, attempt)
+
+def write_spoiler(spoiler_name, seed, items_to_place, layout):
+    """Writes the spoiler file for a layout"""
+    completable, door_changes, item_changes, final_path, escape_path, escape_timer = layout
+    spoiler_file = open(spoiler_name, "w")
 
     # Write the seed
     spoiler_file.write("RNG Seed: {}\n".format(str(seed)))
@@ -275,14 +385,14 @@ def main(arg_list):
     write_door_changes(door_changes, spoiler_file)
     spoiler_file.close()
 
-    # Make the spoiler graph
-    if args.graph:
-        from door_rando import spoiler_graph
-        spoiler_graph.make_spoiler_graph(door_changes, args.create)
-
+def make_rom(args, rom_name, layout, clean_data=None):
+    """Makes the randomized rom for a layout from the clean rom.
+    clean_data is the contents of the clean rom, if they have already been read -
+    then the rom is built in memory and written out once at the end."""
+    completable, door_changes, item_changes, final_path, escape_path, escape_timer = layout
     # Now that we have the door changes and the item changes, implement them!
     # First, make the new rom file:
-    rom = RomManager(args.clean, args.create)
+    rom = RomManager(args.clean, rom_name, clean_data=clean_data, in_memory=clean_data is not None)
 
     # Make the rest of the necessary changes
     rom.set_escape_timer(escape_timer)
@@ -308,6 +418,44 @@ def main(arg_list):
     # Save out the rom
     rom.save_and_close()
 
+def main(arg_list):
+    args = get_args(arg_list)
+    # Hijack stdout for output
+    if args.logfile is not None:
+        sys.stdout = open(args.logfile, "w")
+    seed = rng.seed_rng(args.seed)
+    # Update the settings from JSON files
+    if args.settings is not None:
+        settings_parse.get_settings(settings.setting_paths, args.settings)
+
+    # Setup
+    # Copy it to remove Bombs
+    # TODO: GET RID OF Bombs
+    all_items = sm_global.items[:]
+    all_items = ItemSet(all_items)
+
+    starting_items = parse_starting_items(args.starting_items)
+    items_to_place = settings.items_to_item_list(settings.items)
+
+    open_completability_cache(args)
+    pool = make_worker_pool(args)
+    seed, layout = find_layout(args, seed, starting_items, items_to_place, all_items, pool)
+    close_worker_pool(pool)
+    completability_cache.close()
+    completable, door_changes = layout[0], layout[1]
+
+    print("Completable: " + str(completable))
+    print("RNG SEED - " + str(seed))
+
+    write_spoiler(args.create + ".spoiler.txt", seed, items_to_place, layout)
+
+    # Make the spoiler graph
+    if args.graph:
+        from door_rando import spoiler_graph
+        spoiler_graph.make_spoiler_graph(door_changes, args.create)
+
+    make_rom(args, args.create, layout)
+
     # Collect output info
     out = {}
     out["seed"] = str(seed)
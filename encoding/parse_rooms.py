@@ -14,6 +14,10 @@
 # (L R B T ET EB TS BS LMB RMB)
 
 import collections
+import hashlib
+import os
+import pickle
+from pathlib import Path
 
 from encoding.constraints import *
 from data_types.constraintgraph import *
@@ -222,6 +226,90 @@ def parse_rooms(room_file):
     f.close()
     return rooms
 
+# Bump this whenever a change outside of room_cache_sources makes old pickles stale
+room_cache_version = 3
+
+# The code that determines what parsing a room file produces, relative to the repository root.
+# Its hash is part of the cache key, so a change to the parser or to the
+# item and room definitions never loads stale rooms.
+room_cache_sources = [
+    "encoding/parse_rooms.py",
+    "encoding/constraints.py",
+    "encoding/sm_global.py",
+    "data_types/constraintgraph.py",
+    "data_types/item_set.py",
+    "data_types/minsetset.py",
+    "data_types/orderedset.py",
+]
+
+# Parsed rooms for each room file that has been loaded by this process
+# key - room file path
+# value - dict of room name -> Room
+room_library = {}
+
+# room_file_hash for each room file hashed by this process - the room files and the parser
+# aren't expected to change while it runs, and every generated layout needs the hash
+# key - room file path
+# value - hex digest
+room_file_hashes = {}
+
+def code_hash():
+    """Get a hash of the room parsing code (and of the parser version)"""
+    h = hashlib.sha256(str(room_cache_version).encode())
+    repo_dir = Path(__file__).parent.parent
+    for source in room_cache_sources:
+        h.update((repo_dir / source).read_bytes())
+    return h.hexdigest()
+
+def room_file_hash(room_file):
+    """Get a hash of the contents of a room file and of the code that parses it.
+    Each room file is only hashed once per process."""
+    key = str(room_file)
+    if key not in room_file_hashes:
+        h = hashlib.sha256(Path(room_file).read_bytes())
+        h.update(code_hash().encode())
+        room_file_hashes[key] = h.hexdigest()
+    return room_file_hashes[key]
+
+def room_cache_path(room_file):
+    """Get the on-disk cache location for a room file. The name includes the hash of
+    the file's contents and of the parser, so editing either automatically invalidates the cache."""
+    room_file = Path(room_file)
+    return room_file.parent / ".room_cache" / "{}_{}.pickle".format(room_file.stem, room_file_hash(room_file)[:16])
+
+def load_cached_rooms(room_file):
+    """Parses room_file, or loads its pickled rooms if it has been parsed before."""
+    cache_path = room_cache_path(room_file)
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+    rooms = parse_rooms(room_file)
+    try:
+        cache_path.parent.mkdir(exist_ok=True)
+        # Write then rename so that concurrent processes never see half a file
+        tmp_path = cache_path.with_name(cache_path.name + ".{}.tmp".format(os.getpid()))
+        with open(tmp_path, "wb") as f:
+            pickle.dump(rooms, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    # The cache is only an optimization
+    except OSError:
+        pass
+    return rooms
+
+def load_rooms(room_file, disk_cache=True):
+    """Like parse_rooms, but each room file is only parsed once per process.
+    Returns a copy of the rooms that can be changed freely (for example, by item_quota_rando)
+    without affecting later calls."""
+    key = str(room_file)
+    if key not in room_library:
+        if disk_cache:
+            room_library[key] = load_cached_rooms(room_file)
+        else:
+            room_library[key] = parse_rooms(room_file)
+    return {name: room.copy() for name, room in room_library[key].items()}
+
 def parse_exits(exits_file):
     out = {}
     with open(exits_file, "r") as f:
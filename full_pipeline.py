@@ -15,10 +15,10 @@ if __name__ == "__main__":
     generate.visualize_rooms(room_info)
     rom_m = RomManager("../roms/sm_clean.smc", "../roms/sm_generate.smc")
     print("Parsing original rooms")
-    parsed_rooms = rom_m.parse()
+    parsed_rooms = rom_m.parse(snapshot=True)
     new_obj_names = generate.reify_rooms(room_info, parsed_rooms)
     print("Compiling rooms")
-    rom_m.compile(new_obj_names)
+    rom_m.compile(new_obj_names, link_map="output/link_map.json")
     rom_m.save_and_close()
     with open("output/mdb.txt") as f:
         f.write(new_obj_names.mdb)
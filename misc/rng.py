@@ -23,3 +23,15 @@ def get_hash(s):
     h = hashlib.sha256(s.encode())
     v = int.from_bytes(h.digest(), "big")
     return v
+
+def derive_seed(seed, index):
+    """Deterministically derives the index-th seed of a sequence starting at seed.
+    The derived seeds are sm sentences, like the ones seed_rng chooses."""
+    if index == 0:
+        return seed
+    # Use a separate generator so that the global RNG state is left alone
+    r = random.Random(get_hash("{}#{}".format(seed, index)))
+    with open("misc/sm_words") as f:
+        l = f.read().splitlines()
+        words = r.choices(l, k=4)
+        return ", ".join(words)
@@ -1,101 +1,142 @@
+import collections
 from collections import defaultdict
+import heapq
 from . import intervals
-from . import compress_graph
+from . import match_finder
 
-def find_all_intervals(src, min_size, debug):
-    # Compute the real intervals
-    if debug:
-        print("Finding byte fills")
-    bf = intervals.find_bytefills(src, min_size)
-    if debug:
-        print("Finding word fills")
-    wf = intervals.find_wordfills(src, min_size)
-    if debug:
-        print("Finding sigma fills")
-    sf = intervals.find_sigmafills(src, min_size)
-    if debug:
-        print("Finding address copies")
-    ac = intervals.find_address_copies(src, min_size)
-    if debug:
-        print("Finding address XOR copies")
-    xc = intervals.find_address_xor_copies(src, min_size)
-    if debug:
-        print("Finding relative copies")
-    rc = intervals.find_rel_address_copies(src, min_size)
-    intervals = bf + wf + sf + ac + xc + rc
-    if debug:
-        print ("Found {} intervals".format(len(intervals)))
-    # Filter out bad ones
-    intervals = intervals.filter_worse(intervals)
-    if debug:
-        print("{} intervals are good".format(len(intervals)))
-    return intervals
+# The longest region a single command can encode
+max_command_size = 1024
+# Commands longer than this need the 2 byte extended command code
+max_short_command_size = 32
 
-def optimal_compress(src, min_size=0, debug=False):
-    # Start and end fake intervals
-    start = intervals.FakeInterval(-1,0)
-    end = intervals.FakeInterval(len(src),len(src)+1)
-    intervals = [start, end] + find_all_intervals(src, min_size, debug)
-    if debug:
-        print("Constructing Graph")
-    # Construct the compression graph
-    g = compress_graph.CompressGraph(intervals, src)
-    if debug:
-        print("Graph has {} nodes".format(g.nnodes))
-    # Find the shortest path that encodes all the data
-    d, p = g.fake_dijkstra(start, end)
-    # Cut out the fake nodes
-    p = p[1:-1]
-    print(p)
-    #print(d)
-    return compress_graph.path_to_data(p) + b"\xff"
+def fill_lengths(src):
+    """For each location in src, the length of the byte fill, word fill
+    and sigma fill that starts there"""
+    n = len(src)
+    bf = [1] * n
+    wf = [min(2, n - i) for i in range(n)]
+    sf = [1] * n
+    for i in range(n - 2, -1, -1):
+        if src[i + 1] == src[i]:
+            bf[i] = bf[i + 1] + 1
+        if src[i + 1] == (src[i] + 1) & 0xff:
+            sf[i] = sf[i + 1] + 1
+        if i + 2 < n and src[i + 2] == src[i]:
+            wf[i] = wf[i + 1] + 1
+    return bf, wf, sf
 
-def merge_compress(src, min_size=2, debug=False):
-    assert min_size > 0
-    intervals = find_all_intervals(src, min_size, debug)
-    return path_to_data(recursive_merge_compress(src, min_size, 0, len(src), intervals)) + b"\xff"
+def path_to_data(interval_list):
+    """The compressed bytes for a list of intervals that covers the data, in order"""
+    return b"".join(interval.b for interval in interval_list)
 
-def crosses(interval, index):
-    return index >= interval.start and index < interval.end
+# Command kinds for optimal_compress, with the size of their argument
+FILL_BYTE, FILL_WORD, FILL_SIGMA, COPY, COPY_XOR, COPY_REL, DIRECT = range(7)
+arg_sizes = [1, 2, 1, 2, 2, 1, None]
 
-# Does not work very well currently -- no shortens.
-# also not verified to be correct.
-def recursive_merge_compress(src, min_size, lb, ub, intervals):
-    # Base Case
-    if ub - lb <= min_size:
-        return [intervals.DirectCopyInterval(lb, ub, src[lb:ub])]
-    # Choose the largest interval that crosses the center
-    center = lb + (ub - lb)//2
-    candidates = list(filter(lambda i: crosses(i, center) and i.start >= lb and i.end <= ub, intervals))
-    if len(candidates) > 0:
-        best = intervals.choose_best_interval(candidates)
-        before = list(filter(lambda i: i.end <= best.start, intervals))
-        after = list(filter(lambda i: i.start > best.end, intervals))
-        #TODO: Add shortens to before and after
-        if best.start == lb:
-            lhs = []
-        else:
-            lhs = recursive_merge_compress(src, min_size, lb, best.start, before)
-        if ub == best.end:
-            rhs = []
+def command_interval(src, kind, start, end, arg):
+    if kind == FILL_BYTE:
+        return intervals.ByteFillInterval(start, end, src[start:start + 1])
+    elif kind == FILL_WORD:
+        return intervals.WordFillInterval(start, end, src[start:start + 2])
+    elif kind == FILL_SIGMA:
+        return intervals.SigmaFillInterval(start, end, src[start:start + 1])
+    elif kind == COPY:
+        return intervals.AddressCopyInterval(start, end, arg)
+    elif kind == COPY_XOR:
+        return intervals.AddressCopyXORInterval(start, end, arg)
+    elif kind == COPY_REL:
+        return intervals.RelativeAddressCopyInterval(start, end, start - arg)
+    elif kind == DIRECT:
+        return intervals.DirectCopyInterval(start, end, src[start:end])
+    assert False, "Bad command kind: {}".format(kind)
+
+# Finds the shortest encoding of src, as a shortest path over the locations in src.
+# From each location, each kind of command can encode any length up to the longest
+# one that starts there, and its size only depends on whether it needs an extended code.
+# So each command is two range updates (short and extended) of the cost of the
+# locations after it, which are kept in a heap until the location they end at.
+# Direct copies cost 1 byte per byte, so they use the cheapest location in the last
+# 32 or 1024 locations instead.
+# The copies are found with match_finder at the given level, so level 9 is optimal.
+def optimal_compress(src, level=match_finder.default_level, debug=False):
+    n = len(src)
+    bf, wf, sf = fill_lengths(src)
+    finder = match_finder.MatchFinder(src, level)
+    nice_length = match_finder.level_nice_lengths[level]
+    copy_n = xor_n = 0
+    # cost[i] is the size of the shortest encoding of src[:i],
+    # and command[i] is the last command in it: (start, kind, arg)
+    cost = [0] * (n + 1)
+    command = [None] * (n + 1)
+    # Range updates waiting for their first location
+    pending = [[] for _ in range(n + 1 + max_short_command_size + 1)]
+    # Active range updates: (cost, last location, start, kind, arg)
+    active = []
+    # Candidate starts of a direct copy ending here, as (cost[start] - start, start),
+    # increasing, for direct copies with a short and an extended code
+    direct_windows = [(collections.deque(), max_short_command_size, 1),
+                      (collections.deque(), max_command_size, 2)]
+    for i in range(n + 1):
+        if i > 0:
+            for update in pending[i]:
+                heapq.heappush(active, update)
+            pending[i] = None
+            while active and active[0][1] < i:
+                heapq.heappop(active)
+            best = None
+            if active:
+                best, _, start, kind, arg = active[0]
+                command[i] = (start, kind, arg)
+            for window, size, code_size in direct_windows:
+                while window[0][1] < i - size:
+                    window.popleft()
+                direct_cost = window[0][0] + i + code_size
+                if best is None or direct_cost < best:
+                    best = direct_cost
+                    command[i] = (window[0][1], DIRECT, None)
+            cost[i] = best
+        if i == n:
+            break
+        for window, _, _ in direct_windows:
+            key = cost[i] - i
+            while window and window[-1][0] >= key:
+                window.pop()
+            window.append((key, i))
+        # Longest command of each kind starting here.
+        # A copy from loc of length n at i-1 is a copy from loc+1 of length n-1 at i.
+        if nice_length is not None and copy_n > nice_length and copy_loc + 1 <= match_finder.max_address:
+            copy_n, copy_loc = copy_n - 1, copy_loc + 1
+            rel_n, rel_loc = (rel_n - 1, rel_loc + 1) if rel_n > 0 else (0, None)
         else:
-            rhs = recursive_merge_compress(src, min_size, best.end, ub, after)
-        return lhs + [best] + rhs
-    else:
-        before = list(filter(lambda i: i.start < center, intervals))
-        after = list(filter(lambda i: i.end > center, intervals))
-        lhs = recursive_merge_compress(src, min_size, lb, center, before)
-        rhs = recursive_merge_compress(src, min_size, center, ub, after)
-        # Fix up adjacent direct copies by combining them
-        # There won't be adjacent of other intervals because otherwise the first case would be used.
-        lastl = lhs[-1]
-        firstr = rhs[0]
-        if isinstance(lastl, intervals.DirectCopyInterval) and isinstance(firstr, intervals.DirectCopyInterval) \
-                and lastl.end == firstr.start:
-            new = intervals.DirectCopyInterval(lastl.start, firstr.end, (lastl.cpy_bytes + firstr.cpy_bytes))
-            return lhs[:-1] + [new] + rhs[1:]
+            (copy_n, copy_loc), (rel_n, rel_loc) = finder.search_at(i, nice_length=nice_length)
+        if nice_length is not None and xor_n > nice_length and xor_loc + 1 <= match_finder.max_address:
+            xor_n, xor_loc = xor_n - 1, xor_loc + 1
         else:
-            return lhs + rhs
+            (xor_n, xor_loc), _ = finder.search_at(i, xor=True, nice_length=nice_length)
+        longest = [(bf[i], FILL_BYTE, None), (wf[i], FILL_WORD, None), (sf[i], FILL_SIGMA, None),
+                   (copy_n, COPY, copy_loc), (xor_n, COPY_XOR, xor_loc), (rel_n, COPY_REL, rel_loc)]
+        for length, kind, arg in longest:
+            # A 1 byte command is never better than a direct copy
+            if length < 2:
+                continue
+            length = min(length, max_command_size)
+            arg_cost = cost[i] + arg_sizes[kind]
+            pending[i + 2].append((arg_cost + 1, i + min(length, max_short_command_size), i, kind, arg))
+            if length > max_short_command_size:
+                pending[i + max_short_command_size + 1].append((arg_cost + 2, i + length, i, kind, arg))
+    # Follow the commands back from the end
+    path = []
+    end = n
+    while end > 0:
+        start, kind, arg = command[end]
+        path.append(command_interval(src, kind, start, end, arg))
+        end = start
+    path.reverse()
+    if debug:
+        print(path)
+    data = path_to_data(path)
+    assert len(data) == cost[n], (len(data), cost[n])
+    return data + b"\xff"
 
 def mk_prefix_dict(src, prefix_length):
     """ Create a dict of prefixes to aid with finding copies """
@@ -107,8 +148,51 @@ def mk_prefix_dict(src, prefix_length):
     return d
 
 # Greedy_compress which just finds the best interval for the next bytes and is reasonably fast
+# Higher levels look further back for copies (see match_finder.level_chain_depths)
 # TODO: buggy for min_size < 2?
-def greedy_compress(src, min_size=2, prefix_length=4, debug=False):
+def greedy_compress(src, min_size=2, level=match_finder.default_level, debug=False):
+    i = 0
+    last_end = 0
+    interval_list = []
+    finder = match_finder.MatchFinder(src, level)
+    while i < len(src):
+        bf, _ = intervals.find_bytefill_at(src, i, min_size)
+        wf, _ = intervals.find_wordfill_at(src, i, min_size)
+        sf, _ = intervals.find_sigmafill_at(src, i, min_size)
+        # Address copy, address XOR copy and relative copy
+        copies = finder.find_copies_at(i, min_size)
+        all_intervals = bf + wf + sf + copies
+        if debug:
+            for interval in all_intervals:
+                print(interval)
+        # If there's an interval to choose, use the one that saves the most bytes
+        if len(all_intervals) != 0:
+            interval = intervals.choose_best_interval(all_intervals)
+            # Directcopy the bytes before this interval starts
+            if last_end < i:
+                dc = intervals.DirectCopyInterval(last_end, i, src[last_end:i])
+                if debug:
+                    print("Using: " + str(dc))
+                interval_list.append(dc)
+            if debug:
+                print("Using: " + str(interval))
+            interval_list.append(interval)
+            # Set the iterator to the end of the interval we just chose
+            i += interval.n
+            last_end = i
+        # If there's no interval, update i. Next time we find an interval
+        # this byte will be part of a directcopy.
+        else:
+            i += 1
+    # In case the last thing to do is directcopy
+    if last_end < i:
+        dc = intervals.DirectCopyInterval(last_end, i, src[last_end:i])
+        interval_list.append(dc)
+    return path_to_data(interval_list) + b"\xff"
+
+# The original greedy_compress, which looks for copies with mk_prefix_dict.
+# Kept to compare greedy_compress against - see compress_benchmark.py
+def prefix_greedy_compress(src, min_size=2, prefix_length=4, debug=False):
     i = 0
     last_end = 0
     interval_list = []
@@ -167,5 +251,5 @@ def greedy_compress(src, min_size=2, prefix_length=4, debug=False):
     if last_end < i:
         dc = intervals.DirectCopyInterval(last_end, i, src[last_end:i])
         interval_list.append(dc)
-    return compress_graph.path_to_data(interval_list) + b"\xff"
+    return path_to_data(interval_list) + b"\xff"
 
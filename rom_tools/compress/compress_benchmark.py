@@ -0,0 +1,37 @@
+# Compares greedy_compress and optimal_compress at each level against the original
+# prefix_greedy_compress, on the level data of every room, for speed and compressed size
+# Run from the repository root with:
+# python -m rom_tools.compress.compress_benchmark <clean rom>
+import sys
+import time
+
+from rom_tools.rom_manager import RomManager
+from rom_tools.rom_data_structures import LevelData
+from rom_tools.compress import compress, decompress, match_finder
+
+def level_data(rom):
+    """Get the decompressed level data of every room"""
+    return [obj.level_bytes for obj in rom.parse().values() if isinstance(obj, LevelData)]
+
+def time_it(name, f, datas):
+    start = time.perf_counter()
+    results = [f(data) for data in datas]
+    elapsed = time.perf_counter() - start
+    for data, result in zip(datas, results):
+        assert decompress.decompress(result) == data, name
+    print("{:<30} {:>10.2f} ms {:>10} bytes".format(name, elapsed * 1000, sum(len(r) for r in results)))
+
+def run(clean_rom):
+    rom = RomManager(clean_rom, None, in_memory=True)
+    datas = level_data(rom)
+    print("{} rooms, {} bytes of level data".format(len(datas), sum(len(d) for d in datas)))
+    time_it("prefix_greedy_compress", compress.prefix_greedy_compress, datas)
+    for level in match_finder.level_chain_depths:
+        time_it("greedy_compress level {}".format(level),
+                lambda data: compress.greedy_compress(data, level=level), datas)
+    for level in match_finder.level_chain_depths:
+        time_it("optimal_compress level {}".format(level),
+                lambda data: compress.optimal_compress(data, level=level), datas)
+
+if __name__ == "__main__":
+    run(sys.argv[1])
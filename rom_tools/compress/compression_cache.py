@@ -0,0 +1,126 @@
+import collections
+import hashlib
+import os
+from pathlib import Path
+
+# Compressed data, keyed by a hash of the uncompressed data.
+# Compressing the same data gives the same result, so the cache never needs to be
+# invalidated, and any valid compression of the data can be returned for it.
+# Recently used data is kept in memory, and optionally in a folder on disk so that
+# later builds can reuse it.
+
+def content_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+class CompressionCache(object):
+
+    def __init__(self, max_size=1 << 24, cache_dir=None, max_disk_size=1 << 28):
+        """max_size and max_disk_size are the total bytes of compressed data to keep"""
+        # key -> compressed data from the clean rom. These aren't evicted, so that
+        # unchanged data always compiles back to exactly what it was.
+        self.clean = {}
+        # key -> compressed data, least recently used first
+        self.memory = collections.OrderedDict()
+        self.memory_size = 0
+        self.max_size = max_size
+        self.cache_dir = None
+        if cache_dir is not None:
+            self.cache_dir = Path(cache_dir)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.disk_size = sum(path.stat().st_size for path in self.cache_dir.glob("*.bin"))
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.misses = 0
+
+    def put_clean(self, data, compressed):
+        """Remember the compressed data that the clean rom uses for data"""
+        self.clean[content_key(data)] = bytes(compressed)
+
+    def get(self, data):
+        """Get compressed data for data, or None if it isn't cached"""
+        key = content_key(data)
+        if key in self.clean:
+            self.hits += 1
+            return self.clean[key]
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+        if self.cache_dir is not None:
+            # Another process may evict it at any time
+            try:
+                path = self.disk_path(key)
+                compressed = path.read_bytes()
+                # Mark it as recently used for disk eviction
+                os.utime(path)
+            except FileNotFoundError:
+                compressed = None
+            if compressed is not None:
+                self.remember(key, compressed)
+                self.hits += 1
+                return compressed
+        self.misses += 1
+        return None
+
+    def put(self, data, compressed):
+        key = content_key(data)
+        compressed = bytes(compressed)
+        self.remember(key, compressed)
+        if self.cache_dir is not None:
+            path = self.disk_path(key)
+            if not path.exists():
+                # Write then rename, so that other processes never see part of a file
+                temp_path = path.with_suffix(".tmp{}".format(os.getpid()))
+                temp_path.write_bytes(compressed)
+                os.replace(temp_path, path)
+                self.disk_size += len(compressed)
+                self.evict_disk()
+
+    def compress(self, data, compressor):
+        """Get the compressed data for data, using compressor if it isn't cached"""
+        compressed = self.get(data)
+        if compressed is None:
+            compressed = compressor(data)
+            self.put(data, compressed)
+        return compressed
+
+    def remember(self, key, compressed):
+        """Put key in the in-memory LRU only"""
+        if key in self.memory:
+            self.memory_size -= len(self.memory[key])
+        self.memory[key] = compressed
+        self.memory.move_to_end(key)
+        self.memory_size += len(compressed)
+        while self.memory_size > self.max_size:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= len(evicted)
+
+    def disk_path(self, key):
+        return self.cache_dir / (key + ".bin")
+
+    def evict_disk(self):
+        """Delete the least recently used files until the folder is small enough"""
+        if self.disk_size <= self.max_disk_size:
+            return
+        # Other processes may be using the same folder, so recount it
+        files = []
+        for path in self.cache_dir.glob("*.bin"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        self.disk_size = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self.disk_size <= self.max_disk_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            self.disk_size -= size
+
+# The cache used when compiling level data.
+# Set this to a CompressionCache with a cache_dir to keep compressed level data between runs.
+level_data_cache = CompressionCache()
@@ -8,7 +8,138 @@ def get_n_bits(i, n, p):
     mask = (2**n - 1) << end
     return (i & mask) >> end
 
+# Lookup tables for the commands that transform bytes
+# Every byte value xored with 0xff
+xor_table = bytes(b ^ 0xff for b in range(256))
+# Counting up from any byte for the longest possible sigmafill (1024 bytes), wrapping around at 256
+sigma_table = bytes(range(256)) * 5
+
+def read_command(src, index):
+    """Reads the command at src[index]. Returns the command code, the number of bytes that it
+    decompresses to, and the index of its arguments"""
+    next_cmd = src[index]
+    # The command code is the top 3 bits
+    cmd_code = get_n_bits(next_cmd, 3, 0)
+    if cmd_code == 7:
+        # An extended command uses the next 3 bits for the actual command
+        cmd_code = get_n_bits(next_cmd, 3, 3)
+        # Get the integer which is the last 10 bits of the 2-byte command
+        n = ((next_cmd & 0b11) << 8) | src[index+1]
+        # The argument bytes will be collected from after the 2-byte code
+        index += 2
+    else:
+        n = get_n_bits(next_cmd, 5, 3)
+        index += 1
+    assert cmd_code != 7, "Bad cmd_code: " + str(cmd_code)
+    # Arg is adjusted by 1 since ex. direct_copy 0 copies 1 byte
+    return cmd_code, n + 1, index
+
+# The number of argument bytes for each command code (direct copy has n)
+arg_sizes = [None, 1, 2, 1, 2, 2, 1]
+
+def decompressed_size(src):
+    """Returns the size that src decompresses to, and the size of the compressed data"""
+    size = 0
+    index = 0
+    while src[index] != 0xff:
+        cmd_code, n, index = read_command(src, index)
+        size += n
+        if cmd_code == 0:
+            index += n
+        else:
+            index += arg_sizes[cmd_code]
+    return size, index + 1
+
+def copy_back(out, start, pos, n, table=None):
+    """out[pos:pos+n] = out[start:start+n], mapped through table if it is given.
+    Works as if the bytes were copied one at a time, so if the source overlaps the destination
+    then the bytes that were just copied get copied again"""
+    distance = pos - start
+    assert start >= 0 and distance > 0, ("Copy from outside of the output", start, pos)
+    if table is not None:
+        chunk = min(distance, n)
+        out[pos:pos+chunk] = bytes(out[start:start+chunk]).translate(table)
+        pos += chunk
+        n -= chunk
+        # Any further byte is copied from one that was itself mapped through the table.
+        # Xor twice is the identity, so the rest is a plain copy from twice as far back
+        distance *= 2
+    while n > 0:
+        chunk = min(distance, n)
+        out[pos:pos+chunk] = out[pos-distance:pos-distance+chunk]
+        pos += chunk
+        n -= chunk
+        # The output now repeats with period distance over twice the distance
+        distance *= 2
+
+def decompress_into(src, out, debug=False):
+    """Decompresses src into out, which must be a bytearray or writable memoryview at least
+    decompressed_size(src) long. Back-references are relative to the start of out, so use a memoryview
+    slice to decompress into the middle of a larger buffer.
+    Returns the number of bytes written and the size of the compressed data"""
+    pos = 0
+    index = 0
+    while True:
+        if debug:
+            print("Current Index: {}".format(index))
+        if src[index] == 0xff:
+            return pos, index + 1
+        cmd_code, n, index = read_command(src, index)
+        end = pos + n
+        assert end <= len(out), ("Output buffer is too small", end, len(out))
+        if cmd_code == 0:
+            arg = src[index:index+n]
+            if debug:
+                print("DIRECTCOPY({}) from {} to {} of size {}".format(arg, pos, end, hex(n)))
+            assert len(arg) == n, (len(arg), n)
+            out[pos:end] = arg
+            index += n
+        elif cmd_code == 1:
+            if debug:
+                print("BYTEFILL from {} to {} of size {}".format(pos, end, hex(n)))
+            out[pos:end] = src[index:index+1] * n
+            index += 1
+        elif cmd_code == 2:
+            if debug:
+                print("WORDFILL from {} to {} of size {}".format(pos, end, hex(n)))
+            out[pos:end] = (src[index:index+2] * (n // 2 + 1))[:n]
+            index += 2
+        elif cmd_code == 3:
+            if debug:
+                print("SIGMAFILL from {} to {} of size {}".format(pos, end, hex(n)))
+            arg = src[index]
+            out[pos:end] = sigma_table[arg:arg+n]
+            index += 1
+        elif cmd_code == 4 or cmd_code == 5:
+            arg = src[index] | (src[index+1] << 8)
+            if debug:
+                name = "ADDRCPY" if cmd_code == 4 else "ADDRXORCPY"
+                print("{}({}) from {} to {} of size {}".format(name, arg, pos, end, hex(n)))
+            copy_back(out, arg, pos, n, None if cmd_code == 4 else xor_table)
+            index += 2
+        else:
+            # One byte
+            arg = src[index]
+            if debug:
+                print("ADDRRELCPY({}) from {} to {} of size {}".format(arg, pos, end, hex(n)))
+            copy_back(out, pos - arg, pos, n)
+            index += 1
+        pos = end
+
 def decompress_with_size(src, debug=False):
+    """Returns the decompressed bytes of src, and the size of the compressed data"""
+    size, _ = decompressed_size(src)
+    out = bytearray(size)
+    _, index = decompress_into(src, out, debug=debug)
+    return bytes(out), index
+
+def decompress(src, debug=False):
+    dst, index = decompress_with_size(src, debug=debug)
+    return dst
+
+# The original decompressor, which builds the output one command at a time.
+# Kept to check decompress_with_size against - see decompress_benchmark.py
+def reference_decompress_with_size(src, debug=False):
     dst = b""
     index = 0
     while True:
@@ -58,9 +189,6 @@ def decompress_with_size(src, debug=False):
         dst += new
     return dst, index
 
-def decompress(src, debug=False):
-    dst, index = decompress_with_size(src, debug=debug)
-    return dst
 
 def direct_copy(n, index, src, dst, debug):
     arg = src[index:index+n]
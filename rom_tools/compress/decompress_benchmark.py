@@ -0,0 +1,59 @@
+# Times decompression of every compressed block that the rom parsing reads
+# (level data, tile tables, tilesheets and palettes), and checks the result
+# against the reference implementation
+# Run from the repository root with:
+# python -m rom_tools.compress.decompress_benchmark <clean rom>
+import sys
+import time
+
+from rom_tools.address import Address
+from rom_tools.rom_manager import RomManager
+from rom_tools.rom_data_structures import LevelData
+from rom_tools.compress import decompress
+
+# Same as in graphics.py, which needs PIL
+cre_tile_addr = Address(0xb98000, mode="snes")
+cre_tile_table_addr = Address(0xb9a09d, mode="snes")
+tileset_table_addr = Address(0x8fe6a2, mode="snes")
+
+# Enough to hold any compressed block in the vanilla rom
+window_size = 0x10000
+
+def compressed_blocks(rom):
+    """Get the compressed bytes of every compressed block, by address"""
+    blocks = {}
+    # Only compressed_data is needed, so a lazy parse doesn't decompress anything
+    for obj in rom.parse(lazy=True).values():
+        if isinstance(obj, LevelData):
+            blocks[obj.old_address.as_pc] = obj.compressed_data
+    addresses = [cre_tile_addr, cre_tile_table_addr]
+    for t in rom.read_list(tileset_table_addr, 9, 0x1d, compressed=False):
+        for i in range(0, 9, 3):
+            addresses.append(Address(int.from_bytes(t[i:i+3], byteorder="little"), mode="snes"))
+    for address in addresses:
+        if address.as_pc not in blocks:
+            blocks[address.as_pc] = rom.read_from_clean(address, window_size)
+    return blocks
+
+def time_it(name, f, blocks, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        results = [f(src) for src in blocks.values()]
+        best = min(best, time.perf_counter() - start)
+    print("{:<30} {:>10.2f} ms".format(name, best * 1000))
+    return results
+
+def run(clean_rom, repeats=5):
+    rom = RomManager(clean_rom, None, in_memory=True)
+    blocks = compressed_blocks(rom)
+    reference = time_it("reference_decompress", decompress.reference_decompress_with_size, blocks, repeats)
+    results = time_it("decompress", decompress.decompress_with_size, blocks, repeats)
+    for address, expected, result in zip(blocks, reference, results):
+        assert expected == result, hex(address)
+    print("{} blocks, {} compressed bytes, {} decompressed bytes".format(
+        len(blocks), sum(size for _, size in results), sum(len(data) for data, _ in results)))
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    run(sys.argv[1], repeats)
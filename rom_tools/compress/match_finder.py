@@ -0,0 +1,143 @@
+from . import intervals
+
+# Finds the longest address copy, address XOR copy and relative copy for a location
+# in one pass over a hash chain, instead of checking every earlier location that
+# shares a prefix once for each kind of copy.
+
+# Unlike intervals.find_copy_at, plain copies here may overlap the bytes they write.
+
+# The shortest copy worth finding: a 2 byte copy can't save anything
+min_match = 3
+# The longest copy that fits in an extended command
+max_match = 1023
+# Relative copies have a 1 byte offset
+max_rel_distance = 255
+# Address copies have a 2 byte address, so this is the last location they can copy from
+max_address = (1 << 16) - 1
+
+# Compression level -> how many earlier locations to check, for levels 1 to 9.
+# None checks all of them, which finds the same copies as checking every location.
+level_chain_depths = {1: 4, 2: 8, 3: 16, 4: 32, 5: 64, 6: 128, 7: 256, 8: 1024, 9: None}
+default_level = 8
+# For optimal_compress: once a copy this long is found, stop looking for longer ones,
+# and take the copies at the next locations to be the rest of it instead of searching.
+# None always searches the whole chain.
+level_nice_lengths = {1: 16, 2: 16, 3: 32, 4: 32, 5: 64, 6: 64, 7: 128, 8: 128, 9: None}
+
+xor_table = bytes(b ^ 0xff for b in range(256))
+
+def match_length(src, i1, other, i2, limit, lower=0):
+    """How many bytes of src starting at i1 match the bytes of other starting at i2,
+    up to limit, given that the first lower bytes match"""
+    # Binary search on the length, so that the comparisons are done on slices
+    upper = limit
+    while lower < upper:
+        mid = (lower + upper + 1) // 2
+        if src[i1:i1 + mid] == other[i2:i2 + mid]:
+            lower = mid
+        else:
+            upper = mid - 1
+    return lower
+
+class MatchFinder(object):
+
+    def __init__(self, src, level=default_level):
+        assert level in level_chain_depths, "Bad compression level: {}".format(level)
+        self.src = bytes(src)
+        # src with every byte XORed with 0xff, for finding XOR copies
+        self.xor_src = self.src.translate(xor_table)
+        self.max_chain = level_chain_depths[level]
+        # Hash chains: prefix -> latest location with that prefix,
+        # and location -> previous location with the same prefix
+        self.head = {}
+        self.prev = [-1] * len(src)
+        # Locations before this have been added to the chains
+        self.n_inserted = 0
+
+    def insert_to(self, location):
+        """Add every location before location to the hash chains"""
+        src = self.src
+        head = self.head
+        prev = self.prev
+        for i in range(self.n_inserted, min(location, len(src) - (min_match - 1))):
+            prefix = src[i:i + min_match]
+            prev[i] = head.get(prefix, -1)
+            head[prefix] = i
+        self.n_inserted = max(self.n_inserted, location)
+
+    def search(self, location, other, nice_length=None):
+        """Longest copy of the bytes at location from the earlier locations of other,
+        where other is src or xor_src. The locations of other that start with the same
+        bytes as src at location are in the chain for other[location:location + 3].
+        Returns (length, address) of the longest copy, and (length, address)
+        of the longest copy that is close enough for a relative copy.
+        Stops at the first copy of at least nice_length"""
+        src = self.src
+        prev = self.prev
+        # A copy can read bytes that it has just written (see decompress.copy_back),
+        # which are the same as src for a plain copy.
+        # For an XOR copy they'd be XORed twice, so don't let those overlap.
+        # There are no relative XOR copies.
+        plain = other is src
+        remaining = min(max_match, len(src) - location)
+        enough = remaining if nice_length is None else min(remaining, nice_length)
+        best_n, best_loc = 0, None
+        best_rel_n, best_rel_loc = 0, None
+        if remaining < min_match:
+            return (best_n, best_loc), (best_rel_n, best_rel_loc)
+        chain = len(src) if self.max_chain is None else self.max_chain
+        candidate = self.head.get(other[location:location + min_match], -1)
+        # The chain goes from the closest location back,
+        # so first the locations that a relative copy can use
+        while plain and candidate >= 0 and chain > 0 and location - candidate <= max_rel_distance:
+            chain -= 1
+            # Only compare if it could beat the best so far
+            beat = best_rel_n + 1
+            if src[location + best_rel_n] == src[candidate + best_rel_n] \
+                    and src[location:location + beat] == src[candidate:candidate + beat]:
+                n = match_length(src, location, src, candidate, remaining, beat)
+                if n > best_rel_n:
+                    best_rel_n, best_rel_loc = n, candidate
+                    if n >= enough:
+                        break
+            candidate = prev[candidate]
+        if best_rel_loc is not None and best_rel_loc <= max_address:
+            best_n, best_loc = best_rel_n, best_rel_loc
+        if best_n >= enough:
+            return (best_n, best_loc), (best_rel_n, best_rel_loc)
+        # Then the rest, for address copies
+        while candidate >= 0 and chain > 0:
+            chain -= 1
+            limit = remaining if plain else min(remaining, location - candidate)
+            beat = best_n + 1
+            if limit >= beat and src[location + best_n] == other[candidate + best_n] \
+                    and src[location:location + beat] == other[candidate:candidate + beat] \
+                    and candidate <= max_address:
+                n = match_length(src, location, other, candidate, limit, beat)
+                if n > best_n:
+                    best_n, best_loc = n, candidate
+                    if n >= enough:
+                        break
+            candidate = prev[candidate]
+        return (best_n, best_loc), (best_rel_n, best_rel_loc)
+
+    def search_at(self, location, xor=False, nice_length=None):
+        """Add the locations before location to the chains,
+        and search for copies at location"""
+        self.insert_to(location)
+        return self.search(location, self.xor_src if xor else self.src, nice_length)
+
+    def find_copies_at(self, location, min_size):
+        """Get the best address copy, address XOR copy and relative copy at location,
+        in the same form as the intervals.find_*_copy_at functions"""
+        self.insert_to(location)
+        found = []
+        (n, loc), (rel_n, rel_loc) = self.search(location, self.src)
+        (xor_n, xor_loc), _ = self.search(location, self.xor_src)
+        # Same rule as intervals.find_copy_at: n bytes copied is a length of n - 1
+        for length, loc, constructor in [(n, loc, intervals.address_constructor),
+                                         (xor_n, xor_loc, intervals.address_xor_constructor),
+                                         (rel_n, rel_loc, intervals.rel_address_constructor)]:
+            if length - 1 > 1 and length - 1 >= min_size:
+                found.append(constructor(self.src, loc, location, location + length))
+        return found
@@ -0,0 +1,76 @@
+# Checks that optimal_compress and greedy_compress round-trip through both decompressors,
+# and that optimal_compress at level 9 is never longer than greedy_compress.
+# Run from the repository root with:
+# python -m rom_tools.compress.test_compress
+import random
+
+from rom_tools.compress import compress, decompress, match_finder
+
+def level_like_bytes(rand, n_tiles):
+    """Tile words from a small palette with some empty tiles, then one BTS byte per tile,
+    like decompressed level data"""
+    palette = [rand.randrange(1 << 16) for _ in range(rand.randint(1, 40))]
+    out = bytearray(n_tiles.to_bytes(2, "little"))
+    for _ in range(n_tiles):
+        tile = rand.choice(palette) if rand.random() < 0.4 else 0x80ff
+        out += tile.to_bytes(2, "little")
+    out += bytes(rand.choice([0, 0, 0, 1, 2]) for _ in range(n_tiles))
+    return bytes(out)
+
+def pattern_bytes(rand, n):
+    """Runs of every command kind: fills, sigma fills, copies, XOR copies, relative copies and noise"""
+    out = bytearray()
+    while len(out) < n:
+        kind = rand.randrange(6)
+        length = rand.choice([1, 2, 3, 31, 32, 33, rand.randint(1, 1100)])
+        if kind == 0:
+            out += bytes([rand.randrange(256)]) * length
+        elif kind == 1:
+            out += bytes(rand.randrange(256) for _ in range(2)) * (length // 2 + 1)
+        elif kind == 2:
+            start = rand.randrange(256)
+            out += bytes((start + i) & 0xff for i in range(length))
+        elif kind in [3, 4] and len(out) > 0:
+            start = rand.randrange(len(out))
+            # Copies may overlap the bytes they write
+            for i in range(length):
+                byte = out[start + i]
+                out.append(byte ^ 0xff if kind == 4 else byte)
+        else:
+            out += bytes(rand.randrange(256) for _ in range(length))
+    return bytes(out[:n])
+
+def check_round_trip(src, compressed):
+    assert compressed[-1] == 0xff
+    assert decompress.decompress(compressed) == src
+    dst, size = decompress.reference_decompress_with_size(compressed + b"\x00" * 4)
+    assert dst == src
+    assert size == len(compressed)
+
+def check(src, levels):
+    for level in levels:
+        optimal = compress.optimal_compress(src, level=level)
+        check_round_trip(src, optimal)
+        greedy = compress.greedy_compress(src, level=level)
+        check_round_trip(src, greedy)
+        if level == 9:
+            assert len(optimal) <= len(greedy), (len(optimal), len(greedy))
+
+if __name__ == "__main__":
+    rand = random.Random(0)
+    all_levels = list(match_finder.level_chain_depths)
+    for src in [b"\x00", b"\x01\x02", b"\x05" * 2000, bytes(range(256)) * 5, b"\x01\x02" * 600]:
+        check(src, all_levels)
+    for _ in range(20):
+        check(pattern_bytes(rand, rand.randint(1, 3000)), all_levels)
+    for n_tiles in [256, 1024, 4096]:
+        check(level_like_bytes(rand, n_tiles), [1, match_finder.default_level, 9])
+    # Relative copies only reach 255 bytes back, and address copies need 2 byte addresses
+    check(pattern_bytes(rand, 70000), [match_finder.default_level])
+    # The last location an address copy can use is max_address, and nothing after it
+    noise = bytes(rand.randrange(256) for _ in range(match_finder.max_address + 40))
+    for start in [match_finder.max_address, match_finder.max_address + 1]:
+        src = noise + noise[start:start + 32]
+        (n, loc), _ = match_finder.MatchFinder(src, 9).search_at(len(noise))
+        assert (loc == start) == (start <= match_finder.max_address), (n, loc)
+        check(src, [match_finder.default_level])
@@ -0,0 +1,64 @@
+# Checks that decompress_with_size gives the same result as reference_decompress_with_size,
+# on random command streams that use every command, with short and extended codes.
+# Run from the repository root with:
+# python -m rom_tools.compress.test_decompress
+import random
+
+from rom_tools.compress import decompress
+
+def command_code(rand, cmd_code, n):
+    """The code for a command that decompresses to n bytes, extended if it has to be (or sometimes anyway)"""
+    if n <= 32 and rand.random() < 0.8:
+        return bytes([(cmd_code << 5) | (n - 1)])
+    return bytes([0xe0 | (cmd_code << 2) | ((n - 1) >> 8), (n - 1) & 0xff])
+
+def random_stream(rand, n_commands):
+    """A compressed stream of n_commands random commands, and the number of bytes it decompresses to"""
+    out = bytearray()
+    size = 0
+    for _ in range(n_commands):
+        n = rand.choice([1, 2, 3, rand.randint(1, 32), 32, 33, rand.randint(1, 1024), 1024])
+        # Copies need something to copy from
+        cmd_code = rand.randrange(7 if size > 0 else 4)
+        out += command_code(rand, cmd_code, n)
+        if cmd_code == 0:
+            out += bytes(rand.randrange(256) for _ in range(n))
+        elif cmd_code == 1 or cmd_code == 3:
+            out.append(rand.randrange(256))
+        elif cmd_code == 2:
+            out += bytes(rand.randrange(256) for _ in range(2))
+        elif cmd_code == 4 or cmd_code == 5:
+            # Often close to the end, so that the copy overlaps the bytes it writes
+            address = rand.choice([rand.randrange(size), max(size - rand.randint(1, 4), 0)])
+            out += address.to_bytes(2, "little")
+        else:
+            out.append(rand.randint(1, min(size, 255)))
+        size += n
+    out.append(0xff)
+    return bytes(out), size
+
+def check(src, trailing=b""):
+    reference, reference_size = decompress.reference_decompress_with_size(src + trailing)
+    out, size = decompress.decompress_with_size(src + trailing)
+    assert out == reference
+    assert size == reference_size == len(src)
+    assert decompress.decompressed_size(src + trailing) == (len(out), len(src))
+    # Into the middle of a bigger buffer
+    buf = bytearray(b"\xaa" * (len(out) + 20))
+    n, size = decompress.decompress_into(src, memoryview(buf)[10:10 + len(out)])
+    assert (n, size) == (len(out), len(src))
+    assert buf[10:-10] == out and buf[:10] == buf[-10:] == b"\xaa" * 10
+    return out
+
+if __name__ == "__main__":
+    rand = random.Random(0)
+    assert check(b"\xff") == b""
+    # Byte fill, then a copy of the whole output that overlaps itself
+    assert check(b"\x21\x07" + b"\x85\x00\x00" + b"\xff") == b"\x07" * 8
+    # Sigma fill wrapping around
+    assert check(b"\x62\xfe\xff") == b"\xfe\xff\x00"
+    # XOR copy that overlaps itself
+    assert check(b"\x01\x12\x34" + b"\xa5\x00\x00" + b"\xff") == b"\x12\x34\xed\xcb\x12\x34\xed\xcb"
+    for _ in range(300):
+        stream, size = random_stream(rand, rand.randint(1, 40))
+        assert len(check(stream, bytes(rand.randrange(256) for _ in range(rand.randint(0, 4))))) == size
@@ -49,11 +49,71 @@ class Tile(object):
     def __repr__(self):
         return (self.tile_type, self.texture).__repr__()
 
+# Structured form of the 2-byte tiles of layer1 and layer2
+tile_dtype = np.dtype([("tile_type", np.uint8), ("hflip", np.uint8), ("vflip", np.uint8), ("texture_index", np.uint16)])
+
+def tile_fields(words):
+    """Split an array of 2-byte tiles into a structured array of tile_dtype"""
+    words = np.asarray(words, dtype=np.uint16)
+    fields = np.empty(words.shape, dtype=tile_dtype)
+    fields["tile_type"] = words >> 12
+    fields["hflip"] = (words >> 11) & 1
+    fields["vflip"] = (words >> 10) & 1
+    fields["texture_index"] = words & 0b1111111111
+    return fields
+
+def words_from_fields(fields):
+    """Inverse of tile_fields"""
+    assert (fields["texture_index"] & 0b1111111111 == fields["texture_index"]).all()
+    return ((fields["tile_type"].astype(np.uint16) << 12) | (fields["hflip"].astype(np.uint16) << 11) |
+            (fields["vflip"].astype(np.uint16) << 10) | fields["texture_index"]).astype(np.uint16)
+
+def tiles_from_words(words):
+    """Object array of Tile for an array of 2-byte tiles"""
+    tiles = np.empty(words.shape, dtype="object")
+    fields = tile_fields(words)
+    for i, (ttype, hflip, vflip, tindex) in zip(np.ndindex(words.shape), fields.reshape(-1).tolist()):
+        tiles[i] = Tile(ttype, Texture(tindex, hflip, vflip))
+    return tiles
+
+def words_from_tiles(tiles):
+    """Array of 2-byte tiles for an object array of Tile"""
+    words = np.empty(tiles.shape, dtype=np.uint16)
+    for i, tile in np.ndenumerate(tiles):
+        words[i] = int.from_bytes(tile.to_bytes(), byteorder="little")
+    return words
+
 class LevelArrays(object):
-    def __init__(self, layer1, bts, layer2):
-        self.layer1 = layer1
+    """The level data of a room, as arrays indexed by [x, y].
+    layer1_words and layer2_words are the 2-byte tiles (layer2_words is None if there is no layer2).
+    layer1 and layer2 are the same tiles as arrays of Tile objects, which are only made when used.
+    Changes to those Tile objects are kept when converting back to bytes."""
+    def __init__(self, layer1_words, bts, layer2_words):
+        self.layer1_words = layer1_words
         self.bts = bts
-        self.layer2 = layer2
+        self.layer2_words = layer2_words
+        self._layer1 = None
+        self._layer2 = None
+
+    @property
+    def layer1(self):
+        if self._layer1 is None:
+            self._layer1 = tiles_from_words(self.layer1_words)
+        return self._layer1
+
+    @property
+    def layer2(self):
+        if self.layer2_words is None:
+            return None
+        if self._layer2 is None:
+            self._layer2 = tiles_from_words(self.layer2_words)
+        return self._layer2
+
+    def current_words(self):
+        """layer1_words and layer2_words, including any changes made to the Tile objects"""
+        layer1_words = self.layer1_words if self._layer1 is None else words_from_tiles(self._layer1)
+        layer2_words = self.layer2_words if self._layer2 is None else words_from_tiles(self._layer2)
+        return layer1_words, layer2_words
 
 def tile_of_bytes(b, layer1=True):
     assert len(b) == 2
@@ -69,72 +129,67 @@ def tile_of_bytes(b, layer1=True):
     texture = Texture(tindex, hflip, vflip)
     return Tile(ttype, texture)
 
-# Translates the (uncompressed) leveldata bytes to arrays of Layer1, BTS, Layer2
-# Layer2 is None if all zeros
-# levelsize is the number of bytes in the decompressed level1 data
-# = 2 * the number of BTS bytes
-# = the number of level2 bytes
-def level_array_from_bytes(levelbytes, dimensions):
+def split_level_bytes(levelbytes, dimensions, exact_size=False):
+    """Get the layer1, BTS and layer2 (or None) arrays of the leveldata bytes, indexed by [x, y].
+    The arrays are read-only views of levelbytes"""
     # First two bytes are the amount of level1 data
     levelsize = int.from_bytes(levelbytes[0:2], byteorder='little')
-    # Cut off the size
-    levelbytes = levelbytes[2:]
+    n_tiles = dimensions.x * dimensions.y
     # Make sure everything matches
     assert levelsize % 2 == 0, "Purported level size {} is not even!".format(levelsize)
+    if exact_size:
+        assert levelsize == n_tiles * 2, "Level data length {} does not match specified room dimensions {}".format(levelsize, n_tiles * 2)
     # Some vanilla levels have more level data than needed! :(
-    assert levelsize >= dimensions.x * dimensions.y * 2, "Level data length {} does not match specified room dimensions {}".format(levelsize, dimensions.x * dimensions.y * 2)
-    #assert levelsize == dimensions.x * dimensions.y * 2, "Level data length {} does not match specified room dimensions {}".format(levelsize, dimensions.x * dimensions.y * 2)
+    else:
+        assert levelsize >= n_tiles * 2, "Level data length {} does not match specified room dimensions {}".format(levelsize, n_tiles * 2)
     # The level might not include level2 data
-    if len(levelbytes) == int(2.5 * levelsize):
+    if len(levelbytes) - 2 == int(2.5 * levelsize):
         has_layer2 = True
-    elif len(levelbytes) == int(1.5 * levelsize):
+    elif len(levelbytes) - 2 == int(1.5 * levelsize):
         has_layer2 = False
     else:
-        assert False, "Purported level size {} does not match actual level size {}".format(1.5 * levelsize, len(levelbytes))
-    layer1 = np.empty(dimensions, dtype="object")
-    bts = np.empty(dimensions, dtype="int")
+        assert False, "Purported level size {} does not match actual level size {}".format(1.5 * levelsize, len(levelbytes) - 2)
+    # The data is stored row by row, so read it as [y, x] and transpose
+    shape = (dimensions.y, dimensions.x)
+    layer1 = np.frombuffer(levelbytes, dtype="<u2", count=n_tiles, offset=2).reshape(shape).T
+    bts = np.frombuffer(levelbytes, dtype=np.uint8, count=n_tiles, offset=2 + levelsize).reshape(shape).T
     if has_layer2:
-        layer2 = np.empty(dimensions, dtype="object")
+        layer2_offset = 2 + 3 * (levelsize // 2)
+        layer2 = np.frombuffer(levelbytes, dtype="<u2", count=n_tiles, offset=layer2_offset).reshape(shape).T
     else:
         layer2 = None
-    for y in range(dimensions.y):
-        for x in range(dimensions.x):
-            index = y * dimensions.x + x
-            layer1_index = index * 2
-            layer1[x][y] = tile_of_bytes(levelbytes[layer1_index:layer1_index+2])
-            bts_index = index + levelsize
-            bts_data = int.from_bytes(levelbytes[bts_index:bts_index+1], byteorder='little')
-            bts[x][y] = bts_data
-            if has_layer2:
-                layer2_index = index * 2 + (3 * (levelsize//2))
-                layer2[x][y] = tile_of_bytes(levelbytes[layer2_index:layer2_index+2], layer1=False)
+    return layer1, bts, layer2
+
+def join_level_bytes(layer1, bts, layer2):
+    """Inverse of split_level_bytes. layer2 can be None"""
+    parts = [layer1, bts] if layer2 is None else [layer1, bts, layer2]
+    # Back to row by row
+    data = b"".join(np.ascontiguousarray(a.T).astype(dtype).tobytes()
+                    for a, dtype in zip(parts, ["<u2", np.uint8, "<u2"]))
+    # Create the size header
+    head = int.to_bytes(layer1.size * 2, 2, byteorder="little")
+    return head + data
+
+# Translates the (uncompressed) leveldata bytes to arrays of Layer1, BTS, Layer2
+# Layer2 is None if all zeros
+# levelsize is the number of bytes in the decompressed level1 data
+# = 2 * the number of BTS bytes
+# = the number of level2 bytes
+def level_array_from_bytes(levelbytes, dimensions):
+    layer1, bts, layer2 = split_level_bytes(levelbytes, dimensions)
+    # Ensure level does not use unused tile types
+    layer1_types = layer1 >> 12
+    assert not np.isin(layer1_types, [4, 6, 7]).any(), "Bad tiletype: {}".format(layer1_types[np.isin(layer1_types, [4, 6, 7])])
+    # Copy, so that the arrays are writeable and don't keep levelbytes alive
+    layer1 = layer1.astype(np.uint16)
+    bts = bts.astype("int")
+    if layer2 is not None:
+        layer2 = layer2.astype(np.uint16)
     return LevelArrays(layer1, bts, layer2)
 
 def bytes_from_level_array(level_arrays):
-    all_layer1_bytes = bytearray(b"")
-    all_bts_bytes = bytearray(b"")
-    all_layer2_bytes = bytearray(b"")
-    xdim, ydim = level_arrays.layer1.shape
-    for y in range(ydim):
-        for x in range(xdim):
-            l1 = level_arrays.layer1[x][y]
-            bts = level_arrays.bts[x][y]
-            for b in l1.to_bytes():
-                all_layer1_bytes.append(b)
-            for b in int(bts).to_bytes(1, byteorder="little"):
-                all_bts_bytes.append(b)
-            if level_arrays.layer2 is not None:
-                l2 = level_arrays.layer2[x][y]
-                for b in l2.to_bytes():
-                    all_layer2_bytes.append(b)
-    all_bytes = all_layer1_bytes + all_bts_bytes
-    if level_arrays.layer2 is not None:
-        all_bytes = all_bytes + all_layer2_bytes
-    # Create the size header
-    head = int.to_bytes(len(all_layer1_bytes), 2, byteorder="little")
-    # Convert back to bytes
-    all_bytes = head + bytes(all_bytes)
-    return all_bytes
+    layer1, layer2 = level_arrays.current_words()
+    return join_level_bytes(layer1, level_arrays.bts, layer2)
 
 def bits(x, size):
     return [(x & 2**i) >> i for i in range(size)]
@@ -145,44 +200,19 @@ def reverse_bits(bits):
         x = x | ((2**i) * b)
     return x
 
+def to_bits(a, size):
+    """Array of the bits of each element of a (lowest first), along a new last axis"""
+    return ((a[..., np.newaxis].astype(np.uint32) >> np.arange(size)) & 1).astype(np.uint8)
+
+def from_bits(a):
+    """Inverse of to_bits"""
+    return (a.astype(np.uint32) << np.arange(a.shape[-1])).sum(axis=-1)
+
 def bit_array_from_bytes(levelbytes, dimensions):
-    # First two bytes are the amount of level1 data
-    levelsize = int.from_bytes(levelbytes[0:2], byteorder='little')
-    # Cut off the size
-    levelbytes = levelbytes[2:]
-    # Make sure everything matches
-    assert levelsize % 2 == 0, "Purported level size {} is not even!".format(levelsize)
-    assert levelsize == dimensions.x * dimensions.y * 2, "Level data length {} does not match specified room dimensions {}".format(levelsize, dimensions.x * dimensions.y * 2)
-    # The level might not include level2 data
-    if len(levelbytes) == int(2.5 * levelsize):
-        has_level2 = True
-    elif len(levelbytes) == int(1.5 * levelsize):
-        has_level2 = False
-    else:
-        assert False, "Purported level size {} does not match actual level size {}".format(1.5 * levelsize, len(levelbytes))
-    levelarray = np.zeros((dimensions.x, dimensions.y, 40), dtype=np.uint8)
-    for y in range(dimensions.y):
-        for x in range(dimensions.x):
-            # Level 1 data
-            index = y * dimensions.x + x
-            level1index = index * 2
-            level1 = int.from_bytes(levelbytes[level1index:level1index+2], byteorder='little')
-            for i, b in enumerate(bits(level1, 16)):
-                levelarray[(x, y, i)] = b
-            # BTS data
-            btsindex = index + levelsize
-            bts = int.from_bytes(levelbytes[btsindex:btsindex+1], byteorder='little')
-            bts_offset = 16
-            for i, b in enumerate(bits(bts, 8)):
-                levelarray[(x, y, i+bts_offset)] = b
-            # Level 2 (background) data
-            level2_offset = 24
-            if has_level2:
-                level2index = int(index * 2 + 3*(levelsize/2))
-                level2 = int.from_bytes(levelbytes[level2index:level2index+2], byteorder='little')
-                for i, b in enumerate(bits(level2, 16)):
-                    levelarray[(x, y, i+level2_offset)] = b
-    return levelarray
+    layer1, bts, layer2 = split_level_bytes(levelbytes, dimensions, exact_size=True)
+    if layer2 is None:
+        layer2 = np.zeros(layer1.shape, dtype=np.uint16)
+    return np.concatenate([to_bits(layer1, 16), to_bits(bts, 8), to_bits(layer2, 16)], axis=2)
 
 def codebook_from_bit_array(a):
     library = set([])
@@ -201,43 +231,10 @@ def quantize(a, codebook):
 def bytes_from_bit_array(level_array):
     xdim, ydim, bits = level_array.shape
     assert bits == 40
-    # Store in (mutable) bytearray instead of immutable bytes
-    # for much faster time
-    all_layer1_bytes = bytearray(b"")
-    all_bts_bytes = bytearray(b"")
-    all_layer2_bytes = bytearray(b"")
-    for y in range(ydim):
-        for x in range(xdim):
-            # Level 1
-            l1_bits = level_array[x,y,0:16]
-            l1_int = int(reverse_bits(l1_bits))
-            l1_bytes = l1_int.to_bytes(2, byteorder='little')
-            # Have to use a for-loop because we get 2 bytes
-            for b in l1_bytes:
-                all_layer1_bytes.append(b)
-            # BTS
-            bts_bits = level_array[x,y,16:24]
-            bts_int = int(reverse_bits(bts_bits))
-            bts_bytes = bts_int.to_bytes(1, byteorder='little')
-            for b in bts_bytes:
-                all_bts_bytes.append(b)
-            # Level 2
-            l2_bits = level_array[x,y,24:40]
-            l2_int = int(reverse_bits(l2_bits))
-            l2_bytes = l2_int.to_bytes(2, byteorder='little')
-            for b in l2_bytes:
-                all_layer2_bytes.append(b)
+    layer1 = from_bits(level_array[:,:,0:16])
+    bts = from_bits(level_array[:,:,16:24])
+    layer2 = from_bits(level_array[:,:,24:40])
     # Ignore layer2 data if all zeros
-    has_layer2 = False
-    for b in all_layer2_bytes:
-        if b != 0:
-            has_layer2 = True
-    all_bytes = all_layer1_bytes + all_bts_bytes
-    if has_layer2:
-        all_bytes = all_bytes + all_layer2_bytes
-    # Create the size header
-    head = int.to_bytes(len(all_layer1_bytes), 2, byteorder="little")
-    # Convert back to bytes
-    all_bytes = head + bytes(all_bytes)
-    return all_bytes
-
+    if not layer2.any():
+        layer2 = None
+    return join_level_bytes(layer1, bts, layer2)
@@ -0,0 +1,143 @@
+# Checks the numpy level data conversions in leveldata_utils against the original per-tile versions,
+# on random rooms with and without layer2.
+# Run from the repository root with:
+# python -m rom_tools.leveldata_utils_test
+import random
+
+import numpy as np
+
+from rom_tools import leveldata_utils
+from rom_tools.leveldata_utils import Coord, LevelArrays, tile_of_bytes, bits, reverse_bits
+
+# The original per-tile conversions, kept to check the numpy ones against
+
+def reference_level_array_from_bytes(levelbytes, dimensions):
+    levelsize = int.from_bytes(levelbytes[0:2], byteorder='little')
+    levelbytes = levelbytes[2:]
+    has_layer2 = len(levelbytes) == int(2.5 * levelsize)
+    layer1 = np.empty(dimensions, dtype="object")
+    bts = np.empty(dimensions, dtype="int")
+    layer2 = np.empty(dimensions, dtype="object") if has_layer2 else None
+    for y in range(dimensions.y):
+        for x in range(dimensions.x):
+            index = y * dimensions.x + x
+            layer1_index = index * 2
+            layer1[x][y] = tile_of_bytes(levelbytes[layer1_index:layer1_index+2])
+            bts_index = index + levelsize
+            bts[x][y] = int.from_bytes(levelbytes[bts_index:bts_index+1], byteorder='little')
+            if has_layer2:
+                layer2_index = index * 2 + (3 * (levelsize//2))
+                layer2[x][y] = tile_of_bytes(levelbytes[layer2_index:layer2_index+2], layer1=False)
+    return layer1, bts, layer2
+
+def reference_bytes_from_level_array(layer1, bts, layer2):
+    all_layer1_bytes = bytearray(b"")
+    all_bts_bytes = bytearray(b"")
+    all_layer2_bytes = bytearray(b"")
+    xdim, ydim = layer1.shape
+    for y in range(ydim):
+        for x in range(xdim):
+            all_layer1_bytes += layer1[x][y].to_bytes()
+            all_bts_bytes += int(bts[x][y]).to_bytes(1, byteorder="little")
+            if layer2 is not None:
+                all_layer2_bytes += layer2[x][y].to_bytes()
+    all_bytes = all_layer1_bytes + all_bts_bytes
+    if layer2 is not None:
+        all_bytes = all_bytes + all_layer2_bytes
+    head = int.to_bytes(len(all_layer1_bytes), 2, byteorder="little")
+    return head + bytes(all_bytes)
+
+def reference_bit_array_from_bytes(levelbytes, dimensions):
+    levelsize = int.from_bytes(levelbytes[0:2], byteorder='little')
+    levelbytes = levelbytes[2:]
+    has_level2 = len(levelbytes) == int(2.5 * levelsize)
+    levelarray = np.zeros((dimensions.x, dimensions.y, 40), dtype=np.uint8)
+    for y in range(dimensions.y):
+        for x in range(dimensions.x):
+            index = y * dimensions.x + x
+            level1index = index * 2
+            level1 = int.from_bytes(levelbytes[level1index:level1index+2], byteorder='little')
+            levelarray[x, y, 0:16] = bits(level1, 16)
+            btsindex = index + levelsize
+            levelarray[x, y, 16:24] = bits(levelbytes[btsindex], 8)
+            if has_level2:
+                level2index = int(index * 2 + 3*(levelsize/2))
+                level2 = int.from_bytes(levelbytes[level2index:level2index+2], byteorder='little')
+                levelarray[x, y, 24:40] = bits(level2, 16)
+    return levelarray
+
+def reference_bytes_from_bit_array(level_array):
+    # reverse_bits overflows on uint8 bits
+    level_array = level_array.astype(int)
+    xdim, ydim, _ = level_array.shape
+    all_layer1_bytes = bytearray(b"")
+    all_bts_bytes = bytearray(b"")
+    all_layer2_bytes = bytearray(b"")
+    for y in range(ydim):
+        for x in range(xdim):
+            all_layer1_bytes += int(reverse_bits(level_array[x,y,0:16])).to_bytes(2, byteorder='little')
+            all_bts_bytes += int(reverse_bits(level_array[x,y,16:24])).to_bytes(1, byteorder='little')
+            all_layer2_bytes += int(reverse_bits(level_array[x,y,24:40])).to_bytes(2, byteorder='little')
+    all_bytes = all_layer1_bytes + all_bts_bytes
+    if any(b != 0 for b in all_layer2_bytes):
+        all_bytes = all_bytes + all_layer2_bytes
+    head = int.to_bytes(len(all_layer1_bytes), 2, byteorder="little")
+    return head + bytes(all_bytes)
+
+def random_tile(rand, layer1):
+    tile_types = [t for t in leveldata_utils.TileType if not layer1 or t not in [4, 6, 7]]
+    return (rand.choice(tile_types) << 12) | rand.randrange(1 << 12)
+
+def random_level_bytes(rand, dimensions, has_layer2, extra_tiles=0):
+    """Level data for a room, with extra_tiles more tiles of data than the room needs (like some vanilla rooms)"""
+    n_tiles = dimensions.x * dimensions.y + extra_tiles
+    layer1 = b"".join(random_tile(rand, True).to_bytes(2, "little") for _ in range(n_tiles))
+    bts = bytes(rand.randrange(256) for _ in range(n_tiles))
+    layer2 = b"".join(random_tile(rand, False).to_bytes(2, "little") for _ in range(n_tiles)) if has_layer2 else b""
+    return (2 * n_tiles).to_bytes(2, "little") + layer1 + bts + layer2
+
+def check_level_array(levelbytes, dimensions, exact_size):
+    level_arrays = leveldata_utils.level_array_from_bytes(levelbytes, dimensions)
+    layer1, bts, layer2 = reference_level_array_from_bytes(levelbytes, dimensions)
+    assert (leveldata_utils.words_from_tiles(layer1) == level_arrays.layer1_words).all()
+    assert (bts == level_arrays.bts).all()
+    assert (layer2 is None) == (level_arrays.layer2_words is None)
+    if layer2 is not None:
+        assert (leveldata_utils.words_from_tiles(layer2) == level_arrays.layer2_words).all()
+    new_bytes = leveldata_utils.bytes_from_level_array(level_arrays)
+    assert new_bytes == reference_bytes_from_level_array(layer1, bts, layer2)
+    if exact_size:
+        assert new_bytes == levelbytes
+    # Unchanged words round-trip without making Tile objects
+    copied = LevelArrays(level_arrays.layer1_words, level_arrays.bts, level_arrays.layer2_words)
+    assert leveldata_utils.bytes_from_level_array(copied) == new_bytes
+    # Changes to the Tile objects are picked up
+    level_arrays.layer1[0, 0].tile_type = leveldata_utils.TileType.Solid
+    level_arrays.layer1[0, 0].texture.texture_index = 0x3ff
+    level_arrays.bts[0, 0] = 7
+    layer1[0, 0].tile_type = leveldata_utils.TileType.Solid
+    layer1[0, 0].texture.texture_index = 0x3ff
+    bts[0, 0] = 7
+    assert leveldata_utils.bytes_from_level_array(level_arrays) == reference_bytes_from_level_array(layer1, bts, layer2)
+
+def check_bit_array(levelbytes, dimensions):
+    bit_array = leveldata_utils.bit_array_from_bytes(levelbytes, dimensions)
+    assert (bit_array == reference_bit_array_from_bytes(levelbytes, dimensions)).all()
+    assert leveldata_utils.bytes_from_bit_array(bit_array) == reference_bytes_from_bit_array(bit_array)
+    assert leveldata_utils.bytes_from_bit_array(bit_array) == levelbytes
+
+if __name__ == "__main__":
+    rand = random.Random(0)
+    for _ in range(20):
+        dimensions = Coord(16 * rand.randint(1, 4), 16 * rand.randint(1, 3))
+        for has_layer2 in [True, False]:
+            levelbytes = random_level_bytes(rand, dimensions, has_layer2)
+            check_level_array(levelbytes, dimensions, True)
+            check_bit_array(levelbytes, dimensions)
+            check_level_array(random_level_bytes(rand, dimensions, has_layer2, extra_tiles=16), dimensions, False)
+    # A layer2 of zeros is kept by bytes_from_level_array but not by bytes_from_bit_array
+    dimensions = Coord(16, 16)
+    levelbytes = random_level_bytes(rand, dimensions, False) + b"\x00" * (2 * 256)
+    check_level_array(levelbytes, dimensions, True)
+    bit_array = leveldata_utils.bit_array_from_bytes(levelbytes, dimensions)
+    assert leveldata_utils.bytes_from_bit_array(bit_array) == levelbytes[:2 + 3 * 256] == reference_bytes_from_bit_array(bit_array)
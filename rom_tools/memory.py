@@ -1,3 +1,6 @@
+import bisect
+from collections import defaultdict
+
 from .address import Address
 from encoding import free_space
 
@@ -50,84 +53,164 @@ class Extent(object):
     def end(self):
         return self.start + Address(self.size-1)
 
-#TODO: maintain the invariant that extents are ordered by start address?
-# - makes it easy to check if there are overlapping extents
+# How to choose among the free extents that are big enough
+FIRST_FIT = "first_fit" # The extent at the lowest address
+BEST_FIT = "best_fit"   # The smallest extent, which leaves the big ones for big objects
+allocation_policies = [FIRST_FIT, BEST_FIT]
+
 class Bank(object):
     """A bank is a section of memory, some of which is free.
-       this is stored as a list of extents"""
+       The free space is stored as extents that are ordered by start address,
+       never overlap, and are never next to each other (adjacent ones are merged).
+       Addresses here are pc addresses as ints."""
 
     def __init__(self, bank_n):
         self.bank = bank_n
-        self.extent_list = []
+        # Start of each free extent, in order
+        self.starts = []
+        # Start -> size of each free extent
+        self.sizes = {}
+        # (size, start) of each free extent, in order - for best fit
+        self.by_size = []
+
+    @property
+    def extent_list(self):
+        return [Extent(Address(start), self.sizes[start]) for start in self.starts]
+
+    @extent_list.setter
+    def extent_list(self, extents):
+        self.starts = []
+        self.sizes = {}
+        self.by_size = []
+        for extent in extents:
+            self.add_extent(extent)
 
-    #TODO: assert no overlapping extents
-    #TODO: merge adjacent extents
     def add_extent(self, extent):
         assert(isinstance(extent, Extent))
         assert extent.start.bank == self.bank
         bank2 = extent.end.bank
-        assert bank2 == self.bank, "{} does not match {}".format(bank, bank2)
-        self.extent_list.append(extent)
+        assert bank2 == self.bank, "{} does not match {}".format(self.bank, bank2)
+        start = int(extent.start)
+        end = start + extent.size
+        i = bisect.bisect_left(self.starts, start)
+        assert i == len(self.starts) or self.starts[i] >= end, f"Free space {extent} overlaps {self.extent_list[i]}"
+        # Merge with the extents next to it
+        if i > 0:
+            before = self.starts[i - 1]
+            before_end = before + self.sizes[before]
+            assert before_end <= start, f"Free space {extent} overlaps {self.extent_list[i - 1]}"
+            if before_end == start:
+                start = before
+                self.remove(before)
+                i -= 1
+        if i < len(self.starts) and self.starts[i] == end:
+            end += self.sizes[end]
+            self.remove(self.starts[i])
+        self.insert(start, end - start)
+
+    def insert(self, start, size):
+        bisect.insort(self.starts, start)
+        self.sizes[start] = size
+        bisect.insort(self.by_size, (size, start))
+
+    def remove(self, start):
+        size = self.sizes.pop(start)
+        del self.starts[bisect.bisect_left(self.starts, start)]
+        del self.by_size[bisect.bisect_left(self.by_size, (size, start))]
 
     def __repr__(self):
         return f"{hex(self.bank)}: {str(self.extent_list)}"
 
-    #TODO: can use a fancier algorithm to decide where to find the space...
-    def get_place(self, size):
+    def find_place(self, size, policy=FIRST_FIT):
+        """Get the start of the free extent to use for size bytes, or None if none fit"""
+        assert(size > 0)
+        if policy == FIRST_FIT:
+            for start in self.starts:
+                if self.sizes[start] >= size:
+                    return start
+            return None
+        assert policy == BEST_FIT, f"Bad allocation policy: {policy}"
+        # Smallest extent that fits, at the lowest address of those
+        i = bisect.bisect_left(self.by_size, (size, -1))
+        if i == len(self.by_size):
+            return None
+        return self.by_size[i][1]
+
+    def claim(self, start, size):
+        """Take size bytes from the start of the free extent at start"""
+        extent_size = self.sizes[start]
+        assert size <= extent_size
+        self.remove(start)
+        if size < extent_size:
+            self.insert(start + size, extent_size - size)
+        return Address(start)
+
+    def get_place(self, size, policy=FIRST_FIT):
         """
-        Use first fit to find a place for the data
+        Find a place for the data, and mark it as filled
         """
-        assert(size > 0)
-        if len(self.extent_list) == 0:
+        start = self.find_place(size, policy)
+        if start is None:
             raise AllocationError
-        addr = None
-        remove = None
-        for (i, extent) in enumerate(self.extent_list):
-            # Use the first extent with enough space
-            if extent.has_space(size):
-                addr, to_delete = extent.claim_space(size)
-                # If the extent has zero bytes left after the allocation,
-                # mark it for removal
-                if to_delete:
-                    remove = i
-                break
-        # If this allocation resulted in an empty extent, remove it
-        if remove is not None:
-            self.extent_list.pop(remove)
-        if addr is None:
-            raise AllocationError
-        else:
-            return addr
+        return self.claim(start, size)
 
     def mark_filled(self, address, size):
-        new_extents = []
-        for extent in self.extent_list:
-            address_end = address + Address(size)
-            extent_end = extent.start + Address(extent.size)
-            # If it starts after or ends before, there's no intersection
-            overlap_start = max(extent.start, address)
-            overlap_end = min(extent_end, address_end)
+        start = int(address)
+        end = start + size
+        # The first extent that could overlap is the one that starts before address
+        i = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        overlapping = []
+        while i < len(self.starts) and self.starts[i] < end:
+            overlapping.append(self.starts[i])
+            i += 1
+        for extent_start in overlapping:
+            extent_end = extent_start + self.sizes[extent_start]
             # No overlap
-            if overlap_end <= overlap_start:
-                new_extents.append(extent)
-            else:
-                if overlap_start > extent.start:
-                    before = Extent(extent.start, int(address) - int(extent.start))
-                    new_extents.append(before)
-                if overlap_end < extent_end:
-                    after = Extent(address_end, int(extent_end) - int(address_end))
-                    new_extents.append(after)
-        self.extent_list = new_extents
+            if extent_end <= start:
+                continue
+            self.remove(extent_start)
+            if extent_start < start:
+                self.insert(extent_start, start - extent_start)
+            if end < extent_end:
+                self.insert(end, extent_end - end)
+
+    @property
+    def free_bytes(self):
+        return sum(self.sizes.values())
+
+    @property
+    def largest_free(self):
+        if len(self.by_size) == 0:
+            return 0
+        return self.by_size[-1][0]
+
+    @property
+    def fragmentation(self):
+        """How much of the free space is outside of the largest extent, from 0 to 1"""
+        free = self.free_bytes
+        if free == 0:
+            return 0
+        return 1 - self.largest_free / free
 
 class Memory(object):
 
-    def __init__(self, rom):
+    def __init__(self, rom, policy=FIRST_FIT):
         self.rom = rom
         self.banks = {}
         # essentially a dictionary of banks!
         #TODO: what if the ROM is extended?
         for n in range(0x80, 0xdf + 1):
             self.banks[n] = Bank(n)
+        # ObjNames from a lazy parse, which marks objects as filled as they get parsed
+        self.lazy_obj_names = None
+        assert policy in allocation_policies, f"Bad allocation policy: {policy}"
+        self.policy = policy
+        # (address, size) of everything allocated, in order
+        self.allocations = []
+        # Content key -> addresses that have that content, for allocate_shared
+        self.shared = defaultdict(list)
+        self.n_shared = 0
+        self.shared_bytes = 0
 
     def setup(self):
         """Sets up the memory with the default free space"""
@@ -137,20 +220,48 @@ class Memory(object):
             self.mark_free(addr, size)
 
     def allocate(self, size, banks):
-        """Try to allocate space for <data> in one of the given <banks>."""
-        address = None
+        """Try to allocate space for <data> in one of the given <banks>.
+        With first fit, the first bank that has space is used.
+        With best fit, the smallest extent that fits in any of the banks is used."""
         assert len(banks) > 0
-        banks = [self.banks[b] for b in banks]
-        for bank in banks:
-            try:
-                address = bank.get_place(size)
-            except AllocationError:
+        # Anything that hasn't been parsed yet hasn't been marked as filled
+        if self.lazy_obj_names is not None:
+            self.lazy_obj_names.resolve_all()
+        best = None
+        for b in banks:
+            bank = self.banks[b]
+            start = bank.find_place(size, self.policy)
+            if start is None:
                 continue
+            if self.policy == FIRST_FIT:
+                best = (bank, start)
+                break
+            if best is None or bank.sizes[start] < best[0].sizes[best[1]]:
+                best = (bank, start)
         # No place in any of the banks was found
-        if address is None:
-            raise AllocationError(f"No Memory Address could be found for {size} in {banks}")
-        else:
-            return address, bank
+        if best is None:
+            raise AllocationError(f"No Memory Address could be found for {size} in {[hex(b) for b in banks]}")
+        bank, start = best
+        address = bank.claim(start, size)
+        self.allocations.append((address, size))
+        return address
+
+    def allocate_shared(self, key, size, banks):
+        """Like allocate, but data with the same key as data that is already in one of
+        the banks shares its address. key identifies the data, like the data itself.
+        Returns the address, and whether it is shared."""
+        for address in self.shared[key]:
+            if address.bank in banks:
+                self.n_shared += 1
+                self.shared_bytes += size
+                return address, True
+        address = self.allocate(size, banks)
+        self.add_shared(key, address)
+        return address, False
+
+    def add_shared(self, key, address):
+        """Let later data with key share address"""
+        self.shared[key].append(address)
 
     def allocate_and_write(self, data, banks):
         """Try to allocate <data> in one of the <banks>, then
@@ -174,3 +285,19 @@ class Memory(object):
         bank = address.bank
         self.banks[bank].mark_filled(address, size)
 
+    def allocation_report(self):
+        """How much was allocated in each bank, and how much free space is left"""
+        allocated = defaultdict(lambda: [0, 0])
+        for address, size in self.allocations:
+            allocated[address.bank][0] += 1
+            allocated[address.bank][1] += size
+        lines = ["Bank  Allocations  Allocated     Free  Largest free  Extents  Fragmentation"]
+        for n, bank in self.banks.items():
+            count, total = allocated[n]
+            if count == 0 and len(bank.starts) == 0:
+                continue
+            lines.append(f"{hex(n)} {count:>12} {total:>10} {bank.free_bytes:>8} {bank.largest_free:>13} {len(bank.starts):>8} {bank.fragmentation:>14.1%}")
+        total_allocated = sum(size for _, size in self.allocations)
+        lines.append(f"{len(self.allocations)} allocations, {total_allocated} bytes ({self.policy})")
+        lines.append(f"{self.n_shared} shared with identical data, {self.shared_bytes} bytes saved")
+        return "\n".join(lines)
@@ -0,0 +1,127 @@
+# Checks Bank and Memory against a model of the free space as a set of free byte addresses,
+# with random frees, fills and allocations under both allocation policies.
+# Run from the repository root with:
+# python -m rom_tools.memory_test
+import random
+
+from rom_tools.address import Address
+from rom_tools.memory import Bank, Memory, Extent, AllocationError, FIRST_FIT, BEST_FIT
+
+def bank_start(bank_n):
+    """The pc address of the start of a (LoROM) bank"""
+    return (bank_n - 0x80) * 0x8000
+
+def runs(free):
+    """The maximal runs of consecutive addresses in free, as (start, size) in address order"""
+    out = []
+    for address in sorted(free):
+        if len(out) > 0 and out[-1][0] + out[-1][1] == address:
+            out[-1] = (out[-1][0], out[-1][1] + 1)
+        else:
+            out.append((address, 1))
+    return out
+
+def model_place(free, size, policy):
+    """Where the model would put size bytes, or None"""
+    fits = [(run_size, start) for start, run_size in runs(free) if run_size >= size]
+    if len(fits) == 0:
+        return None
+    if policy == FIRST_FIT:
+        return min(fits, key=lambda fit: fit[1])[1]
+    return min(fits)[1]
+
+def check_bank(bank, free):
+    extents = runs(free)
+    assert [(int(extent.start), extent.size) for extent in bank.extent_list] == extents
+    assert bank.by_size == sorted((size, start) for start, size in extents)
+    assert bank.free_bytes == len(free)
+    assert bank.largest_free == max([size for _, size in extents], default=0)
+
+def random_range(rand, base, span):
+    start = base + rand.randrange(span)
+    return start, rand.randint(1, min(64, base + span - start))
+
+def run_bank(rand, policy, n_steps, span=512):
+    bank_n = rand.choice([0x80, 0x8f, 0xdf])
+    base = bank_start(bank_n)
+    bank = Bank(bank_n)
+    free = set()
+    for _ in range(n_steps):
+        operation = rand.random()
+        if operation < 0.4:
+            start, size = random_range(rand, base, span)
+            new = set(range(start, start + size))
+            try:
+                bank.add_extent(Extent(Address(start), size))
+                added = True
+            except AssertionError:
+                added = False
+            # Free space that overlaps free space is an error
+            assert added == free.isdisjoint(new), (start, size)
+            if added:
+                free |= new
+        elif operation < 0.6:
+            start, size = random_range(rand, base, span)
+            bank.mark_filled(Address(start), size)
+            free -= set(range(start, start + size))
+        else:
+            size = rand.randint(1, 48)
+            start = model_place(free, size, policy)
+            try:
+                address = int(bank.get_place(size, policy))
+            except AllocationError:
+                address = None
+            assert address == start, (address, start, size)
+            if address is not None:
+                free -= set(range(address, address + size))
+        check_bank(bank, free)
+    # Setting the extent list rebuilds the same bank
+    copy = Bank(bank_n)
+    copy.extent_list = bank.extent_list
+    check_bank(copy, free)
+
+def run_memory(rand, policy, n_steps):
+    bank_ns = [0x8f, 0xa1, 0xb8]
+    memory = Memory(None, policy)
+    free = {bank_n: set() for bank_n in bank_ns}
+    for bank_n in bank_ns:
+        for _ in range(8):
+            start, size = random_range(rand, bank_start(bank_n), 1024)
+            new = set(range(start, start + size))
+            if free[bank_n].isdisjoint(new):
+                memory.mark_free(Address(start), size)
+                free[bank_n] |= new
+    for _ in range(n_steps):
+        size = rand.randint(1, 48)
+        banks = rand.sample(bank_ns, rand.randint(1, len(bank_ns)))
+        # First fit takes the first bank with room, best fit the smallest extent of any of them
+        places = []
+        for bank_n in banks:
+            start = model_place(free[bank_n], size, policy)
+            if start is not None:
+                run_size = dict(runs(free[bank_n]))[start]
+                places.append((run_size, bank_n, start))
+        expected = None
+        if len(places) > 0:
+            if policy == FIRST_FIT:
+                _, bank_n, expected = places[0]
+            else:
+                smallest = min(run_size for run_size, _, _ in places)
+                _, bank_n, expected = next(place for place in places if place[0] == smallest)
+        try:
+            address = int(memory.allocate(size, banks))
+        except AllocationError:
+            address = None
+        assert address == expected, (address, expected, size)
+        if address is not None:
+            free[bank_n] -= set(range(address, address + size))
+            assert memory.allocations[-1] == (Address(address), size)
+        for bank_n in bank_ns:
+            check_bank(memory.banks[bank_n], free[bank_n])
+
+if __name__ == "__main__":
+    rand = random.Random(0)
+    for policy in [FIRST_FIT, BEST_FIT]:
+        for _ in range(20):
+            run_bank(rand, policy, 300)
+            run_memory(rand, policy, 100)
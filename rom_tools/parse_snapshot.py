@@ -0,0 +1,69 @@
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+from . import rom_data_structures
+from .compress import compression_cache
+
+# Parsing a clean rom always gives the same objects and the same free space,
+# so the result of RomManager.parse is pickled next to the rom and loaded by later runs.
+# Snapshots are keyed by the checksum of the rom and by the parsing code,
+# so a different rom or a change to the parser never loads a stale snapshot.
+
+# Bump this whenever a change outside of snapshot_sources makes old snapshots stale
+snapshot_version = 1
+
+# The code that determines what a parse produces (the objects, the decompressed level data
+# and the free space), relative to the repository root
+snapshot_sources = [
+    "rom_tools/rom_data_structures.py",
+    "rom_tools/leveldata_utils.py",
+    "rom_tools/memory.py",
+    "rom_tools/address.py",
+    "rom_tools/rom_manager.py",
+    "rom_tools/compress/decompress.py",
+    "encoding/free_space.py",
+]
+
+def code_hash():
+    h = hashlib.sha256(str(snapshot_version).encode())
+    repo_dir = Path(__file__).parent.parent
+    for source in snapshot_sources:
+        h.update((repo_dir / source).read_bytes())
+    return h.hexdigest()
+
+def snapshot_path(clean_name, rom_checksum):
+    clean_name = Path(clean_name)
+    name = "{}_{}_{}.pickle".format(clean_name.stem, rom_checksum[:16], code_hash()[:16])
+    return clean_name.parent / ".parse_cache" / name
+
+def load(path, memory):
+    """Load the ObjNames from a snapshot and put its free space into memory.
+    Returns None if there is no usable snapshot"""
+    try:
+        with open(path, "rb") as f:
+            obj_names, extent_lists = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+    for bank_n, extent_list in extent_lists.items():
+        memory.banks[bank_n].extent_list = extent_list
+    # The parse would have told the cache how the clean rom compresses its levels
+    for obj in obj_names.values():
+        if isinstance(obj, rom_data_structures.LevelData):
+            compression_cache.level_data_cache.put_clean(obj.level_bytes, obj.compressed_data)
+    return obj_names
+
+def save(path, obj_names, memory):
+    """Save a snapshot of a full parse, and of the memory after it"""
+    extent_lists = {bank_n: bank.extent_list for bank_n, bank in memory.banks.items()}
+    try:
+        path.parent.mkdir(exist_ok=True)
+        # Write then rename so that concurrent processes never see half a file
+        tmp_path = path.with_name(path.name + ".{}.tmp".format(os.getpid()))
+        with open(tmp_path, "wb") as f:
+            pickle.dump((obj_names, extent_lists), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    # The snapshot is only an optimization
+    except OSError:
+        pass
@@ -1,5 +1,6 @@
 from functools import reduce, wraps
 import inspect
+import json
 from enum import IntEnum
 import numpy as np
 from collections.abc import MutableMapping
@@ -8,6 +9,8 @@ from . import byte_ops
 from .address import *
 from .compress import compress
 from .compress import decompress
+from .compress import compression_cache
+from .compress import match_finder
 from . import leveldata_utils
 
 #TODO: A way to save the original bytes and decide whether an object has changed...
@@ -62,6 +65,24 @@ class FutureBytes(object):
     def __repr__(self):
         return f"FutureBytes({self.obj}, {self.size}, {self.banks})"
 
+def content_key(b_list):
+    """Identifies compiled bytes that will resolve to the same thing.
+    A pointer is identified by where its object is, or if it hasn't been allocated yet,
+    by the object itself."""
+    key = []
+    for b in b_list:
+        if type(b) is bytes:
+            key.append(b)
+        elif type(b) is FutureBytes:
+            obj = b.obj
+            if getattr(obj, "address", None) is not None and not hasattr(obj, "ptr_bytes"):
+                key.append((b.size, obj.address.as_pc))
+            else:
+                key.append((b.size, object.__getattribute__(obj, "name")))
+        else:
+            raise TypeError(f"Cannot find the content key for an object of type {type(b)}")
+    return tuple(key)
+
 def byte_size(byte_obj):
     if type(byte_obj) is bytes:
         return len(byte_obj)
@@ -253,7 +274,11 @@ def pointer_def(constructor, ptr_size, banks, invalid_bytes=None, invalid_ok=Fal
             address = address + Address((bank << 16) + 0x8000, mode="snes")
         #print(f"Pointer to {hex(address.as_pc)}")
         name = constructor.name_def.format(address)
-        parser(address, obj_names, rom, data)
+        # A lazy parse follows the pointer when the object is first used
+        if obj_names.lazy:
+            obj_names.defer(name, parser, address, rom, data)
+        else:
+            parser(address, obj_names, rom, data)
         return name, ptr_size
 
     def pointer_compiler(obj, rom):
@@ -287,15 +312,22 @@ def pointer_def(constructor, ptr_size, banks, invalid_bytes=None, invalid_ok=Fal
             # If the object already has a place on the rom, allocate it there
             #TODO: the new size can be larger as long as it extends into free space
             #TODO: allocation should be the responsibility of pointer_def?
+            # Objects with the same bytes share one copy (see Memory.allocate_shared)
+            key = content_key(obj.bytes)
             if old_address is not None and obj_size <= obj.old_size:
                 #if obj_size < obj.old_size:
                 #    print("Compiled object {} is smaller".format(obj.name))
                 assert old_address.bank in banks
                 obj.address = old_address
+                rom.memory.add_shared(key, old_address)
             else:
                 #print(banks)
-                addr, bank = rom.memory.allocate(obj_size, banks)
-                print(f"Allocating compiled object {obj.name} of size {obj_size} at {addr} in {bank}. Old size: {obj.old_size}")
+                addr, shared = rom.memory.allocate_shared(key, obj_size, banks)
+                if shared:
+                    # The bytes are already written there by another object
+                    obj.shared = True
+                else:
+                    print(f"Allocating compiled object {obj.name} of size {obj_size} at {addr} in {hex(addr.bank)}. Old size: {obj.old_size}")
                 obj.address = addr
         return FutureBytes(obj, ptr_size, banks)
 
@@ -319,7 +351,8 @@ def parse_wrapper(constructor):
             name = constructor.name_def.format(address)
             # Use the address as the name for parsing
             # Already being parsed
-            if name in obj_names:
+            # (A lazy parse may have found a pointer to it without following it yet)
+            if name in obj_names and not obj_names.is_pending(name):
                 return
             # Register it first so that it won't be processed twice
             obj_names[name] = None
@@ -333,6 +366,7 @@ def parse_wrapper(constructor):
             s = constructor(name, address, size, obj_names, *s_objs)
             # Register the real value
             obj_names[name] = s
+            obj_names.mark_parsed(s)
             return name, size
         return wrapper
     return inner
@@ -507,28 +541,75 @@ state_condition_fns = (parse_state_condition, compile_state_condition)
 
 class ObjNames(MutableMapping):
     """ Glorified dict that keeps track of IDs to
-    allow for the creation of new objects with unique names. """
+    allow for the creation of new objects with unique names.
+    With lazy, pointers found while parsing are only followed when the object they
+    point to is looked up. Iterating parses everything that hasn't been parsed yet.
+    memory is marked as filled by each object when it gets parsed. """
 
-    def __init__(self):
+    def __init__(self, lazy=False, memory=None):
         self.d = {}
         self.new_obj_id = 0
+        self.lazy = lazy
+        self.memory = memory
+        # name -> (parser, address, rom, data) for pointers that haven't been followed
+        self.pending = {}
 
     #TODO: Suggestions in KeyError
     def __getitem__(self, k):
-        return self.d[k]
+        if k in self.d:
+            return self.d[k]
+        if k in self.pending:
+            self.resolve(k)
+            return self.d[k]
+        # It may be behind a pointer that hasn't been found yet
+        while len(self.pending) > 0:
+            self.resolve(next(iter(self.pending)))
+            if k in self.d:
+                return self.d[k]
+        raise KeyError(k)
 
     def __setitem__(self, k, v):
+        self.pending.pop(k, None)
         self.d[k] = v
 
+    def __contains__(self, k):
+        # Only the names found so far, so that this doesn't parse anything
+        return k in self.d or k in self.pending
+
     def __iter__(self):
+        self.resolve_all()
         return self.d.__iter__()
     
     def __len__(self):
+        self.resolve_all()
         return self.d.__len__()
 
     def __delitem__(self, k):
+        self.pending.pop(k, None)
         return self.d.__delitem__(k)
 
+    def defer(self, name, parser, address, rom, data):
+        """Remember how to parse name, to do when it is looked up"""
+        if name not in self:
+            self.pending[name] = (parser, address, rom, data)
+
+    def is_pending(self, name):
+        return name in self.pending
+
+    def resolve(self, name):
+        """Parse a deferred object"""
+        parser, address, rom, data = self.pending.pop(name)
+        parser(address, self, rom, data)
+
+    def resolve_all(self):
+        while len(self.pending) > 0:
+            self.resolve(next(iter(self.pending)))
+
+    def mark_parsed(self, obj):
+        """Mark the place an object was parsed from as filled"""
+        if self.memory is not None and type(obj.old_address) is Address:
+            self.memory.mark_filled(obj.old_address, obj.old_size)
+
     def get_new_name(self, constructor):
         obj_name = constructor.name_def.format(self.new_obj_id)
         self.new_obj_id += 1
@@ -1043,6 +1124,52 @@ class LevelData(RomObject):
     def parse_definition():
         assert False
 
+    # A lazy parse only reads compressed_data, and leaves level_bytes and level_array as None
+    # along with the room dimensions to decode them with.
+    # The level is decompressed when level_bytes or level_array is first used.
+    def __init__(self, name, old_address, old_size, obj_names, level_bytes, level_array, compressed_data,
+                 dimensions=None):
+        self._dimensions = dimensions
+        super().__init__(name, old_address, old_size, obj_names, level_bytes, level_array, compressed_data)
+
+    @property
+    def level_bytes(self):
+        self.decompress_level()
+        return self._level_bytes
+
+    @level_bytes.setter
+    def level_bytes(self, value):
+        self._level_bytes = value
+
+    @property
+    def level_array(self):
+        self.decompress_level()
+        return self._level_array
+
+    @level_array.setter
+    def level_array(self, value):
+        self._level_array = value
+
+    @property
+    def compressed_data(self):
+        return self._compressed_data
+
+    @compressed_data.setter
+    def compressed_data(self, value):
+        # Setting it to None forces recompression, so the level can't be decompressed later
+        if value is None and hasattr(self, "_compressed_data"):
+            self.decompress_level()
+        self._compressed_data = value
+
+    def decompress_level(self):
+        # Only a lazily parsed level has anything to decode
+        if self._level_array is not None or self._dimensions is None:
+            return
+        level_bytes, _ = decompress.decompress_with_size(self._compressed_data)
+        compression_cache.level_data_cache.put_clean(level_bytes, self._compressed_data)
+        self._level_bytes = level_bytes
+        self._level_array = leveldata_utils.level_array_from_bytes(level_bytes, self._dimensions)
+
 @parse_wrapper(LevelData)
 def level_data_parser(address, obj_names, rom, data):
     room_width, room_height = data
@@ -1051,23 +1178,41 @@ def level_data_parser(address, obj_names, rom, data):
     #TODO: the total amount of level data could theoretically exceed this with bad compression
     max_data = 5 * room_width * 16 * room_height * 16
     max_bytes = rom.read_from_clean(address, max_data)
+    level_dimensions = leveldata_utils.Coord(room_width * 16, room_height * 16)
     # Return the size of the COMPRESSED data (for allocation purposes)
     # The new room could fit at the location where it originally existed
     #print(address)
+    if obj_names.lazy:
+        # Only find where the compressed data ends (see LevelData.decompress_level)
+        _, size = decompress.decompressed_size(max_bytes)
+        return [None, None, rom.read_from_clean(address, size), level_dimensions], size
     level_bytes, size = decompress.decompress_with_size(max_bytes)
     compressed_data = rom.read_from_clean(address, size)
-    level_dimensions = leveldata_utils.Coord(room_width * 16, room_height * 16)
+    # So that any level data that is the same as this compiles to the same bytes
+    compression_cache.level_data_cache.put_clean(level_bytes, compressed_data)
     level_array = leveldata_utils.level_array_from_bytes(level_bytes, level_dimensions)
     return [level_bytes, level_array, compressed_data], size
 
+# How level data that isn't cached is compressed on compile: optimal_compress with the match finder
+# at level_data_compress_level (see match_finder.level_chain_depths), except that level data longer than
+# level_data_optimal_limit bytes uses greedy_compress - optimal_compress gets much slower on long data
+level_data_compress_level = match_finder.default_level
+level_data_optimal_limit = 1 << 13
+
+def compress_level_bytes(level_bytes):
+    if len(level_bytes) > level_data_optimal_limit:
+        return compress.greedy_compress(level_bytes, level=level_data_compress_level)
+    return compress.optimal_compress(level_bytes, level=level_data_compress_level)
+
 @compile_wrapper
 def level_data_compiler(obj, rom):
     # If the object was parsed, we already know the compressed data
     # Can set this field to None in order to force recompression on compile
+    # (level data that has been compressed before comes from the cache)
     if obj.compressed_data is not None:
         return [obj.compressed_data]
     else:
-        compressed_bytes = compress.greedy_compress(obj.level_bytes)
+        compressed_bytes = compression_cache.level_data_cache.compress(obj.level_bytes, compress_level_bytes)
         return [compressed_bytes]
 
 LevelData.fns = (level_data_parser, level_data_compiler)
@@ -1168,19 +1313,68 @@ def scrolls_compiler(obj, rom):
 Scrolls.fns = (scrolls_parser, scrolls_compiler)
 
 # Parsing
-def parse_from_savestations(savestation_addrs, rom):
-    obj_names = ObjNames()
+def parse_from_savestations(savestation_addrs, rom, lazy=False):
+    """Parse everything reachable from the save stations.
+    With lazy, only the save stations are parsed now (see ObjNames)"""
+    if lazy:
+        obj_names = ObjNames(lazy=True, memory=rom.memory)
+    else:
+        obj_names = ObjNames()
     for addr in savestation_addrs:
         SaveStation.fns[0](addr, obj_names, rom, None)
     return obj_names
 
 # Compiling
-def compile_from_savestations(savestation_objs, obj_names, rom):
+def resolve_bytes(b_list):
+    """Join compiled bytes into real bytes, now that every object has an address"""
+    # Use mutable bytearray for speed
+    obj_bytes = bytearray()
+    for b in b_list:
+        if type(b) is bytes:
+            obj_bytes += b
+        elif type(b) is FutureBytes:
+            obj_bytes += b.resolve()
+        else:
+            raise TypeError
+    return bytes(obj_bytes)
+
+def coalesce_writes(writes):
+    """Sort (pc address, bytes) writes by address and merge the ones that touch into runs.
+    Where writes overlap, the one that starts later wins."""
+    runs = []
+    for start, data in sorted(writes, key=lambda w: w[0]):
+        if len(runs) > 0 and start <= runs[-1][0] + len(runs[-1][1]):
+            run_start, run = runs[-1]
+            offset = start - run_start
+            run[offset:offset + len(data)] = data
+        else:
+            runs.append((start, bytearray(data)))
+    return runs
+
+def write_link_map(link_map, objs):
+    """Write the name, bank, address and size of every compiled object as json"""
+    entries = []
+    for obj in objs:
+        entries.append({
+            "name": obj.name,
+            "type": type(obj).__name__,
+            "bank": hex(obj.address.bank),
+            "address": hex(obj.address.as_snes),
+            "pc": hex(obj.address.as_pc),
+            "size": len(obj.true_bytes),
+            "shared": hasattr(obj, "shared"),
+        })
+    entries.sort(key=lambda entry: int(entry["pc"], 16))
+    with open(link_map, "w") as f:
+        json.dump(entries, f, indent=1)
+
+def compile_from_savestations(savestation_objs, obj_names, rom, link_map=None):
+    """Compile everything reachable from the save stations into rom.
+    link_map is a file to write the address of every object to (see write_link_map)"""
     # Allocation
     print("ALLOCATION")
     # Adds "address" and "bytes" fields to each object
-    #TODO: Use a dictionary from bank -> bytes -> address (hash FutureAddress by name, size)
-    # to avoid repetition (each compiler can check before allocation)
+    # Objects with the same bytes are allocated once (see pointer_def)
     for obj in savestation_objs:
         # Do not allow Save Stations to be allocated outside of their normal location
         # Levels built from scratch should include old_address for savesation objects
@@ -1189,28 +1383,22 @@ def compile_from_savestations(savestation_objs, obj_names, rom):
         SaveStation.fns[1](obj, rom)
         obj.address = obj.old_address
         #print("Done with {}".format(obj.name))
+    print(rom.memory.allocation_report())
     print("POINTER RESOLUTION")
-    # Pointer resolution
-    for name, obj in obj_names.items():
-        # Use mutable bytearray for speed
-        obj_bytes = bytearray()
-        #print(name)
-        #print(obj.name)
-        #print(obj.bytes)
-        # Objects no longer pointed to are not compiled
-        if hasattr(obj, "bytes"):
-            for i,b in enumerate(obj.bytes):
-                if type(b) is bytes:
-                    obj_bytes += b
-                elif type(b) is FutureBytes:
-                    obj_bytes += b.resolve()
-                else:
-                    raise TypeError
-            # Set it
-            obj.true_bytes = bytes(obj_bytes)
+    # Every object has its address now, so pointers resolve in any order
+    # Objects no longer pointed to are not compiled,
+    # and objects inside other objects are part of their bytes
+    compiled = [obj for obj in obj_names.values() if hasattr(obj, "bytes") and hasattr(obj, "address")]
+    writes = []
+    for obj in compiled:
+        obj.true_bytes = resolve_bytes(obj.bytes)
+        # Shared objects are written by the object they share with
+        if not hasattr(obj, "shared"):
+            writes.append((obj.address.as_pc, obj.true_bytes))
     print("WRITING")
-    # Write bytes out
-    for obj in obj_names.values():
-        if hasattr(obj, "address"):
-            rom.write_to_new(obj.address, obj.true_bytes)
-
+    runs = coalesce_writes(writes)
+    for start, run in runs:
+        rom.write_to_new(Address(start), run)
+    print(f"{len(writes)} objects written in {len(runs)} runs")
+    if link_map is not None:
+        write_link_map(link_map, compiled)
@@ -48,12 +48,25 @@ def parse_patches(patch_file):
     f.close()
     return patches
 
+# The parsed encoding files, so that a process that makes many roms only reads each of them once
+# key - (parse function name, file name[, clean rom file name])
+# value - the parsed dictionaries, which are copied before being handed out
+encoding_library = {}
+
 def parse_doors(door_file, rom):
     """Use the door definitions files so that door nodes can be used to access
     door data. Creates two dictionaries, from and to. From is indexed by door names
     and has the memory address for each door. Writing to that memory address will alter
     that door. To is indexed by door name, and contains the door data. Writing this memory
     to another door memory address with make that door lead to the specified door."""
+    key = ("parse_doors", str(door_file), rom.clean_name)
+    if key not in encoding_library:
+        encoding_library[key] = read_doors(door_file, rom)
+    door_from, door_to = encoding_library[key]
+    return door_from.copy(), door_to.copy()
+
+def read_doors(door_file, rom):
+    """Reads the door definitions file for parse_doors"""
     f = open(door_file, "r")
     # key - door name
     # value - memory address of that door
@@ -111,6 +124,12 @@ def make_doors(door_list, rom, extra_from, extra_to):
                 rom.write_to_new(door_from[door2], door_to[door1])
 
 def parse_item_locations(item_locations_file):
+    key = ("parse_item_locations", str(item_locations_file))
+    if key not in encoding_library:
+        encoding_library[key] = read_item_locations(item_locations_file)
+    return encoding_library[key].copy()
+
+def read_item_locations(item_locations_file):
     f = open(item_locations_file)
     # key - item node name
     # value - (memory_address, location_type)
@@ -137,6 +156,12 @@ def make_items(item_list, rom):
             rom.write_to_new(address, item_defns[item][location_type])
 
 def parse_saves(save_file):
+    key = ("parse_saves", str(save_file))
+    if key not in encoding_library:
+        encoding_library[key] = read_saves(save_file)
+    return encoding_library[key].copy()
+
+def read_saves(save_file):
     f = open(save_file, "r")
     # Key - save room door
     # Value - address of the door data used by that save room
@@ -414,7 +439,6 @@ def room_copy(room_info, free_8f, free_83, rom):
     # Value - Door data
     door_to = {}
     # To fill in door_to, need the original door data for doors that lead into the room
-    #TODO: call this only once instead of every time we need them!!
     _, global_door_to = parse_doors("encoding/dsl/door_defns.txt", rom)
     for i in range(n_doors):
         door_data = global_door_to[original_door_names[i]]
@@ -12,6 +12,7 @@ from .address import Address
 from .compress import decompress
 from .compress import compress
 from . import rom_data_structures
+from . import parse_snapshot
 
 # Addresses of the maps for the different regions
 # https://patrickjohnston.org/bank/82#f9717
@@ -47,27 +48,52 @@ class RomManager(object):
        Also *eventually* will be able to detect if your rom is `pure` and apply
        some necessary patches auto-magically"""
 
-    def __init__(self,clean_name,new_name):
+    def __init__(self,clean_name,new_name,clean_data=None,in_memory=False):
+        """With in_memory, the roms are kept in memory instead of being edited on disk.
+        The new rom is only written to new_name by save_and_close, and new_name can be None
+        to not write a file at all - use to_bytes to get the new rom."""
         assert clean_name != new_name, "The new rom name cannot be the same as the clean rom name!"
         #TODO: assert that clean_name refers to an actual file,
         # and that new_name does not refer to an existing file
-        self.load_rom(clean_name, new_name)
+        self.in_memory = in_memory
+        self.load_rom(clean_name, new_name, clean_data=clean_data)
         # Create a memory model for the new ROM
         self.memory = Memory(self)
         self.memory.setup()
 
-    def load_rom(self, clean_name, new_name, mod=True):
-        """Opens the files associated with the clean rom and the modded rom"""
+    def load_rom(self, clean_name, new_name, mod=True, clean_data=None):
+        """Opens the files associated with the clean rom and the modded rom.
+        clean_data is the contents of the clean rom, if they have already been read
+        (when making many roms from the same clean rom)"""
 
         pure_rom_sum = '21f3e98df4780ee1c667b84e57d88675'
         modded_rom_sum = 'idk'
         pure_rom_size = 3145728
 
-        # First, make a copy of clean_name as new_name
-        copy_file(clean_name, new_name)
+        self.clean_name = str(clean_name)
+        self.new_name = new_name
+        if self.in_memory:
+            if clean_data is None:
+                with open(clean_name, "rb") as clean_file:
+                    clean_data = clean_file.read()
+            assert len(clean_data) == pure_rom_size, "Rom is headered!"
+            self.clean_data = bytes(clean_data)
+            self.new_data = bytearray(clean_data)
+            self.clean_rom = None
+            self.new_rom = None
+            if mod:
+                self.mod_rom()
+            return
 
-        checksum = _checksum(new_name)
-        filesize = _file_length(new_name)
+        # First, make a copy of clean_name as new_name
+        if clean_data is None:
+            copy_file(clean_name, new_name)
+            checksum = _checksum(new_name)
+            filesize = _file_length(new_name)
+        else:
+            with open(new_name, "wb") as new_file:
+                new_file.write(clean_data)
+            filesize = len(clean_data)
         # TODO: Check and decapitate...
         # But what to do with the clean one? If we are going to 
         # copy data from the clean one, we need it to be unheadered,
@@ -145,24 +171,46 @@ class RomManager(object):
 
     def save_and_close(self):
         """ Saves all changes to the rom, for now that just closes it"""
+        if self.in_memory:
+            if self.new_name is not None:
+                with open(self.new_name, "wb") as new_file:
+                    new_file.write(self.new_data)
+            return
         self.clean_rom.close()
         self.new_rom.close()
         self.clean_rom = None
         self.new_rom = None
 
+    def to_bytes(self):
+        """The contents of the new rom. Only for in_memory roms"""
+        assert self.in_memory, "to_bytes needs an in_memory rom"
+        return bytes(self.new_data)
+
     def write_to_new(self, offset, data):
         """Write data to offset in the new rom"""
+        if self.in_memory:
+            pc = offset.as_pc
+            # Slice assignment would grow the rom instead of failing
+            assert pc + len(data) <= len(self.new_data), "Write past the end of the rom: {}".format(offset)
+            self.new_data[pc:pc + len(data)] = data
+            return
         self.new_rom.seek(offset.as_pc)
         self.new_rom.write(data)
 
     def read_from_new(self, offset, n_bytes):
         """Read n bytes from the new rom at offset"""
+        if self.in_memory:
+            pc = offset.as_pc
+            return bytes(self.new_data[pc:pc + n_bytes])
         self.new_rom.seek(offset.as_pc)
         r = self.new_rom.read(n_bytes)
         return r
 
     def read_from_clean(self, offset, n_bytes):
         """Read n bytes from the clean rom at offset"""
+        if self.in_memory:
+            pc = offset.as_pc
+            return self.clean_data[pc:pc + n_bytes]
         self.clean_rom.seek(offset.as_pc)
         r = self.clean_rom.read(n_bytes)
         return r
@@ -276,7 +324,26 @@ class RomManager(object):
             address += save_station_size
         return addrs
 
-    def parse(self):
+    def clean_checksum(self):
+        if self.in_memory:
+            return md5(self.clean_data).hexdigest()
+        return _checksum(self.clean_name)
+
+    def parse(self, lazy=False, snapshot=False):
+        """Parse the rom into an ObjNames of everything reachable from the save stations.
+        With lazy, objects are only parsed (and level data decompressed) when they're used.
+        Either way, the places that get parsed are marked as filled in self.memory.
+        With snapshot, the parse is loaded from (or saved to) a snapshot next to the clean rom
+        (see parse_snapshot). This replaces the free space in self.memory, so do it before
+        allocating anything."""
+        if snapshot:
+            assert not lazy, "Only a full parse can be saved as a snapshot"
+            path = parse_snapshot.snapshot_path(self.clean_name, self.clean_checksum())
+            obj_names = parse_snapshot.load(path, self.memory)
+            if obj_names is None:
+                obj_names = self.parse()
+                parse_snapshot.save(path, obj_names, self.memory)
+            return obj_names
         # Vanilla Savestations
         crateria_save_table = Address(0x0044c5, mode="pc")
         crateria_savestations = self.save_table_entries(crateria_save_table)
@@ -299,7 +366,12 @@ class RomManager(object):
         #TODO: what about Ceres?
         all_saves = crateria_savestations + brinstar_savestations + norfair_savestations + \
                 wrecked_ship_savestations + maridia_savestations + tourian_savestations
-        obj_names = rom_data_structures.parse_from_savestations(all_saves, self)
+        obj_names = rom_data_structures.parse_from_savestations(all_saves, self, lazy=lazy)
+        # A lazy parse marks objects as they get parsed (see ObjNames.mark_parsed),
+        # and parses the rest before anything is allocated
+        if lazy:
+            self.memory.lazy_obj_names = obj_names
+            return obj_names
         # Register the objects with the memory model so that we don't allocate new levels
         # on top of existing ones
         for obj in obj_names.values():
@@ -311,8 +383,10 @@ class RomManager(object):
         self.memory = Memory(self)
         self.memory.setup()
 
-    def compile(self, obj_names):
+    def compile(self, obj_names, link_map=None):
+        """Compile obj_names into the new rom.
+        link_map is a file to write the address of every compiled object to"""
         all_saves = [obj for obj in obj_names.values() if isinstance(obj, rom_data_structures.SaveStation)]
         print(f"Saves: {all_saves}")
-        rom_data_structures.compile_from_savestations(all_saves, obj_names, self)
+        rom_data_structures.compile_from_savestations(all_saves, obj_names, self, link_map=link_map)
 
@@ -1,10 +1,13 @@
 # Data types for concrete map creation
 import collections
+import functools
 import heapq
 import random
 from enum import Enum
 from typing import Dict, Set, List
 
+import numpy as np
+
 from world_rando.coord import Coord, Rect
 
 class Path(object):
@@ -78,10 +81,43 @@ def rand_d(p1, p2):
     """Randomized Euclidean distance"""
     return euclidean(p1, p2) + random.uniform(0, 9)
 
+# Searches over a map with dimensions use flat indices into the grid,
+# with index = y * width + x so that the indices sort the same way as Coord
+@functools.lru_cache(maxsize=None)
+def grid_coords(dimensions):
+    """The Coord for each flat index"""
+    width, height = dimensions
+    return [Coord(x, y) for y in range(height) for x in range(width)]
+
+@functools.lru_cache(maxsize=None)
+def grid_neighbors(dimensions):
+    """The in-bounds neighbors of each flat index, in the same order as Coord.neighbors"""
+    width, height = dimensions
+    neighbors = []
+    for y in range(height):
+        for x in range(width):
+            i = y * width + x
+            n = []
+            if x > 0:
+                n.append(i - 1)
+            if y > 0:
+                n.append(i - width)
+            if x < width - 1:
+                n.append(i + 1)
+            if y < height - 1:
+                n.append(i + width)
+            neighbors.append(tuple(n))
+    return neighbors
+
 class ConcreteMap(object):
     """
     Stores the information for a concrete map: What tiles are where.
     Provides search abilities, etc.
+    A map with dimensions also keeps [x, y] grids of which tiles are in the map and
+    which are fixed, which the searches and compose use instead of the tiles dict.
+    Only cmap[coord] = tile keeps the grids up to date - writing to .tiles directly bypasses
+    occupied and fixed, so the searches and compose won't see the change.
+    The is_fixed of a tile should not change while it is in a map.
     """
 
     # Avoid the infamous default value bug!
@@ -94,6 +130,27 @@ class ConcreteMap(object):
             self.tiles = {}
         else:
             self.tiles = _tiles
+        if _dimensions is not None:
+            self.occupied = np.zeros(tuple(_dimensions), dtype=bool)
+            self.fixed = np.zeros(tuple(_dimensions), dtype=bool)
+            for c, t in self.tiles.items():
+                if self.in_bounds(c):
+                    self.occupied[c] = True
+                    self.fixed[c] = t.is_fixed
+
+    def flat(self, grid):
+        """A grid as a list by flat index"""
+        return grid.ravel(order="F").tolist()
+
+    def reach_test(self, reach_pred):
+        """A test on flat indices for reach_pred.
+        step_on and can_place are looked up in the grids."""
+        if reach_pred == self.step_on:
+            return self.flat(self.occupied & ~self.fixed).__getitem__
+        if reach_pred == self.can_place:
+            return self.flat(~self.fixed).__getitem__
+        coords = grid_coords(self.dimensions)
+        return lambda i: reach_pred(coords[i])
 
     def in_bounds(self, coord):
         """Is the given coord in bounds?"""
@@ -117,10 +174,29 @@ class ConcreteMap(object):
         #TODO: and has the same dimensions as before?
         return ConcreteMap(self.dimensions, _tiles=new_tiles)
 
+    def collides(self, other, offset=Coord(0,0)):
+        """Would any tile of other, moved by offset, be out of bounds or on a tile of self?"""
+        assert self.dimensions is not None
+        if len(other) == 0:
+            return False
+        xy = np.array(list(other.keys()), dtype=int) + np.array(offset, dtype=int)
+        width, height = self.dimensions
+        x, y = xy[:, 0], xy[:, 1]
+        if x.min() < 0 or y.min() < 0 or x.max() >= width or y.max() >= height:
+            return True
+        return bool(self.occupied[x, y].any())
+
     def compose(self, other, offset=Coord(0,0), collision_policy="error"):
         """Returns a new cmap which is a composition of self and other.
         If self and other share a maptile, then the collision policy decides."""
-        new_tiles = {}
+        # Find out if there will be a collision before copying anything
+        if collision_policy == "none" and self.dimensions is not None and self.collides(other, offset):
+            return None
+        new_cmap = ConcreteMap(self.dimensions)
+        if self.dimensions is not None:
+            new_cmap.occupied = self.occupied.copy()
+            new_cmap.fixed = self.fixed.copy()
+        new_tiles = new_cmap.tiles
         for c, t in self.items():
             # Use a copy to avoid duplicates
             new_tiles[c] = t.copy()
@@ -139,9 +215,9 @@ class ConcreteMap(object):
                 else:
                     assert False, "Bad collision policy: " + collision_policy
             else:
-                new_tiles[c_o] = t.copy()
+                new_cmap[c_o] = t.copy()
         #TODO: which dimensions does it get?
-        return ConcreteMap(self.dimensions, _tiles=new_tiles)
+        return new_cmap
 
     #TODO: some optimizations can be made
     #TODO: use heapdict instead of heapq
@@ -153,6 +229,30 @@ class ConcreteMap(object):
         search tiles outside the bounds of the ConcreteMap, ensuring the search space is finite. """
         self.assert_in_bounds(start)
         self.assert_in_bounds(goal)
+        if self.dimensions is None:
+            return self.dict_map_search(start, goal, reach_pred, dist)
+        coords = grid_coords(self.dimensions)
+        neighbors = grid_neighbors(self.dimensions)
+        reach = self.reach_test(reach_pred)
+        width = self.dimensions[0]
+        s = start.y * width + start.x
+        g = goal.y * width + goal.x
+        h = [(0, s)]
+        # flat index -> flat index that offered it
+        offers = {s: s}
+        while len(h) > 0:
+            _, pos = heapq.heappop(h)
+            if pos == g:
+                return {coords[a]: coords[b] for a, b in offers.items()}, set(coords[a] for a in offers)
+            for a in neighbors[pos]:
+                if a not in offers and reach(a):
+                    heapq.heappush(h, (dist(coords[a], goal), a))
+                    offers[a] = pos
+        # not found
+        return None
+
+    def dict_map_search(self, start, goal, reach_pred, dist):
+        """map_search for a map without dimensions"""
         h = []
         finished = set([start])
         offers = {start: start}
@@ -174,6 +274,29 @@ class ConcreteMap(object):
         """bfs over nodes satisfying reach_pred. If goal_pred is None, just returns all there was to see.
         If goal_pred is not none, searches for a node satisfying goal_pred."""
         self.assert_in_bounds(start)
+        if self.dimensions is None:
+            return self.dict_map_bfs(start, goal_pred, reach_pred)
+        coords = grid_coords(self.dimensions)
+        neighbors = grid_neighbors(self.dimensions)
+        reach = self.reach_test(reach_pred)
+        s = start.y * self.dimensions[0] + start.x
+        q = collections.deque([s])
+        # flat index -> flat index that offered it, in the order they were found
+        offers = {s: s}
+        def result(goal):
+            return goal, {coords[a]: coords[b] for a, b in offers.items()}, set(coords[a] for a in offers)
+        while len(q) > 0:
+            pos = q.popleft()
+            if goal_pred is not None and goal_pred(coords[pos]):
+                return result(coords[pos])
+            for a in neighbors[pos]:
+                if a not in offers and reach(a):
+                    q.append(a)
+                    offers[a] = pos
+        return result(None)
+
+    def dict_map_bfs(self, start, goal_pred, reach_pred):
+        """map_bfs for a map without dimensions"""
         q = collections.deque([start])
         finished = set([start])
         offers = {start: start}
@@ -285,8 +408,12 @@ class ConcreteMap(object):
 
     # Cannot set an item outside the bounds
     def __setitem__(self, key, value):
-        if self.dimensions is None or key.in_bounds(Coord(0, 0), self.dimensions):
+        if self.dimensions is None:
+            self.tiles[key] = value
+        elif key.in_bounds(Coord(0, 0), self.dimensions):
             self.tiles[key] = value
+            self.occupied[key] = True
+            self.fixed[key] = value.is_fixed
         else:
             assert False, "Index not in bounds: " + str(key)
 
@@ -305,6 +432,70 @@ class ConcreteMap(object):
     def values(self):
         return self.tiles.values()
 
+class ReachIndex(object):
+    """
+    The connected components of the tiles of a cmap with dimensions that can be stepped on
+    (see ConcreteMap.step_on), kept up to date as tiles are added with add.
+    Answers what map_bfs(start, None, reach_pred=cmap.step_on) would reach without searching.
+    """
+
+    def __init__(self, cmap):
+        self.width, self.height = cmap.dimensions
+        n = self.width * self.height
+        # Flat index (see grid_coords) -> the component it is in, or -1 if it can't be stepped on
+        self.labels = np.full(n, -1, dtype=int)
+        # Component -> the flat indices in it
+        self.members = {}
+        self.neighbors = grid_neighbors(cmap.dimensions)
+        flat = np.arange(n)
+        self.xs = flat % self.width
+        self.ys = flat // self.width
+        step = cmap.flat(cmap.occupied & ~cmap.fixed)
+        for i in range(n):
+            if step[i]:
+                self.add_index(i)
+
+    def add(self, pos):
+        """pos was added to the cmap as a tile that can be stepped on"""
+        self.add_index(pos.y * self.width + pos.x)
+
+    def add_index(self, i):
+        if self.labels[i] >= 0:
+            return
+        components = set(self.labels[a] for a in self.neighbors[i]) - {-1}
+        if len(components) == 0:
+            self.labels[i] = i
+            self.members[i] = [i]
+            return
+        # Relabel the smaller components into the largest one
+        largest = max(components, key=lambda c: len(self.members[c]))
+        for c in components:
+            if c != largest:
+                moved = self.members.pop(c)
+                self.labels[moved] = largest
+                self.members[largest].extend(moved)
+        self.labels[i] = largest
+        self.members[largest].append(i)
+
+    def reachable(self, start):
+        """Mask of the flat indices that map_bfs from start over step_on tiles reaches"""
+        s = start.y * self.width + start.x
+        if self.labels[s] >= 0:
+            components = [self.labels[s]]
+        else:
+            components = [self.labels[a] for a in self.neighbors[s] if self.labels[a] >= 0]
+        mask = np.isin(self.labels, components)
+        mask[s] = True
+        return mask
+
+    def closest(self, start, target):
+        """The reachable tile from start that is closest to target.
+        Ties go to the first in Coord order."""
+        d2 = (self.xs - target.x) ** 2 + (self.ys - target.y) ** 2
+        d2[~self.reachable(start)] = np.iinfo(d2.dtype).max
+        i = int(np.argmin(d2))
+        return Coord(int(self.xs[i]), int(self.ys[i]))
+
 #TODO
 def map_lsearch(start, goal, pred=lambda x: True, dist=euclidean):
     """special search that first finds failure states in moving from start to goal,
@@ -425,14 +616,16 @@ def merging_partition(space, targetn, maxsize, implicit_bboxes):
     that each room can occupy
     """
     # Initially, every room has only itself.
-    rooms = {p: set([p]) for p in space}
+    partition = RoomPartition(space, implicit_bboxes)
+    rooms = partition.rooms
     # The rooms on which forward progress can be made
+    # (Filled in the same order as checking every pair of rooms would)
+    order = {p: i for i, p in enumerate(rooms)}
     active_neighbors = collections.defaultdict(set)
-    for p1, ps1 in rooms.items():
-        for p2, ps2 in rooms.items():
-            if p1 != p2 and adjacent(ps1, ps2):
-                active_neighbors[p1].add(p2)
-                active_neighbors[p2].add(p1)
+    for p1 in rooms:
+        for p2 in sorted(partition.neighbors[p1], key=order.get):
+            active_neighbors[p1].add(p2)
+            active_neighbors[p2].add(p1)
     while len(rooms) > targetn:
         if len(active_neighbors) == 0:
             break
@@ -441,7 +634,7 @@ def merging_partition(space, targetn, maxsize, implicit_bboxes):
         # Pick a random of its neighbors
         n = random.choice(list(active_neighbors[r]))
         # Try to merge them
-        if not can_merge(r, n, rooms, maxsize, implicit_bboxes):
+        if not partition.can_merge(r, n, maxsize):
             # If the merge didn't work out, then remove the neighbor
             active_neighbors[r] -= set([n])
             # If that was the last neighbor, r is no longer active.
@@ -449,56 +642,102 @@ def merging_partition(space, targetn, maxsize, implicit_bboxes):
                 del active_neighbors[r]
             continue
         # They can be merged...
-        new_neighbors = (active_neighbors[r] | active_neighbors[n]) - set([r, n])
+        new_neighbors = (active_neighbors[r] | active_neighbors.get(n, set())) - set([r, n])
         # If the merged room has no active neighbors, it is no longer active
         if len(new_neighbors) == 0:
             del active_neighbors[r]
         else:
             active_neighbors[r] = new_neighbors
         #print(f"Merging {r} and {n}")
-        rooms[r] = rooms[r] | rooms[n]
-        active_neighbors = active_replace(active_neighbors, n, r)
-        del rooms[n]
+        # The merged room replaces n for the rooms that n was an active neighbor of,
+        # which are all rooms next to n
+        for k in partition.neighbors[n]:
+            if k != r and n in active_neighbors.get(k, ()):
+                active_neighbors[k] = (active_neighbors[k] - set([n])) | set([r])
+        active_neighbors.pop(n, None)
+        partition.merge(r, n)
     return rooms
 
-def can_merge(room1, room2, rooms, maxsize, implicit_bboxes):
-    """
-    Can tiles1 merge with tiles2 while respecting
-    the bounding boxes and size constraints?
+class RoomPartition(object):
     """
-    tiles1 = rooms[room1]
-    tiles2 = rooms[room2]
-    # Check that the new room won't have more than maxsize tiles
-    if len(tiles1) + len(tiles2) > maxsize:
-        return False
-    bbox = extent(tiles1 | tiles2)
-    # Check that the actual number of screens that need to be loaded
-    # for the new room won't exceed maxsize.
-    if bbox.area > maxsize:
-        return False
-    # Build the bounding box for each room
-    room_bboxes = {k: extent(v) for k, v in rooms.items()}
-    # Don't care about room1 and room2, since the merge will replace them
-    del room_bboxes[room1]
-    del room_bboxes[room2]
-    # Make sure that the bbox of the merged room does not overlap with
-    # any of the existing rooms
-    return not any(map(lambda b: bbox.intersects(b), list(room_bboxes.values()) + implicit_bboxes))
-
-def active_replace(active, tile1, tile2):
+    The rooms for merging_partition, keyed by one of their tiles.
+    Along with the tiles of each room, keeps its bounding box, the rooms next to it,
+    and grids of which room's bounding box covers each tile and which tiles are in
+    the implicit bounding boxes, so that checking a merge only looks at the tiles
+    inside the bounding box of the merged room.
     """
-    When two rooms merge, their adjacencies merge
-    When r1 and r2 merge into r1, go through and replace r2 in adjacencies with r1
-    Replace tile1 with tile2 in active
-    """
-    new_active = collections.defaultdict(set)
-    for k, v in active.items():
-        if k != tile1:
-            if tile1 in active[k]:
-                new_active[k] = (active[k] - set([tile1])) | set([tile2])
-            else:
-                new_active[k] = active[k]
-    return new_active
+
+    def __init__(self, space, implicit_bboxes):
+        self.rooms = {p: set([p]) for p in space}
+        # room -> (start x, start y, end x, end y), like a Rect
+        self.bboxes = {p: (p.x, p.y, p.x + 1, p.y + 1) for p in space}
+        # room -> the rooms that have a tile next to one of its tiles
+        self.neighbors = {p: set(n for n in p.neighbors() if n in self.rooms) for p in space}
+        if len(space) == 0:
+            return
+        bbox = extent(space)
+        self.origin = bbox.start
+        width, height = bbox.size_coord()
+        # Which room's bounding box covers each tile, or -1
+        self.ids = {p: i for i, p in enumerate(self.rooms)}
+        self.owner = np.full((width, height), -1, dtype=int)
+        for p, i in self.ids.items():
+            self.owner[p - self.origin] = i
+        # Which tiles are in an implicit bounding box. Rooms can't get bigger than
+        # the extent of space, so the rest of an implicit bounding box doesn't matter.
+        self.implicit = np.zeros((width, height), dtype=bool)
+        for b in implicit_bboxes:
+            x0, y0 = b.start - self.origin
+            x1, y1 = b.end - self.origin
+            self.implicit[max(x0, 0):max(x1, 0), max(y0, 0):max(y1, 0)] = True
+
+    def merged_bbox(self, room1, room2):
+        ax0, ay0, ax1, ay1 = self.bboxes[room1]
+        bx0, by0, bx1, by1 = self.bboxes[room2]
+        return min(ax0, bx0), min(ay0, by0), max(ax1, bx1), max(ay1, by1)
+
+    def bbox_slice(self, bbox):
+        x0, y0, x1, y1 = bbox
+        return slice(x0 - self.origin.x, x1 - self.origin.x), slice(y0 - self.origin.y, y1 - self.origin.y)
+
+    def can_merge(self, room1, room2, maxsize):
+        """
+        Can tiles1 merge with tiles2 while respecting
+        the bounding boxes and size constraints?
+        """
+        # Check that the new room won't have more than maxsize tiles
+        if len(self.rooms[room1]) + len(self.rooms[room2]) > maxsize:
+            return False
+        bbox = self.merged_bbox(room1, room2)
+        x0, y0, x1, y1 = bbox
+        # Check that the actual number of screens that need to be loaded
+        # for the new room won't exceed maxsize.
+        if (x1 - x0) * (y1 - y0) > maxsize:
+            return False
+        # Make sure that the bbox of the merged room does not overlap with
+        # any of the other rooms, or the implicit bounding boxes.
+        # The bounding boxes of the rooms never overlap, so any tile covered by
+        # another room's bounding box is covered by that room in owner.
+        area = self.bbox_slice(bbox)
+        if self.implicit[area].any():
+            return False
+        owners = self.owner[area]
+        return bool(((owners == -1) | (owners == self.ids[room1]) | (owners == self.ids[room2])).all())
+
+    def merge(self, room1, room2):
+        """Merge room2 into room1"""
+        self.rooms[room1] = self.rooms[room1] | self.rooms[room2]
+        del self.rooms[room2]
+        bbox = self.merged_bbox(room1, room2)
+        self.bboxes[room1] = bbox
+        del self.bboxes[room2]
+        self.owner[self.bbox_slice(bbox)] = self.ids[room1]
+        neighbors2 = self.neighbors.pop(room2)
+        for k in neighbors2:
+            if k != room1:
+                self.neighbors[k].discard(room2)
+                self.neighbors[k].add(room1)
+        self.neighbors[room1] = (self.neighbors[room1] | neighbors2) - set([room1, room2])
 
 def active_delete(active, tile):
     """
@@ -515,14 +754,3 @@ def extent(coords):
     maxx = max(coords, key=lambda item: item.x).x
     maxy = max(coords, key=lambda item: item.y).y
     return Rect(Coord(minx, miny), Coord(maxx, maxy) + Coord(1, 1))
-
-def adjacent(room1, room2):
-    """
-    Simple inefficient test for room ajdacency
-    Adjacent rooms can be merged.
-    """
-    for p1 in room1:
-        for p2 in room2:
-            if p1.adjacent(p2):
-                return True
-    return False
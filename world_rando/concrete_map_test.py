@@ -0,0 +1,98 @@
+# Checks ConcreteMap.compose and collides against composing the tile dicts directly,
+# for tiles of the other map that collide or land out of bounds, under each collision policy.
+# Run from the repository root with:
+# python -m world_rando.concrete_map_test
+import random
+
+import numpy as np
+
+from world_rando.concrete_map import ConcreteMap, MapTile
+from world_rando.coord import Coord
+
+def random_cmap(rand, dimensions, n_tiles, span=None):
+    """A map with tiles at random places in span (by default, in dimensions)"""
+    if span is None:
+        span = dimensions
+    cmap = ConcreteMap(dimensions)
+    for _ in range(n_tiles):
+        c = Coord(rand.randrange(span.x), rand.randrange(span.y))
+        if cmap.in_bounds(c):
+            cmap[c] = MapTile(_fixed=rand.random() < 0.3)
+        else:
+            cmap.tiles[c] = MapTile(_fixed=rand.random() < 0.3)
+    return cmap
+
+def dict_compose(cmap, other, offset, collision_policy):
+    """The tiles compose should give: tiles of other that are out of bounds or on a tile of cmap
+    are skipped by "defer", and make "none" give None and "error" fail"""
+    tiles = dict(cmap.tiles)
+    for c, t in other.items():
+        c_o = c + offset
+        if not cmap.in_bounds(c_o) or c_o in tiles:
+            if collision_policy == "defer":
+                continue
+            return collision_policy
+        tiles[c_o] = t
+    return tiles
+
+def check_grids(cmap):
+    """occupied and fixed match the tiles"""
+    occupied = np.zeros(tuple(cmap.dimensions), dtype=bool)
+    fixed = np.zeros(tuple(cmap.dimensions), dtype=bool)
+    for c, t in cmap.items():
+        occupied[c] = True
+        fixed[c] = t.is_fixed
+    assert (cmap.occupied == occupied).all()
+    assert (cmap.fixed == fixed).all()
+
+def check_compose(cmap, other, offset):
+    before = dict(cmap.tiles)
+    for collision_policy in ["none", "defer", "error"]:
+        expected = dict_compose(cmap, other, offset, collision_policy)
+        if expected == "error":
+            try:
+                cmap.compose(other, offset, collision_policy)
+                failed = False
+            except AssertionError:
+                failed = True
+            assert failed
+            continue
+        composed = cmap.compose(other, offset, collision_policy)
+        if expected == "none":
+            assert composed is None
+            assert cmap.collides(other, offset)
+            continue
+        assert composed.keys() == expected.keys()
+        # Every tile is a copy
+        assert all(composed[c] is not t for c, t in expected.items())
+        assert all(composed[c].is_fixed == t.is_fixed for c, t in expected.items())
+        check_grids(composed)
+        if collision_policy == "none":
+            assert not cmap.collides(other, offset)
+    # compose never changes the maps
+    assert cmap.tiles == before
+    check_grids(cmap)
+
+if __name__ == "__main__":
+    rand = random.Random(0)
+    dimensions = Coord(12, 8)
+    cmap = ConcreteMap(dimensions)
+    cmap[Coord(3, 3)] = MapTile()
+    other = ConcreteMap(Coord(2, 2))
+    other[Coord(0, 0)] = MapTile(_fixed=True)
+    other[Coord(1, 1)] = MapTile()
+    assert not cmap.collides(ConcreteMap(dimensions))
+    assert not cmap.collides(other)
+    assert cmap.collides(other, Coord(2, 2))
+    # Out of bounds on each side
+    for offset in [Coord(-1, 0), Coord(0, -1), Coord(11, 0), Coord(0, 7)]:
+        assert cmap.collides(other, offset), offset
+        assert cmap.compose(other, offset, "none") is None
+        assert cmap.compose(other, offset, "defer").keys() == {Coord(3, 3)} | {c + offset for c in other.keys() if cmap.in_bounds(c + offset)}
+
+    for _ in range(200):
+        cmap = random_cmap(rand, dimensions, rand.randint(0, 40))
+        # other's tiles can be anywhere, including outside of its own dimensions
+        other = random_cmap(rand, Coord(4, 4), rand.randint(0, 6), span=Coord(5, 5))
+        offset = Coord(rand.randint(-3, 12), rand.randint(-3, 8))
+        check_compose(cmap, other, offset)
@@ -0,0 +1,41 @@
+# Checks FixedMap.feasible against map_gen.can_place at every position,
+# for the fixed rooms and the elevators, on random maps.
+# Run from the repository root with:
+# python -m world_rando.feasible_test
+import random
+
+from world_rando import fixed_cmaps, map_gen
+from world_rando.concrete_map import ConcreteMap, MapTile
+from world_rando.coord import Coord
+
+fmaps = list(fixed_cmaps.fixed_maps.values()) + [
+    fixed_cmaps.elevator_up_room,
+    fixed_cmaps.elevator_down_room,
+    fixed_cmaps.save_point_l_room,
+    fixed_cmaps.item_room,
+]
+
+def random_cmap(rand, dimensions, n_tiles):
+    cmap = ConcreteMap(dimensions)
+    for _ in range(n_tiles):
+        c = Coord(rand.randrange(dimensions.x), rand.randrange(dimensions.y))
+        cmap[c] = MapTile(_fixed=rand.random() < 0.3)
+    return cmap
+
+def check_feasible(fmap, cmap):
+    feasible = fmap.feasible(cmap)
+    assert feasible.shape == tuple(cmap.dimensions)
+    for x in range(cmap.dimensions.x):
+        for y in range(cmap.dimensions.y):
+            p = Coord(x, y)
+            assert feasible[p] == map_gen.can_place(fmap, p, cmap), (p, fmap.extend)
+
+if __name__ == "__main__":
+    rand = random.Random(0)
+    for _ in range(30):
+        # Small maps too, so that the rooms and the elevator shafts run off the edges
+        dimensions = Coord(rand.randint(1, 20), rand.randint(1, 14))
+        n_tiles = rand.choice([0, 1, 3, rand.randint(0, dimensions.x * dimensions.y // 4)])
+        cmap = random_cmap(rand, dimensions, n_tiles)
+        for fmap in fmaps:
+            check_feasible(fmap, cmap)
@@ -1,5 +1,7 @@
 from functools import reduce
 
+import numpy as np
+
 from world_rando.coord import *
 from world_rando.concrete_map import *
 from world_rando.room_dtypes import Room, Door, RoomCopyConverter, DoorCopyConverter
@@ -151,17 +153,48 @@ class FixedMap(object):
         if self.extend is None:
             return self.real_cmap
         # For elevators, extend them downwards or upwards with blank fixed tiles
+        # (in a copy, so that the shafts for other positions don't pile up in real_cmap)
         elif self.extend > 0:
-            c2 = ConcreteMap(None, _tiles=self.real_cmap.tiles)
+            c2 = ConcreteMap(None, _tiles=dict(self.real_cmap.tiles))
             for i in range(self.extend, dims.y - pos.y):
                 c2[Coord(0, i)] = MapTile(TileType.elevator_shaft,_fixed=True)
             return c2
         elif self.extend <= 0:
-            c2 = ConcreteMap(None, _tiles=self.real_cmap.tiles)
+            c2 = ConcreteMap(None, _tiles=dict(self.real_cmap.tiles))
             for i in range(-pos.y, self.extend):
                 c2[Coord(0, i)] = MapTile(TileType.elevator_shaft,_fixed=True)
             return c2
 
+    def feasible(self, cmap):
+        """[x, y] grid of the positions in cmap where the cmap for that position can be
+        composed with cmap without a collision. The same as map_gen.can_place for every
+        position at once: each tile of the footprint rules out the positions that would
+        put it on an occupied tile or out of bounds."""
+        width, height = cmap.dimensions
+        offsets = np.array(list(self.real_cmap.keys()), dtype=int).reshape(-1, 2)
+        pad = int(np.abs(offsets).max()) if len(offsets) > 0 else 0
+        # Out of bounds counts as occupied
+        padded = np.ones((width + 2 * pad, height + 2 * pad), dtype=bool)
+        padded[pad:pad + width, pad:pad + height] = cmap.occupied
+        blocked = np.zeros((width, height), dtype=bool)
+        for dx, dy in offsets:
+            blocked |= padded[pad + dx:pad + dx + width, pad + dy:pad + dy + height]
+        if self.extend is not None:
+            # The shaft fills the column from extend to the edge of the map
+            occupied = cmap.occupied.astype(int)
+            rows = np.arange(height) + self.extend
+            if self.extend > 0:
+                # below[x, r] - how many tiles are at or below row r
+                below = np.zeros((width, height + 1), dtype=int)
+                below[:, :height] = np.cumsum(occupied[:, ::-1], axis=1)[:, ::-1]
+                blocked |= below[:, np.minimum(rows, height)] > 0
+            else:
+                # above[x, r] - how many tiles are above row r
+                above = np.zeros((width, height + 1), dtype=int)
+                above[:, 1:] = np.cumsum(occupied, axis=1)
+                blocked |= above[:, np.maximum(rows, 0)] > 0
+        return ~blocked
+
 # Kraid
 kraid_tiles = [
         (Coord(1,0), MapTile(_fixed=True,_walls=set([Coord(-1,0),Coord(0,1)]))),
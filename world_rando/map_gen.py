@@ -1,53 +1,63 @@
 import random
 from typing import Dict, Set, Tuple
 
+import numpy as np
+
 from world_rando.coord import Coord, Rect
-from world_rando.concrete_map import Path, ConcreteMap, MapTile, get_path, euclidean, path_concat
+from world_rando.concrete_map import Path, ConcreteMap, MapTile, ReachIndex, get_path, euclidean, path_concat
 from world_rando import fixed_cmaps
 from world_rando import map_viz
 from world_rando.item_order_graph import NodeType
 
 #TODO: Bounds checking on the results of the spring model
-#TODO: A way to keep the model going until the average absolute spring force falls below a threshold?
 #TODO: This can break the way elevators are chosen...
-#TODO: damping!
-def spring_model(node_locs, graph, n_iterations, spring_constant, spring_equilibrium, dt, damping):
+def spring_model(node_locs, graph, n_iterations, spring_constant, spring_equilibrium, dt, damping,
+                 tolerance=0, repulsion=0):
     """Changes node placement based on a simple spring model.
-    Node locs is the dictionary of initial node placements and is edited by the function.
+    Node locs is the dictionary of initial node placements.
     graph is the graph of how the  nodes are connected to each other
         (i.e. where to place springs).
-    n_iterations is how many time steps to run the model for.
+    n_iterations is the most time steps to run the model for.
         A few should suffice for my purposes.
     spring_constant is the k in -kx.
     spring_equilibrium is the distance where the spring is at rest.
     dt is the time step.
+    damping is the c in -cv, which slows the nodes down.
+    The model stops early once the average force on a node is below tolerance.
+    repulsion pushes every pair of nodes apart with a force of repulsion / distance^2.
     Returns a lower potential-energy node_locs."""
-    # node locs is node_name -> node_position
-    # node_name -> node_velocity
-    # using mcoords as a vector
-    node_v = {n : Coord(0, 0) for n in node_locs}
-    # node_name -> node_acceleration
-    node_a = {n : Coord(0, 0) for n in node_locs}
-    iteration = 0
-    while iteration < n_iterations:
-        for n in node_locs:
-            # Update node_v
-            for e in graph.nodes[n].edges:
-                t = e.terminal
-                # The amount of stretching, possibly negative
-                x = euclidean(node_locs[n], node_locs[t]) - spring_equilibrium
-                # Direction
-                n_to_t = (node_locs[t] - node_locs[n]).to_unit()
-                #-kx
-                node_v[n] = node_v[n] + n_to_t.scale(spring_constant * x * dt)
-                node_v[t] = node_v[t] + n_to_t.scale(-spring_constant * x * dt)
-            # update node_locs
-            node_locs[n] = node_locs[n] + node_v[n].scale(dt)
-        iteration = iteration + 1
+    nodes = list(node_locs.keys())
+    index = {n: i for i, n in enumerate(nodes)}
+    # One spring for each edge, from src to dst
+    edges = [(index[n], index[e.terminal]) for n in nodes for e in graph.nodes[n].edges]
+    src = np.array([e[0] for e in edges], dtype=int)
+    dst = np.array([e[1] for e in edges], dtype=int)
+    pos = np.array([node_locs[n] for n in nodes], dtype=float).reshape(-1, 2)
+    vel = np.zeros_like(pos)
+    for _ in range(n_iterations):
+        force = np.zeros_like(pos)
+        if len(edges) > 0:
+            diff = pos[dst] - pos[src]
+            length = np.linalg.norm(diff, axis=1)
+            # Nodes on top of each other don't know which way to go
+            unit = np.divide(diff, length[:, None], out=np.zeros_like(diff), where=length[:, None] > 0)
+            # -kx, pulling the ends of a stretched spring together
+            f = unit * (spring_constant * (length - spring_equilibrium))[:, None]
+            np.add.at(force, src, f)
+            np.add.at(force, dst, -f)
+        if repulsion > 0:
+            # Every pair, which is fine for the few hundred nodes of a region graph
+            diff = pos[:, None, :] - pos[None, :, :]
+            d2 = (diff ** 2).sum(axis=2)
+            np.fill_diagonal(d2, np.inf)
+            d2 = np.maximum(d2, 1e-2)
+            force += repulsion * (diff / (d2 * np.sqrt(d2))[:, :, None]).sum(axis=1)
+        vel += (force - damping * vel) * dt
+        pos += vel * dt
+        if len(pos) == 0 or np.linalg.norm(force, axis=1).mean() < tolerance:
+            break
     # resolve to an int
-    # TODO: is there a dict map function?
-    node_locs = {n: node_locs[n].resolve_int() for n in node_locs}
-    return node_locs
+    return {n: Coord(int(x), int(y)) for n, (x, y) in zip(nodes, pos)}
 
 #TODO: generalize this?
 # take in node placement 'strategy'
@@ -80,6 +90,8 @@ def map_gen(dimensions, graph, settings):
     #TODO: can get unlucky with elevator placement of multiple elevators
     #   See output/error.png
     paths: List[Path] = []
+    # What can be reached from where, updated as paths are added
+    reach = ReachIndex(cmap)
     for node in rnodes:
         for edge in graph.nodes[node].edges:
             # Special case - edges from MB start from the escape point!
@@ -89,14 +101,11 @@ def map_gen(dimensions, graph, settings):
                 start_point = node_locs[node]
             end_point = node_locs[edge.terminal]
             # path from n1 to n2
-            # first, find all nodes reachable from n1 that are already placed
-            _, o, f = cmap.map_bfs(start_point, None, reach_pred=cmap.step_on)
-            # find the closest.
-            dists = [(p, euclidean(p, node_locs[edge.terminal])) for p in list(f)]
-            dists = sorted(dists, key=lambda n: n[1])
+            # first, find the closest of the nodes reachable from n1 that are already placed
             #TODO: probability distribution over dists?
-            closest, _ = dists[0]
+            closest = reach.closest(start_point, end_point)
             # Find the path to closest
+            _, o, _ = cmap.map_bfs(start_point, lambda p: p == closest, reach_pred=cmap.step_on)
             to_closest = get_path(o, start_point, closest)
             # Make a new path to that item from the closest reachable point
             offers, _ = cmap.map_search(closest, end_point,
@@ -108,6 +117,7 @@ def map_gen(dimensions, graph, settings):
                 for xy in to_end:
                     if xy not in cmap:
                         cmap[xy] = MapTile()
+                        reach.add(xy)
             else:
                 assert False, "Cannot find path: " + str(closest) + ", " + str(node_locs[edge.terminal])
             path = path_concat(to_closest, to_end)
@@ -172,7 +182,10 @@ def find_placement(initial, cmap, graph):
     bboxes = []
     for node, init_pos in initial.items():
         node_fmap = fixed_cmaps.node_to_fixedmap(node, graph.nodes[node].data)
-        g, _, _ = cmap.map_bfs(init_pos, lambda p: can_place(node_fmap, p, cmap))
+        # Where can_place would be true, for every position at once
+        feasible = node_fmap.feasible(cmap)
+        # The first of those in BFS order from init_pos
+        g, _, _ = cmap.map_bfs(init_pos, lambda p: feasible[p])
         assert g is not None, "No valid place found."
         final_node_locs[node] = g
         # Actually place it into the map
@@ -196,7 +209,9 @@ def node_place(graph, dimensions, up_es, down_es, settings):
                           settings["spring_constant"],
                           settings["equilibrium"],
                           settings["spring_dt"],
-                          settings["spring_damping"])
+                          settings["spring_damping"],
+                          settings["spring_tolerance"],
+                          settings["spring_repulsion"])
     trunc_spring = {n : xy.truncate(Coord(0, 0), dimensions) for (n, xy) in spring.items()}
     # Now do a search for a good placement for each nod.
     cmap = ConcreteMap(dimensions)
@@ -0,0 +1,66 @@
+# Checks that merging_partition gives rooms that keep its invariants, on random spaces with
+# implicit bounding boxes: the rooms split the space, their bounding boxes don't overlap each
+# other or the implicit ones, and no room has more than maxsize tiles or bounding box area.
+# Run from the repository root with:
+# python -m world_rando.merging_partition_test
+import random
+
+from world_rando.concrete_map import merging_partition, extent
+from world_rando.coord import Coord, Rect
+
+def random_space(rand, dimensions, density):
+    return set(c for c in Rect(Coord(0, 0), dimensions) if rand.random() < density)
+
+def random_bbox(rand, dimensions):
+    start = Coord(rand.randrange(dimensions.x), rand.randrange(dimensions.y))
+    return Rect(start, start + Coord(rand.randint(1, 4), rand.randint(1, 4)))
+
+def area(rect):
+    size = rect.end - rect.start
+    return size.x * size.y
+
+def connected(room):
+    start = next(iter(room))
+    seen = {start}
+    stack = [start]
+    while len(stack) > 0:
+        for n in stack.pop().neighbors():
+            if n in room and n not in seen:
+                seen.add(n)
+                stack.append(n)
+    return seen == room
+
+def check_partition(space, targetn, maxsize, implicit_bboxes):
+    rooms = merging_partition(space, targetn, maxsize, implicit_bboxes)
+    # Every tile of space is in exactly one room, which is keyed by one of its tiles
+    assert sum(len(room) for room in rooms.values()) == len(space)
+    assert set().union(*rooms.values()) == space
+    assert all(p in room for p, room in rooms.items())
+    bboxes = {p: extent(room) for p, room in rooms.items()}
+    for p, room in rooms.items():
+        assert connected(room)
+        assert len(room) <= maxsize
+        assert area(bboxes[p]) <= maxsize
+        # Single tiles can be inside an implicit bounding box, but they never merge with anything
+        if len(room) > 1:
+            assert not any(bboxes[p].intersects(b) for b in implicit_bboxes), p
+        for q in rooms:
+            if q != p:
+                assert not bboxes[p].intersects(bboxes[q]), (p, q)
+    return rooms
+
+if __name__ == "__main__":
+    rand = random.Random(0)
+    random.seed(0)
+    assert merging_partition(set(), 1, 24, []) == {}
+    # A 2x3 block merges into one room, unless an implicit bounding box is in the way
+    block = Rect(Coord(0, 0), Coord(2, 3)).as_set()
+    assert list(check_partition(block, 1, 6, []).values()) == [block]
+    assert len(check_partition(block, 1, 5, [])) > 1
+    assert len(check_partition(block, 1, 6, [Rect(Coord(1, 1), Coord(2, 2))])) > 1
+    for _ in range(100):
+        dimensions = Coord(rand.randint(1, 30), rand.randint(1, 20))
+        space = random_space(rand, dimensions, rand.choice([0.5, 0.8, 1]))
+        implicit_bboxes = [random_bbox(rand, dimensions) for _ in range(rand.randint(0, 6))]
+        targetn = rand.choice([1, rand.randint(1, max(len(space), 1))])
+        check_partition(space, targetn, rand.choice([2, 6, 24]), implicit_bboxes)
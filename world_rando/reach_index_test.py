@@ -0,0 +1,57 @@
+# Checks ReachIndex against flooding the map with map_bfs over step_on tiles,
+# on random maps with fixed tiles, as tiles are added one at a time.
+# Run from the repository root with:
+# python -m world_rando.reach_index_test
+import random
+
+from world_rando.concrete_map import ConcreteMap, MapTile, ReachIndex, grid_coords
+from world_rando.coord import Coord
+
+def random_coord(rand, dimensions):
+    return Coord(rand.randrange(dimensions.x), rand.randrange(dimensions.y))
+
+def check_query(cmap, reach, start, target):
+    _, _, reached = cmap.map_bfs(start, None, reach_pred=cmap.step_on)
+    coords = grid_coords(cmap.dimensions)
+    mask = reach.reachable(start)
+    assert set(c for i, c in enumerate(coords) if mask[i]) == reached
+    # The closest of the reached tiles, the first in flat index order on a tie
+    d2 = {c: (c.x - target.x) ** 2 + (c.y - target.y) ** 2 for c in reached}
+    best = min(d2.values())
+    expected = next(c for c in coords if c in reached and d2[c] == best)
+    assert reach.closest(start, target) == expected, (start, target)
+
+def run_map(rand, dimensions, n_steps):
+    cmap = ConcreteMap(dimensions)
+    for _ in range(rand.randint(0, 60)):
+        cmap[random_coord(rand, dimensions)] = MapTile(_fixed=rand.random() < 0.3)
+    reach = ReachIndex(cmap)
+    for _ in range(n_steps):
+        pos = random_coord(rand, dimensions)
+        if pos not in cmap:
+            cmap[pos] = MapTile()
+            reach.add(pos)
+        # Starts can be on fixed tiles or empty space, like the node locations in map_gen
+        for _ in range(3):
+            check_query(cmap, reach, random_coord(rand, dimensions), random_coord(rand, dimensions))
+
+if __name__ == "__main__":
+    rand = random.Random(0)
+    # Two components that a fixed tile keeps apart
+    cmap = ConcreteMap(Coord(5, 1))
+    cmap[Coord(0, 0)] = MapTile()
+    cmap[Coord(2, 0)] = MapTile(_fixed=True)
+    cmap[Coord(4, 0)] = MapTile()
+    reach = ReachIndex(cmap)
+    assert reach.closest(Coord(0, 0), Coord(4, 0)) == Coord(0, 0)
+    for x in [1, 3]:
+        cmap[Coord(x, 0)] = MapTile()
+        reach.add(Coord(x, 0))
+    # The fixed tile still splits the row
+    assert reach.closest(Coord(0, 0), Coord(4, 0)) == Coord(1, 0)
+    # But from the fixed tile, the components on both sides are reached
+    assert reach.closest(Coord(2, 0), Coord(4, 0)) == Coord(4, 0)
+    check_query(cmap, reach, Coord(2, 0), Coord(0, 0))
+    for _ in range(40):
+        dimensions = Coord(rand.randint(1, 24), rand.randint(1, 16))
+        run_map(rand, dimensions, 60)
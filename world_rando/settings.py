@@ -106,6 +106,10 @@ concrete_map_settings_d = {
     "equilibrium"       :   3,
     "spring_dt"         :   0.1, # map_gen.node_place
     "spring_damping"    :   0.9,
+    # Stop early once the average force on a node is below this
+    "spring_tolerance"  :   0.05,
+    # How hard nodes push each other apart (0 for none)
+    "spring_repulsion"  :   0,
     # Region-specific map size restrictions
     # At most 64,32, but leave some space for elevators
     "region_sizes"      :   {"Wrecked_Ship" : Coord(54, 30),
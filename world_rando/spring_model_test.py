@@ -0,0 +1,55 @@
+# Checks map_gen.spring_model on small graphs: a spring settles near its equilibrium,
+# nodes on top of each other don't break it, and tolerance stops it early.
+# Run from the repository root with:
+# python -m world_rando.spring_model_test
+import math
+
+from data_types.basicgraph import BasicGraph
+from world_rando.coord import Coord
+from world_rando.map_gen import spring_model
+
+def mk_graph(nodes, edges):
+    graph = BasicGraph()
+    for n in nodes:
+        graph.add_node(n)
+    for n1, n2 in edges:
+        graph.add_edge(n1, n2)
+    return graph
+
+def distance(c1, c2):
+    return math.hypot(c1.x - c2.x, c1.y - c2.y)
+
+if __name__ == "__main__":
+    pair = mk_graph(["a", "b"], [("a", "b")])
+    # A stretched spring and a squashed one both settle near equilibrium
+    for b in [Coord(60, 34), Coord(22, 21)]:
+        locs = spring_model({"a": Coord(20, 20), "b": b}, pair, 500, 2, 10, 0.1, 0.9)
+        assert abs(distance(locs["a"], locs["b"]) - 10) <= 1.5, locs
+    # With repulsion, the pair settles a bit further apart than equilibrium
+    locs = spring_model({"a": Coord(20, 20), "b": Coord(60, 20)}, pair, 500, 2, 10, 0.1, 0.9, repulsion=100)
+    assert 10 <= distance(locs["a"], locs["b"]) <= 13, locs
+
+    # Nodes on top of each other, joined by a spring or not
+    triple = mk_graph(["a", "b", "c"], [("a", "b"), ("b", "c")])
+    start = {"a": Coord(20, 20), "b": Coord(20, 20), "c": Coord(20, 20)}
+    for repulsion in [0, 5]:
+        # int() of a NaN position would raise
+        locs = spring_model(start, triple, 100, 2, 3, 0.1, 0.9, repulsion=repulsion)
+        assert all(isinstance(c, Coord) for c in locs.values())
+        if repulsion == 0:
+            assert locs == start
+    start = {"a": Coord(20, 20), "b": Coord(20, 20), "c": Coord(35, 20)}
+    locs = spring_model(start, triple, 100, 2, 3, 0.1, 0.9, repulsion=5)
+    assert all(isinstance(c, Coord) for c in locs.values())
+
+    # With a tolerance that the first step already meets, the model stops after one step,
+    # so more iterations give the same result
+    start = {"a": Coord(20, 20), "b": Coord(60, 34)}
+    one_step = spring_model(start, pair, 1, 2, 10, 0.1, 0.9)
+    assert one_step != spring_model(start, pair, 500, 2, 10, 0.1, 0.9)
+    assert spring_model(start, pair, 500, 2, 10, 0.1, 0.9, tolerance=1000) == one_step
+    # A settled spring stops long before n_iterations
+    settled = spring_model(start, pair, 10 ** 7, 2, 10, 0.1, 0.9, tolerance=0.05)
+    assert abs(distance(settled["a"], settled["b"]) - 10) <= 1.5, settled
+    # No graph at all
+    assert spring_model({}, pair, 10, 2, 10, 0.1, 0.9) == {}